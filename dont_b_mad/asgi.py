@@ -1,5 +1,10 @@
 """
 ASGI config for dont_b_mad project.
+
+Live game updates (Server-Sent Events) are only streamed when served
+through this entry point, e.g. `uvicorn dont_b_mad.asgi:application`.
+The streams are served by game.live on the event loop, without Django's
+middleware, so an open stream ties up no thread.
 """
 
 import os
@@ -8,5 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dont_b_mad.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imports models, so only after get_asgi_application() has set Django up
+from game.live import with_live_events  # noqa: E402
+
+application = with_live_events(django_application)
 
@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'game.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,9 +71,25 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Second shard of the shard tests (game/tests.py), never listed in
+    # GAME_SHARDS; kept in memory so that it leaves no file behind
+    'shard_test': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
 }
 
+# Game shards (game/shards.py): games with their players, pieces and journal
+# are spread over these database aliases by game id, so turns of different
+# games write to different files. To add a shard, define it above, e.g.
+#     'games_1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'games_1.sqlite3'},
+# list it here, then run "python manage.py migrate --database games_1" and
+# "python manage.py rebalance_shards" with the app servers stopped.
+GAME_SHARDS = ['default']
+
+DATABASE_ROUTERS = ['game.shards.GameShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -116,3 +133,29 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+
+# Hot game cache (game/cache.py): active games are kept in process memory and
+# piece rows are written behind in batches. Set ENABLED to False to write
+# every turn's pieces synchronously.
+GAME_STATE_CACHE = {
+    'ENABLED': True,
+    'MAX_GAMES': 1000,                  # Games kept per process (LRU)
+    'MAX_BYTES': 32 * 1024 * 1024,      # Memory bound for cached games
+    'TTL_SECONDS': 15 * 60,             # Idle games are dropped after this
+    'FLUSH_INTERVAL_SECONDS': 1.0,      # Write-behind delay for piece rows
+    'FLUSH_BATCH_SIZE': 200,            # Games written per flush transaction
+}
+
+# How new games store their pieces: 'rows' (one Piece row per piece) or
+# 'packed' (the whole board in one binary field on Game, no Piece rows).
+# Existing games are packed by migrate (migration 0013) when this is 'packed';
+# after changing it, convert them with: python manage.py convert_board_storage
+GAME_BOARD_STORAGE = 'rows'
+
+# Request metrics (game/metrics.py): per-view latency, query counts and
+# response sizes served at /metrics in the Prometheus text format. When
+# disabled the middleware unloads itself and costs nothing.
+GAME_METRICS = {
+    'ENABLED': False,
+    'TOKEN': None,                      # Require "Authorization: Bearer <token>" to scrape
+}
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Game, Player, Piece
+from .models import Game, Player, Piece, GameEvent, JournalCheckpoint
 
 
 @admin.register(Game)
@@ -10,8 +10,8 @@ class GameAdmin(admin.ModelAdmin):
 
 @admin.register(Player)
 class PlayerAdmin(admin.ModelAdmin):
-    list_display = ['id', 'name', 'color', 'game', 'order']
-    list_filter = ['color', 'game']
+    list_display = ['id', 'name', 'color', 'game', 'order', 'is_bot']
+    list_filter = ['color', 'is_bot', 'game']
 
 
 @admin.register(Piece)
@@ -19,3 +19,29 @@ class PieceAdmin(admin.ModelAdmin):
     list_display = ['id', 'player', 'piece_number', 'position', 'in_home']
     list_filter = ['player', 'in_home']
 
+
+class JournalAdmin(admin.ModelAdmin):
+    """Read-only admin for the append-only move journal (see game.journal)"""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(GameEvent)
+class GameEventAdmin(JournalAdmin):
+    list_display = ['id', 'game', 'version', 'kind', 'seat', 'dice_value', 'piece', 'created_at']
+    list_filter = ['kind', 'game']
+    readonly_fields = ['game', 'version', 'kind', 'seat', 'dice_value', 'piece', 'captured', 'created_at']
+
+
+@admin.register(JournalCheckpoint)
+class JournalCheckpointAdmin(JournalAdmin):
+    list_display = ['id', 'game', 'version', 'status', 'current_player_index']
+    list_filter = ['game']
+    readonly_fields = ['game', 'version', 'status', 'current_player_index', 'dice_value', 'progress']
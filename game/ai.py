@@ -0,0 +1,211 @@
+"""
+Computer Player Module
+======================
+
+Picks moves for bot players with an expectimax search over the dice.
+
+How it works:
+    - Decision nodes: the player to move picks the piece that maximizes its
+      own score (max-n, so every seat plays for itself)
+    - Chance nodes: the six dice values are averaged; a roll without a legal
+      move rolls again while rules.BoardState.rolls_allowed() leaves tries,
+      then passes the turn (as game.turns plays it)
+    - The search runs on rules.BoardState, so no database access happens
+      while thinking
+
+Features:
+    - Iterative deepening that stops at a per-move time budget and keeps the
+      best move of the deepest completed search
+    - Transposition table of chance-node values with LRU eviction, shared by
+      all searches of the process
+    - Depth 1 always completes, so a move is returned even with a tiny budget
+
+Example:
+    >>> from game import ai, rules
+    >>> board = rules.BoardState(dice=6)
+    >>> ai.choose_move(board)
+    0
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from . import rules
+
+
+# Search limits: think at most this long per move, and never deeper than this
+DEFAULT_TIME_BUDGET = 0.05
+MAX_DEPTH = 8
+
+# Chance-node values kept in the transposition table before the least
+# recently used ones are evicted
+TABLE_SIZE = 100_000
+
+# Evaluation weights
+HOME_BONUS = 20
+WIN_SCORE = 10_000
+
+DICE_VALUES = range(1, rules.ENTER_ROLL + 1)
+
+
+class SearchTimeout(Exception):
+    """The time budget ran out in the middle of a search"""
+
+
+class TranspositionTable:
+    """Bounded, thread-safe map of search positions to values with LRU eviction"""
+
+    def __init__(self, size=TABLE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, depth):
+        """Get a value searched at least depth plies deep, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < depth:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, depth, value):
+        """Store a value, evicting the least recently used entries when full"""
+        with self._lock:
+            self._entries[key] = (depth, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+
+
+transposition_table = TranspositionTable()
+
+
+def evaluate(board):
+    """Heuristic score of every seat: progress of its pieces, with a bonus for pieces in home"""
+    scores = []
+    progress = board.progress
+    for seat in range(board.seats):
+        first = seat * rules.PIECES_PER_PLAYER
+        score = 0
+        for value in progress[first:first + rules.PIECES_PER_PLAYER]:
+            if value >= rules.TRACK_LENGTH:
+                score += value + 1 + HOME_BONUS
+            elif value >= 0:
+                score += value + 1
+        scores.append(score)
+    return tuple(scores)
+
+
+def _won(board, seat):
+    """Terminal scores when a seat has won"""
+    return tuple(WIN_SCORE if other == seat else 0 for other in range(board.seats))
+
+
+class _Search:
+    """One expectimax search with a deadline"""
+
+    def __init__(self, deadline, table):
+        self.deadline = deadline
+        self.table = table
+
+    def after_move(self, board, seat, depth):
+        """Value of a board on which seat just moved (dice still set)"""
+        if board.has_won(seat):
+            return _won(board, seat)
+        board.end_turn()
+        return self.chance(board, depth - 1)
+
+    def chance(self, board, depth, tries=0):
+        """Average value over the next dice roll (tries: rolls without a move so far this turn)"""
+        if depth <= 0:
+            return evaluate(board)
+        key = (board.progress.tobytes(), board.turn, tries)
+        value = self.table.get(key, depth)
+        if value is not None:
+            return value
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        totals = [0.0] * board.seats
+        for dice_value in DICE_VALUES:
+            child = board.copy()
+            child.dice = dice_value
+            for seat, score in enumerate(self.decision(child, depth, tries)):
+                totals[seat] += score
+        value = tuple(total / len(DICE_VALUES) for total in totals)
+        self.table.put(key, depth, value)
+        return value
+
+    def decision(self, board, depth, tries=0):
+        """Value of the best move of the player to move with the rolled dice"""
+        seat = board.turn
+        moves = board.movable_pieces()
+        if not moves:
+            # No legal move: roll again while tries are left, otherwise the turn passes (even on a 6)
+            tries += 1
+            if tries < board.rolls_allowed(seat):
+                board.dice = 0
+                return self.chance(board, depth, tries)
+            board.turn = (board.turn + 1) % board.seats
+            board.dice = 0
+            return self.chance(board, depth - 1)
+
+        best = None
+        for piece in moves:
+            child = board.copy()
+            child.move(piece)
+            value = self.after_move(child, seat, depth)
+            if best is None or value[seat] > best[seat]:
+                best = value
+        return best
+
+    def best_move(self, board, moves, depth):
+        """Best piece at the root for a fixed depth"""
+        seat = board.turn
+        best_piece, best_value = None, None
+        for piece in moves:
+            child = board.copy()
+            child.move(piece)
+            value = self.after_move(child, seat, depth)
+            if best_value is None or value[seat] > best_value[seat]:
+                best_piece, best_value = piece, value
+        return best_piece
+
+
+def choose_move(board, time_budget=DEFAULT_TIME_BUDGET, max_depth=MAX_DEPTH, table=None):
+    """
+    Choose the piece to move for the player to move on board.
+
+    Args:
+        board: rules.BoardState with turn and dice set
+        time_budget: Seconds the search may take
+        max_depth: Deepest search, in moves
+        table: TranspositionTable, defaults to the shared process-wide table
+
+    Returns:
+        Index of the piece to move, or None if no piece can move
+    """
+    moves = board.movable_pieces()
+    if len(moves) <= 1:
+        return moves[0] if moves else None
+
+    search = _Search(time.perf_counter() + time_budget, transposition_table if table is None else table)
+    best = search.best_move(board, moves, 1)
+    for depth in range(2, max_depth + 1):
+        try:
+            best = search.best_move(board, moves, depth)
+        except SearchTimeout:
+            break
+    return best
@@ -0,0 +1,645 @@
+"""
+Endpoint Benchmark Module
+=========================
+
+Plays real games through the Django test client, the way the browser does,
+and measures every request.
+
+How it works:
+    - Every table is a thread with its own test client and database
+      connection. It plays full games one after another: create, then roll
+      (the turn endpoint, which passes on the server when no piece can
+      move) and move until the game is over, polling the state after every
+      move and reloading the board page every few moves
+    - Roll games play the same way through the roll endpoint (roll_dice)
+      that API clients still use, so it keeps its own query budget
+    - Bot games seat one scripted player against computer players, so their
+      move requests include the bot turns played server-side; they are
+      reported under separate labels (e.g. move_piece[bots])
+    - Every request records its latency and the SQL queries it ran on its
+      own connection (the write-behind flusher is not counted)
+    - run_spectators() calls the ASGI and the WSGI application with many
+      concurrent spectators of one game and compares throughput, latency,
+      live event streams held open and threads used
+
+Results are plain dicts that serialize to JSON, so runs on two branches can
+be diffed; check() compares a run against query budgets and, optionally,
+against a baseline run.
+
+The benchmarks create and delete games, so they refuse to run against
+databases that may hold live data: DEBUG must be on, or every database the
+games use must be a test database (check_database()).
+
+Example:
+    >>> from game import benchmark
+    >>> results = benchmark.run(tables=4, bot_games=1, seed=1)
+    >>> benchmark.check(results)
+    []
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import asyncio
+import io
+import math
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import django
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, reset_queries
+from django.db.backends.base.creation import TEST_DATABASE_PREFIX
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from . import cache, live, shards, turns
+from .models import Game
+from .snapshot import board_storage
+
+
+# Most SQL queries a single request may run with the default settings
+# (game cache on, row storage), counting BEGIN and COMMIT. A roll or board
+# load may miss the cache and load the whole game.
+QUERY_BUDGETS = {
+    'create_game': 6,
+    'play_turn': 8,
+    'roll_dice': 8,
+    'move_piece': 7,
+    'get_game_state': 2,
+    'game_board': 4,
+}
+
+# Queries of one computer turn: its move (or pass) commit with the home
+# counter update and a checkpoint
+BOT_TURN_QUERIES = 6
+
+# Bot games may play up to turns.MAX_BOT_TURNS computer turns per request
+QUERY_BUDGETS.update({f'{label}[bots]': budget for label, budget in QUERY_BUDGETS.items()})
+for _label in ('create_game[bots]', 'play_turn[bots]', 'move_piece[bots]'):
+    QUERY_BUDGETS[_label] += BOT_TURN_QUERIES * turns.MAX_BOT_TURNS
+
+# A p95 latency above the baseline's by more than the tolerance (and by more
+# than the noise floor) is a regression
+DEFAULT_LATENCY_TOLERANCE = 0.25
+LATENCY_NOISE_MS = 1.0
+
+# Requests one game may take before the table gives up on it
+DEFAULT_MAX_REQUESTS = 5_000
+
+# Reload the board page after this many moves of a table
+DEFAULT_BOARD_EVERY = 25
+
+# Spectator run: spectators watching one game, state polls each, and the
+# threads of the WSGI comparison (e.g. gunicorn --workers 2 --threads 4)
+DEFAULT_SPECTATORS = 1000
+DEFAULT_POLLS = 5
+DEFAULT_WSGI_THREADS = 8
+
+
+class UnsafeDatabaseError(Exception):
+    """The benchmark would write to a database that may hold live games"""
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values (0 for no values)"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class EndpointStats:
+    """Latencies and query counts of the requests to one endpoint"""
+
+    def __init__(self):
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+
+    def add(self, seconds, queries, ok=True):
+        """Record one request"""
+        self.latencies.append(seconds)
+        self.queries.append(queries)
+        if not ok:
+            self.errors += 1
+
+    def merge(self, other):
+        """Add the requests recorded by another instance"""
+        self.latencies.extend(other.latencies)
+        self.queries.extend(other.queries)
+        self.errors += other.errors
+
+    def summary(self, wall_seconds):
+        """Percentiles in milliseconds, throughput and query counts"""
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'requests': count,
+            'errors': self.errors,
+            'requests_per_second': round(count / wall_seconds, 1) if wall_seconds else None,
+            'mean_ms': round(1000 * sum(latencies) / count, 3) if count else 0.0,
+            'p50_ms': round(1000 * percentile(latencies, 0.50), 3),
+            'p95_ms': round(1000 * percentile(latencies, 0.95), 3),
+            'p99_ms': round(1000 * percentile(latencies, 0.99), 3),
+            'max_ms': round(1000 * latencies[-1], 3) if count else 0.0,
+            'queries_mean': round(sum(self.queries) / count, 2) if count else 0.0,
+            'queries_max': max(self.queries, default=0),
+        }
+
+
+# =============================================================================
+# TABLES
+# =============================================================================
+
+class Table:
+    """One simulated table: a test client playing games one after another"""
+
+    def __init__(self, seed, games=1, bot_games=0, board_every=DEFAULT_BOARD_EVERY,
+                 max_requests=DEFAULT_MAX_REQUESTS, roll_games=0):
+        self.client = Client()
+        self.random = random.Random(seed)
+        self.games = games
+        self.bot_games = bot_games
+        self.roll_games = roll_games
+        self.board_every = board_every
+        self.max_requests = max_requests
+        self.stats = defaultdict(EndpointStats)
+        self.game_ids = []
+        self.finished = 0
+        self.error = None
+
+    def run(self):
+        """Play all games of the table; exceptions are kept for the caller"""
+        try:
+            plays = [(False, 'play_turn')] * self.games + [(False, 'roll_dice')] * self.roll_games
+            for bots, endpoint in plays + [(True, 'play_turn')] * self.bot_games:
+                if self.play_game(bots, endpoint):
+                    self.finished += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            connection.close()
+
+    def request(self, name, bots, method, url, data=None):
+        """Send one request and record its latency and query count"""
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = method(url, data or {})
+            elapsed = time.perf_counter() - started
+        count = len(queries)
+        # The capture measures the growth of the bounded query log, so keep it short
+        reset_queries()
+        self.stats[f'{name}[bots]' if bots else name].add(elapsed, count, response.status_code < 400)
+        return response
+
+    def play_game(self, bots, endpoint='play_turn'):
+        """
+        Create a game and play it to the end, like the browser client.
+
+        A player without a movable piece rolls again (or the server has
+        passed its turn). With bots, only the first seat is played by the
+        table. endpoint is the URL name rolls are sent to: play_turn or
+        roll_dice (both answer with the movable pieces).
+
+        Returns:
+            True if the game finished within max_requests
+        """
+        if bots:
+            data = {'player_names[]': ['Benchmark', '', '', ''], 'fill_with_bots': 'on'}
+        else:
+            data = {'player_names[]': [f'Player {seat}' for seat in range(1, 5)]}
+        created = self.request('create_game', bots, self.client.post, reverse('create_game'), data)
+        if created.status_code != 302:
+            return False
+        game_id = resolve(created['Location']).kwargs['game_id']
+        self.game_ids.append(game_id)
+
+        version = 0
+        moves = 0
+        requests = 1
+        while requests < self.max_requests:
+            rolled = self.request(endpoint, bots, self.client.post, reverse(endpoint, args=[game_id]))
+            requests += 1
+            if rolled.status_code != 200:
+                return False
+            result = rolled.json()
+            if result['game_over']:
+                return True
+            movable = result['movable_pieces']
+            if not movable:
+                continue
+
+            piece_id = self.random.choice(movable)
+            moved = self.request('move_piece', bots, self.client.post,
+                                 reverse('move_piece', args=[game_id, piece_id]))
+            self.request('get_game_state', bots, self.client.get,
+                         reverse('game_state', args=[game_id]), {'since': version})
+            requests += 2
+            if moved.status_code != 200:
+                return False
+            result = moved.json()
+            version = result['version']
+            moves += 1
+            if moves % self.board_every == 0:
+                self.request('game_board', bots, self.client.get, reverse('game_board', args=[game_id]))
+                requests += 1
+            if result['game_over']:
+                return True
+        return False
+
+
+# =============================================================================
+# RUNS
+# =============================================================================
+
+def is_test_database(alias):
+    """Whether a database is a test database: in-memory SQLite, or named with the test_ prefix"""
+    db = connections[alias]
+    name = str(db.settings_dict['NAME'])
+    if db.vendor == 'sqlite' and db.creation.is_in_memory_db(name):
+        return True
+    return os.path.basename(name).startswith(TEST_DATABASE_PREFIX)
+
+
+def check_database():
+    """
+    Make sure the benchmark may create and delete games on the configured databases.
+
+    Raises:
+        UnsafeDatabaseError: If DEBUG is off and 'default' or a game shard is
+            not a test database
+    """
+    if settings.DEBUG:
+        return
+    aliases = dict.fromkeys([DEFAULT_DB_ALIAS, *shards.game_shards()])
+    live = [alias for alias in aliases if not is_test_database(alias)]
+    if live:
+        raise UnsafeDatabaseError(
+            f'Refusing to benchmark against {", ".join(live)} with DEBUG off: the benchmark creates and deletes '
+            f'games. Use development settings (DEBUG = True) or test databases ({TEST_DATABASE_PREFIX}* names).'
+        )
+
+
+def run(tables=4, games=1, bot_games=0, seed=None, board_every=DEFAULT_BOARD_EVERY,
+        max_requests=DEFAULT_MAX_REQUESTS, keep_games=False, roll_games=0):
+    """
+    Play games on concurrent tables and summarize every endpoint.
+
+    Args:
+        tables: Tables (threads) playing at the same time
+        games: Games each table plays with four scripted players
+        bot_games: Games each table plays afterwards against computer players
+        roll_games: Games each table plays through the roll endpoint instead
+            of the turn endpoint (after the games above, before the bot games)
+        seed: Seed for the dice and the move choices; with more than one
+            table the interleaving, and so the dice, still varies
+        board_every: Moves between two board page loads
+        max_requests: Requests after which a game is abandoned
+        keep_games: Keep the played games instead of deleting them
+
+    Returns:
+        JSON-serializable dict with the run settings and per-endpoint stats
+
+    Raises:
+        UnsafeDatabaseError: See check_database()
+    """
+    check_database()
+    rng = random.Random(seed)
+    if seed is not None:
+        random.seed(seed)  # Game.roll_dice uses the module-level generator
+    players = [
+        Table(rng.random(), games, bot_games, board_every, max_requests, roll_games)
+        for _ in range(tables)
+    ]
+
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=table.run, name=f'benchmark-table-{index}')
+               for index, table in enumerate(players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+
+    try:
+        for table in players:
+            if table.error is not None:
+                raise table.error
+        stats = defaultdict(EndpointStats)
+        for table in players:
+            for label, endpoint in table.stats.items():
+                stats[label].merge(endpoint)
+    finally:
+        if not keep_games:
+            _delete_games([game_id for table in players for game_id in table.game_ids])
+
+    total = sum(len(endpoint.latencies) for endpoint in stats.values())
+    return {
+        'run': {
+            'tables': tables,
+            'games_per_table': games,
+            'bot_games_per_table': bot_games,
+            'roll_games_per_table': roll_games,
+            'seed': seed,
+            'board_every': board_every,
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'game_cache': cache.enabled(),
+            'board_storage': board_storage(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        'games': {
+            'played': sum(len(table.game_ids) for table in players),
+            'finished': sum(table.finished for table in players),
+        },
+        'wall_seconds': round(wall_seconds, 3),
+        'requests': total,
+        'requests_per_second': round(total / wall_seconds, 1) if wall_seconds else None,
+        'endpoints': {label: stats[label].summary(wall_seconds) for label in sorted(stats)},
+    }
+
+
+def _delete_games(game_ids):
+    """Delete benchmark games once their pending piece rows are flushed"""
+    cache.game_cache.flush_all()
+    for game_id in game_ids:
+        cache.game_cache.invalidate(game_id)
+    for db, ids in shards.by_shard(game_ids).items():
+        Game.objects.using(db).filter(id__in=ids).delete()
+
+
+# =============================================================================
+# SPECTATORS
+# =============================================================================
+
+def run_spectators(spectators=DEFAULT_SPECTATORS, polls=DEFAULT_POLLS, wsgi_threads=DEFAULT_WSGI_THREADS,
+                   keep_games=False):
+    """
+    Let many spectators watch one game at once, through the ASGI and the WSGI application.
+
+    Every spectator loads the board page, opens the live event stream and
+    then polls the state (If-None-Match, so mostly 304s), all spectators at
+    the same time, each sending its next request when the last one answered:
+    - asgi: dont_b_mad's ASGI application (live streams served by
+      game.live) on one event loop, a task per spectator; event streams
+      stay open until every spectator is done
+    - wsgi: the WSGI application on a pool of wsgi_threads threads, like a
+      sync worker pool; requests wait for a free thread and the event
+      stream is refused (204), so spectators can only poll
+
+    The applications are called directly, without a server or sockets (and
+    without the test clients, whose per-request signal receivers slow down
+    thousands of concurrent requests). Latencies count from the moment a
+    request is sent, waiting for a free thread included.
+
+    Returns:
+        JSON-serializable dict with the settings and one summary per path
+
+    Raises:
+        UnsafeDatabaseError: See check_database()
+    """
+    check_database()
+    client = Client()
+    created = client.post(reverse('create_game'), {'player_names[]': [f'Player {seat}' for seat in range(1, 5)]})
+    game_id = resolve(created['Location']).kwargs['game_id']
+    paths = {
+        'board': reverse('game_board', args=[game_id]),
+        'events': reverse('game_events', args=[game_id]),
+        'state': reverse('game_state', args=[game_id]),
+    }
+    try:
+        results = {
+            'asgi': asyncio.run(_asgi_spectators(paths, spectators, polls)),
+            'wsgi': _wsgi_spectators(paths, spectators, polls, wsgi_threads),
+        }
+    finally:
+        if not keep_games:
+            _delete_games([game_id])
+
+    return {
+        'run': {
+            'spectators': spectators,
+            'polls': polls,
+            'wsgi_threads': wsgi_threads,
+            'database': connection.vendor,
+            'game_cache': cache.enabled(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        **results,
+    }
+
+
+class SpectatorStats:
+    """Requests, open event streams and threads seen by the spectators of one path"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = []
+        self.streams = 0
+        self.peak_streams = 0
+        self.peak_threads = threading.active_count()
+        self._lock = threading.Lock()
+
+    def add(self, seconds, status):
+        """Record one request"""
+        with self._lock:
+            self.latencies.append(seconds)
+            self.statuses.append(status)
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def stream_opened(self, delta=1):
+        """Count an event stream opened (or, with -1, closed)"""
+        with self._lock:
+            self.streams += delta
+            self.peak_streams = max(self.peak_streams, self.streams)
+
+    def summary(self, wall_seconds):
+        """Percentiles in milliseconds, throughput, streams held and threads used"""
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'requests': count,
+            'errors': sum(1 for status in self.statuses if status >= 400),
+            'not_modified': self.statuses.count(304),
+            'wall_seconds': round(wall_seconds, 3),
+            'requests_per_second': round(count / wall_seconds, 1) if wall_seconds else None,
+            'p50_ms': round(1000 * percentile(latencies, 0.50), 3),
+            'p95_ms': round(1000 * percentile(latencies, 0.95), 3),
+            'p99_ms': round(1000 * percentile(latencies, 0.99), 3),
+            'max_ms': round(1000 * latencies[-1], 3) if latencies else 0.0,
+            'streams_held': self.peak_streams,
+            'peak_threads': self.peak_threads,
+        }
+
+
+async def _asgi_spectators(paths, spectators, polls):
+    """All spectators as tasks on one event loop, calling the ASGI application"""
+    application = live.with_live_events(get_asgi_application())
+    stats = SpectatorStats()
+    finished = asyncio.Event()
+    remaining = spectators
+
+    async def get(path, etag=None):
+        """One request; returns (status, ETag); an event stream is left running"""
+        headers = [(b'host', b'testserver')]
+        if etag:
+            headers.append((b'if-none-match', etag.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        answered = asyncio.get_running_loop().create_future()
+        start = {}
+        request = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if request:
+                return request.pop()
+            await asyncio.Future()  # The client never disconnects on its own
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                start.update(message)
+            elif not answered.done():
+                answered.set_result(None)  # First body chunk (a stream's retry line)
+
+        started = time.perf_counter()
+        task = asyncio.ensure_future(application(scope, receive, send))
+        await asyncio.wait([answered, task], return_when=asyncio.FIRST_COMPLETED)
+        stats.add(time.perf_counter() - started, start.get('status', 500))
+        if task.done():
+            task.result()
+            task = None
+        etag = {name.lower(): value for name, value in start.get('headers', ())}.get(b'etag', b'').decode() or None
+        return start.get('status', 500), etag, task
+
+    async def spectator():
+        nonlocal remaining
+        await get(paths['board'])
+        status, _, stream = await get(paths['events'])
+        if stream is not None:
+            stats.stream_opened()
+        etag = None
+        for _ in range(polls):
+            status, etag, _ = await get(paths['state'], etag)
+        remaining -= 1
+        if not remaining:
+            finished.set()
+        await finished.wait()
+        if stream is not None:
+            stream.cancel()
+            await asyncio.gather(stream, return_exceptions=True)
+            stats.stream_opened(-1)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(spectator() for _ in range(spectators)))
+    return stats.summary(time.perf_counter() - started)
+
+
+def _wsgi_spectators(paths, spectators, polls, threads):
+    """All spectators queued on a fixed thread pool, calling the WSGI application"""
+    application = get_wsgi_application()
+    stats = SpectatorStats()
+    lock = threading.Lock()
+    finished = threading.Event()
+    remaining = spectators
+    steps = ['board', 'events'] + ['state'] * polls
+    etags = [None] * spectators
+
+    def get(path, etag):
+        """One request; returns (status, ETag)"""
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+            'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1', 'HTTP_HOST': 'testserver',
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if etag:
+            environ['HTTP_IF_NONE_MATCH'] = etag
+        start = []
+        body = application(environ, lambda status, headers, exc_info=None: start.extend((status, headers)))
+        try:
+            for _ in body:
+                pass
+        finally:
+            body.close()
+        return int(start[0].split()[0]), dict(start[1]).get('ETag')
+
+    def request(pool, spectator, step, sent_at):
+        nonlocal remaining
+        status, etag = get(paths[steps[step]], etags[spectator] if steps[step] == 'state' else None)
+        stats.add(time.perf_counter() - sent_at, status)
+        if steps[step] == 'state':
+            etags[spectator] = etag or etags[spectator]
+        if step + 1 < len(steps):
+            pool.submit(request, pool, spectator, step + 1, time.perf_counter())
+            return
+        with lock:
+            remaining -= 1
+            if not remaining:
+                finished.set()
+
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='benchmark-wsgi')
+    started = time.perf_counter()
+    for spectator in range(spectators):
+        pool.submit(request, pool, spectator, 0, started)
+    finished.wait()
+    wall_seconds = time.perf_counter() - started
+    pool.shutdown()
+    return stats.summary(wall_seconds)
+
+
+def check(results, budgets=None, baseline=None, tolerance=DEFAULT_LATENCY_TOLERANCE):
+    """
+    Compare a run against query budgets and an optional baseline run.
+
+    Args:
+        results: Dict returned by run()
+        budgets: Most queries per request by endpoint label, defaults to QUERY_BUDGETS
+        baseline: Results of an earlier run; more queries than there (bot
+            game labels excepted), or a p95 latency more than tolerance
+            above it, are regressions
+        tolerance: Allowed relative p95 latency increase over the baseline
+
+    Returns:
+        List of regression messages, empty if the run is within budget
+    """
+    budgets = QUERY_BUDGETS if budgets is None else budgets
+    previous = baseline['endpoints'] if baseline else {}
+    failures = []
+    for label, endpoint in results['endpoints'].items():
+        if endpoint['errors']:
+            failures.append(f'{label}: {endpoint["errors"]} failed requests')
+        budget = budgets.get(label)
+        if budget is not None and endpoint['queries_max'] > budget:
+            failures.append(f'{label}: {endpoint["queries_max"]} queries, budget is {budget}')
+
+        before = previous.get(label)
+        if before is None:
+            continue
+        # Bot turns depend on the dice and the search, so their query counts vary between runs
+        if not label.endswith('[bots]') and endpoint['queries_max'] > before['queries_max']:
+            failures.append(
+                f'{label}: {endpoint["queries_max"]} queries, baseline had {before["queries_max"]}'
+            )
+        limit = max(before['p95_ms'] * (1 + tolerance), before['p95_ms'] + LATENCY_NOISE_MS)
+        if endpoint['p95_ms'] > limit:
+            failures.append(
+                f'{label}: p95 {endpoint["p95_ms"]:.2f} ms, baseline {before["p95_ms"]:.2f} ms'
+            )
+    return failures
@@ -0,0 +1,94 @@
+"""
+Game Event Broker Module
+========================
+
+In-process publish/subscribe hub that pushes game updates to connected
+clients (Server-Sent Events on the ASGI app).
+
+Features:
+    - Events are encoded once per publish, as a Server-Sent Events message
+      with the game version as its id, and fanned out to every subscriber
+    - Safe to publish from sync views running in worker threads
+    - Bounded subscriber queues: slow clients drop their oldest events
+      instead of growing memory; clients notice the gap in the versions
+      and fetch /state/?since= to catch up
+
+Note:
+    The broker lives in one process. With several ASGI worker processes,
+    clients only receive events for turns handled by their own process, so
+    run a single worker or fall back to polling /state/.
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+
+# Events kept per subscriber before the oldest ones are dropped
+MAX_QUEUED_EVENTS = 100
+
+
+def sse_message(event):
+    """Encode an event as a Server-Sent Events message (id: game version, data: JSON)"""
+    data = json.dumps(event)
+    version = event.get('version')
+    if version is None:
+        return f'data: {data}\n\n'
+    return f'id: {version}\ndata: {data}\n\n'
+
+
+def _put_dropping_oldest(queue, message):
+    """Queue a message, discarding the oldest one when the queue is full"""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+class GameBroker:
+    """Fans out game events to subscribers, keyed by game id"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, game_id):
+        """Register the running event loop for a game's events, returns the queue to read from"""
+        queue = asyncio.Queue(maxsize=MAX_QUEUED_EVENTS)
+        with self._lock:
+            self._subscribers[game_id].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, game_id, queue):
+        """Remove a subscriber queue"""
+        with self._lock:
+            subscribers = self._subscribers.get(game_id)
+            if subscribers is None:
+                return
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                del self._subscribers[game_id]
+
+    def subscriber_count(self, game_id):
+        """Number of clients listening to a game"""
+        with self._lock:
+            return len(self._subscribers.get(game_id, ()))
+
+    def publish(self, game_id, event):
+        """Encode an event once and deliver it to every subscriber of the game"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(game_id, ()))
+        if not subscribers:
+            return
+        message = sse_message(event)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_put_dropping_oldest, queue, message)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                self.unsubscribe(game_id, queue)
+
+
+broker = GameBroker()
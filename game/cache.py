@@ -0,0 +1,315 @@
+"""
+Hot Game Cache Module
+=====================
+
+In-process cache of active game states with write-behind of piece rows.
+
+How it works:
+    - A committed snapshot is stored pickled, keyed by game id. Every
+      request unpickles its own private copy, so concurrent requests never
+      share mutable model instances
+    - Turns commit the Game row (compare-and-swap on version) and the
+      journal event synchronously; only the Piece rows are written behind,
+      in batches, by a flusher thread
+    - Game.flushed_version records up to which version the Piece rows are
+      written. Whoever loads a game from the database replays the journal
+      moves after it (see GameSnapshot.catch_up), so a committed turn
+      survives eviction, a crash before the flush and other workers
+
+Invalidation rules:
+    - An entry is only used if its version equals Game.version in the
+      database (one primary key lookup per request); otherwise the game is
+      reloaded. This keeps several worker processes consistent
+    - A failed compare-and-swap evicts the entry (another worker or request
+      committed first)
+    - Every writer outside game.turns must still bump Game.version
+      (e.g. quit_game); editing Piece rows directly (admin, shell) is not
+      seen by cached games until their version changes
+    - Piece rows lag behind by up to FLUSH_INTERVAL_SECONDS; code that needs
+      positions must read them through load(), aload() or load_snapshot()
+
+Async views use aload(): a hit costs one async ORM query and is served on
+the event loop; only a miss loads in a worker thread. The cache's lock is never held across an
+await, so the event loop and worker threads can share it.
+
+Configuration (settings.GAME_STATE_CACHE):
+    ENABLED, MAX_GAMES, MAX_BYTES, TTL_SECONDS, FLUSH_INTERVAL_SECONDS,
+    FLUSH_BATCH_SIZE
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import atexit
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.http import Http404
+
+from .models import Game, Piece
+from .shards import by_shard, db_for_game
+from .snapshot import PIECE_STATE_FIELDS, load_snapshot
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_GAMES': 1000,
+    'MAX_BYTES': 32 * 1024 * 1024,
+    'TTL_SECONDS': 15 * 60,
+    'FLUSH_INTERVAL_SECONDS': 1.0,
+    'FLUSH_BATCH_SIZE': 200,
+}
+
+
+def cache_settings():
+    """GAME_STATE_CACHE settings merged over the defaults"""
+    return {**DEFAULTS, **getattr(settings, 'GAME_STATE_CACHE', {})}
+
+
+class GameStateCache:
+    """LRU/TTL cache of pickled game snapshots, bounded by game count and bytes"""
+
+    def __init__(self, max_games, max_bytes, ttl, flush_interval, flush_batch_size):
+        self.max_games = max_games
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # game id -> (version, pickled snapshot, expires at)
+        self._bytes = 0
+        self._dirty = OrderedDict()  # game id -> (version, piece rows)
+        self._flusher = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    # -------------------------------------------------------------------------
+    # Entries
+    # -------------------------------------------------------------------------
+
+    def get(self, game_id, version):
+        """Private copy of the cached snapshot if it has the given version, else None"""
+        with self._lock:
+            entry = self._entries.get(game_id)
+            if entry is None or entry[0] != version or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._drop(game_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(game_id)
+            self.hits += 1
+            data = entry[1]
+        return pickle.loads(data)
+
+    def put(self, snapshot):
+        """Store a committed snapshot, unless a newer version is cached already"""
+        game = snapshot.game
+        data = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            entry = self._entries.get(game.id)
+            if entry is not None:
+                if entry[0] > game.version:
+                    return
+                self._drop(game.id)
+            self._entries[game.id] = (game.version, data, time.monotonic() + self.ttl)
+            self._bytes += len(data)
+            while self._entries and (len(self._entries) > self.max_games or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, game_id):
+        """Forget a game (its pending piece rows are still flushed)"""
+        with self._lock:
+            if game_id in self._entries:
+                self._drop(game_id)
+
+    def clear(self):
+        """Forget all games"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _drop(self, game_id):
+        """Remove an entry; caller holds the lock"""
+        self._bytes -= len(self._entries.pop(game_id)[1])
+
+    def expire(self):
+        """Drop entries whose TTL has passed"""
+        now = time.monotonic()
+        with self._lock:
+            for game_id in [key for key, entry in self._entries.items() if entry[2] < now]:
+                self._drop(game_id)
+
+    # -------------------------------------------------------------------------
+    # Write-behind
+    # -------------------------------------------------------------------------
+
+    def mark_dirty(self, snapshot):
+        """Queue the piece rows of a committed snapshot for the flusher (newest version wins)"""
+        rows = [
+            (piece.id, piece.position, piece.steps_taken, piece.in_home, piece.version)
+            for piece in snapshot.pieces
+        ]
+        with self._lock:
+            pending = self._dirty.get(snapshot.game.id)
+            if pending is None or pending[0] < snapshot.game.version:
+                self._dirty[snapshot.game.id] = (snapshot.game.version, rows)
+            self._start_flusher()
+
+    def pending(self):
+        """Number of games with piece rows waiting to be flushed"""
+        with self._lock:
+            return len(self._dirty)
+
+    def flush(self):
+        """
+        Write one batch of dirty games, one transaction per shard: their
+        flushed_version, then all their piece rows with one bulk UPDATE.
+
+        A game whose flushed_version is already at or past the queued version
+        (flushed by another worker) is skipped.
+
+        Returns:
+            Number of games written, or None if part of the batch failed and was requeued
+        """
+        with self._lock:
+            batch = []
+            while self._dirty and len(batch) < self.flush_batch_size:
+                batch.append(self._dirty.popitem(last=False))
+        if not batch:
+            return 0
+
+        entries = dict(batch)
+        written = 0
+        failed = False
+        for db, game_ids in by_shard(entries).items():
+            part = [(game_id, entries[game_id]) for game_id in game_ids]
+            try:
+                written += self._flush_shard(db, part)
+            except DatabaseError:
+                # Put the games back (unless newer versions were queued meanwhile) and retry later
+                with self._lock:
+                    for game_id, (version, rows) in part:
+                        pending = self._dirty.get(game_id)
+                        if pending is None or pending[0] < version:
+                            self._dirty[game_id] = (version, rows)
+                logger.exception('Flushing %d games to %s failed, will retry', len(part), db)
+                failed = True
+        return None if failed else written
+
+    def _flush_shard(self, db, batch):
+        """Write the piece rows of dirty games on one shard in one transaction, returns the games written"""
+        with transaction.atomic(using=db):
+            # Claim each game first (a write, so the row is locked); games
+            # already flushed this far by another worker are skipped
+            games = Game.objects.using(db)
+            due = [
+                (game_id, version, rows) for game_id, (version, rows) in batch
+                if games.filter(id=game_id, flushed_version__lt=version).update(flushed_version=version)
+            ]
+            Piece.objects.using(db).bulk_update([
+                Piece(id=piece_id, position=position, steps_taken=steps, in_home=in_home, version=piece_version)
+                for _, _, rows in due
+                for piece_id, position, steps, in_home, piece_version in rows
+            ], PIECE_STATE_FIELDS)
+        return len(due)
+
+    def flush_all(self):
+        """Flush until nothing is pending"""
+        while self.pending():
+            if self.flush() is None:
+                break
+
+    def _start_flusher(self):
+        """Start the background flusher thread; caller holds the lock"""
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._run_flusher, name='game-cache-flusher', daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        """Flush dirty games every flush_interval seconds"""
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_all()
+                self.expire()
+            finally:
+                close_old_connections()
+
+
+_config = cache_settings()
+game_cache = GameStateCache(
+    max_games=_config['MAX_GAMES'],
+    max_bytes=_config['MAX_BYTES'],
+    ttl=_config['TTL_SECONDS'],
+    flush_interval=_config['FLUSH_INTERVAL_SECONDS'],
+    flush_batch_size=_config['FLUSH_BATCH_SIZE'],
+)
+atexit.register(game_cache.flush_all)
+
+
+def enabled():
+    """Whether views read through the cache and piece rows are written behind"""
+    return cache_settings()['ENABLED']
+
+
+def load(game_id):
+    """
+    Load a game snapshot through the cache, or raise Http404.
+
+    Costs one version query on a hit, a full snapshot load on a miss.
+    """
+    if not enabled():
+        return load_snapshot(game_id)
+    version = Game.objects.using(db_for_game(game_id)).filter(id=game_id).values_list('version', flat=True).first()
+    return _cached(game_id, version) or _load_and_put(game_id)
+
+
+async def aload(game_id, version=None):
+    """
+    load() for async views: the version query goes through the async ORM
+    and a hit is served on the event loop; a miss loads the snapshot in a
+    worker thread.
+
+    Args:
+        version: Game version the caller has just read, saves the query
+    """
+    if not enabled():
+        return await sync_to_async(load_snapshot)(game_id)
+    if version is None:
+        games = Game.objects.using(db_for_game(game_id))
+        version = await games.filter(id=game_id).values_list('version', flat=True).afirst()
+    return _cached(game_id, version) or await sync_to_async(_load_and_put)(game_id)
+
+
+def _cached(game_id, version):
+    """Cached snapshot at version, None on a miss; Http404 if the game does not exist (version None)"""
+    if version is None:
+        game_cache.invalidate(game_id)
+        raise Http404('No Game matches the given query.')
+    return game_cache.get(game_id, version)
+
+
+def _load_and_put(game_id):
+    """Load a snapshot from the database and cache it"""
+    snapshot = load_snapshot(game_id)
+    game_cache.put(snapshot)
+    return snapshot
+
+
+def store(snapshot):
+    """Cache a snapshot after its turn was committed, queueing its piece rows if they are unflushed"""
+    if not enabled():
+        return
+    game_cache.put(snapshot)
+    if snapshot.unflushed:
+        game_cache.mark_dirty(snapshot)
@@ -0,0 +1,381 @@
+"""
+Image Variants Module
+=====================
+
+Right-sized WebP/AVIF variants of the images in static/images, written
+under content-hashed names and listed in a manifest.
+
+How it works:
+    - Every source image gets one variant per use it is rendered at. USES
+      gives the longest edge in pixels (about twice the CSS size, for
+      high-DPI screens); every image can be a board token, FOLDER_USES adds
+      the larger uses by folder
+    - generate() writes the variants to static/variants/ as
+      <name>-<use>.<hash>.<format>, hashing the encoded bytes, so a file
+      never changes under its name and can be cached forever
+    - manifest.json maps every source path (relative to static/images) to
+      its variants; unchanged sources are not encoded again
+    - Sprite sheets pack images that are shown together or in turn (dice
+      faces, a team's tokens) into one strip of square cells, so the page
+      fetches one file per sheet; the manifest lists their frames in order
+    - variant_url() and the {% image_url %} / {% image_background %} tags
+      pick the variant and fall back to the original image when there is no
+      manifest entry, so the site works before the first run
+
+Generating requires Pillow (optional dependency, see requirements.txt).
+AVIF is only written by Pillow builds with AVIF support. Serving needs
+neither; the manifest is read once per process, so restart after a run.
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import hashlib
+import io
+import json
+import re
+
+from django.conf import settings
+from django.templatetags.static import static
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+except ImportError:  # Pillow is only needed to generate variants
+    Image = None
+
+
+# Longest edge of every use, in pixels
+USES = {
+    'token': 96,   # Piece tokens, board coins, challenge markers, dice (40-48 px on the board)
+    'dice': 240,   # Dice face next to the board (120 px)
+    'bill': 480,   # Quadrant and home lane backgrounds (240 px)
+    'card': 800,   # Challenge task card (up to 400 px)
+}
+
+# Uses besides 'token', by top-level folder of static/images
+FOLDER_USES = {
+    'challenges': ('card',),
+    'dice': ('dice',),
+    'dollar': ('bill',),
+    'euro': ('bill',),
+    'leva': ('bill',),
+    'liri': ('bill',),
+    'roma': ('bill',),
+}
+
+# Output formats, best first; browsers that support neither get the original
+FORMATS = ('avif', 'webp')
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+DEFAULT_QUALITY = {'avif': 55, 'webp': 80}
+
+SOURCE_DIR = settings.BASE_DIR / 'static' / 'images'
+OUTPUT_DIR = settings.BASE_DIR / 'static' / 'variants'
+STATIC_PREFIX = 'variants'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+_manifest = None
+_manifest_token = None
+
+
+def _require_pillow():
+    """Raise a helpful error when Pillow is not installed"""
+    if Image is None:
+        raise ImportError('Generating image variants requires Pillow: pip install Pillow')
+
+
+def available_formats():
+    """Formats the installed Pillow can encode, in FORMATS order"""
+    _require_pillow()
+    return tuple(fmt for fmt in FORMATS if features.check(fmt))
+
+
+def uses_for(path):
+    """Uses a source image gets variants for"""
+    return ('token',) + FOLDER_USES.get(path.split('/', 1)[0], ())
+
+
+# =============================================================================
+# MANIFEST
+# =============================================================================
+
+def manifest():
+    """Manifest dict with 'images' and 'sprites', loaded once per process (both empty without one)"""
+    global _manifest
+    if _manifest is None:
+        _manifest = _read_manifest(OUTPUT_DIR)
+    return _manifest
+
+
+def reload_manifest():
+    """Read the manifest again on next use"""
+    global _manifest, _manifest_token
+    _manifest = None
+    _manifest_token = None
+
+
+def manifest_token():
+    """Short digest of the manifest, for cache keys of markup that embeds variant URLs"""
+    global _manifest_token
+    if _manifest_token is None:
+        data = json.dumps(manifest(), sort_keys=True).encode('utf-8')
+        _manifest_token = hashlib.sha256(data).hexdigest()[:12]
+    return _manifest_token
+
+
+def variant_urls(path, use):
+    """URLs of the variants of an image for a use, best format first ({} if none)"""
+    entry = manifest()['images'].get(path, {}).get('variants', {}).get(use, {})
+    return {fmt: static(f'{STATIC_PREFIX}/{entry[fmt]}') for fmt in FORMATS if fmt in entry}
+
+
+def variant_url(path, use, fmt='webp'):
+    """URL of one variant format of an image, or of the original image"""
+    urls = variant_urls(path, use)
+    return urls.get(fmt) or static(f'images/{path}')
+
+
+def sprite_urls(name):
+    """URLs of a sprite sheet, best format first ({} if it was not generated)"""
+    sheet = manifest()['sprites'].get(name, {})
+    return {fmt: static(f'{STATIC_PREFIX}/{sheet[fmt]}') for fmt in FORMATS if fmt in sheet}
+
+
+def sprite_position(name, frame):
+    """
+    CSS background-size and background-position showing one frame of a
+    sprite sheet in an element of any size, or None without the sheet.
+    """
+    sheet = manifest()['sprites'].get(name)
+    if sheet is None or not 0 <= frame < len(sheet['frames']):
+        return None
+    count = len(sheet['frames'])
+    offset = 100 * frame / (count - 1) if count > 1 else 0
+    return f'{count * 100}% 100%', f'{offset:g}% 0'
+
+
+def client_sprites(names):
+    """Sprite sheets for game.js: {name: {format: url, 'frames': [paths]}}, generated ones only"""
+    sprites = {}
+    for name in names:
+        urls = sprite_urls(name)
+        if urls:
+            sprites[name] = {**urls, 'frames': manifest()['sprites'][name]['frames']}
+    return sprites
+
+
+def client_variants(paths_by_use):
+    """
+    Variant URLs for game.js: {path: {use: {format: url}}}, for the given
+    paths only, so the page does not carry the whole manifest.
+
+    Args:
+        paths_by_use: Dict of use -> iterable of source paths
+    """
+    variants = {}
+    for use, paths in paths_by_use.items():
+        for path in paths:
+            urls = variant_urls(path, use)
+            if urls:
+                variants.setdefault(path, {})[use] = urls
+    return variants
+
+
+# =============================================================================
+# GENERATION
+# =============================================================================
+
+def _safe_stem(path):
+    """File name stem of a source path, reduced to URL-safe characters"""
+    stem = path.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+    return re.sub(r'[^A-Za-z0-9_-]+', '-', stem).strip('-') or 'image'
+
+
+def _encode(image, fmt, quality):
+    """Encoded bytes of an image"""
+    stream = io.BytesIO()
+    if fmt == 'webp':
+        image.save(stream, 'WEBP', quality=quality, method=6)
+    else:
+        image.save(stream, 'AVIF', quality=quality)
+    return stream.getvalue()
+
+
+def _variant_image(image, size):
+    """Copy of an image scaled down to fit size x size (never scaled up)"""
+    variant = ImageOps.exif_transpose(image)
+    has_alpha = variant.mode in ('RGBA', 'LA', 'PA') or 'transparency' in variant.info
+    variant = variant.convert('RGBA' if has_alpha else 'RGB')
+    variant.thumbnail((size, size), Image.LANCZOS)
+    return variant
+
+
+def generate(formats=None, quality=None, force=False, sprites=None,
+             source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR):
+    """
+    Write the variants of all images, the sprite sheets and the manifest,
+    removing variant files the new manifest does not list.
+
+    Args:
+        formats: Formats to write, defaults to every available one of FORMATS
+        quality: Dict of format -> encoder quality, merged over DEFAULT_QUALITY
+        force: Encode every image again, even if its source did not change
+        sprites: Dict of sheet name -> {'use': use giving the cell size,
+            'fit': 'cover' or 'contain', 'frames': source paths in order}
+        source_dir: Directory of the original images
+        output_dir: Directory for the variants and the manifest
+
+    Returns:
+        Dict with the counts of images encoded, reused and skipped (not
+        images or sheets with missing frames), the number of sprite sheets
+        and the total bytes of sources and token variants
+    """
+    _require_pillow()
+    formats = tuple(formats or available_formats())
+    if not formats:
+        raise ValueError('This Pillow build can encode neither AVIF nor WebP')
+    quality = {**DEFAULT_QUALITY, **(quality or {})}
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    previous = {'images': {}, 'sprites': {}} if force else _read_manifest(output_dir)
+    images = {}
+    stats = {'encoded': 0, 'reused': 0, 'skipped': [], 'sprites': 0, 'source_bytes': 0, 'token_bytes': 0}
+
+    for source in sorted(p for p in source_dir.rglob('*') if p.is_file()):
+        path = source.relative_to(source_dir).as_posix()
+        data = source.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+
+        old = previous['images'].get(path)
+        if old and old['source'] == digest and _complete(old, path, formats, output_dir):
+            images[path] = {'source': digest, 'variants': {
+                use: {key: value for key, value in variant.items() if key not in FORMATS or key in formats}
+                for use, variant in old['variants'].items()
+            }}
+            stats['reused'] += 1
+        else:
+            try:
+                original = Image.open(io.BytesIO(data))
+                original.load()
+            except (UnidentifiedImageError, OSError):
+                stats['skipped'].append(f'{path} (not an image)')
+                continue
+            images[path] = {'source': digest, 'variants': _write_variants(
+                original, path, formats, quality, output_dir
+            )}
+            stats['encoded'] += 1
+
+        stats['source_bytes'] += len(data)
+        token = images[path]['variants']['token']
+        stats['token_bytes'] += min((output_dir / token[fmt]).stat().st_size for fmt in formats)
+
+    sheets = {}
+    for name, sheet in (sprites or {}).items():
+        missing = [path for path in sheet['frames'] if path not in images]
+        if missing:
+            stats['skipped'].append(f'sprite {name} (missing {", ".join(missing)})')
+            continue
+        digest = hashlib.sha256(json.dumps(
+            [sheet['use'], sheet['fit'], [(path, images[path]['source']) for path in sheet['frames']]]
+        ).encode()).hexdigest()[:16]
+        old = previous['sprites'].get(name)
+        if old and old['source'] == digest and all(
+            fmt in old and (output_dir / old[fmt]).is_file() for fmt in formats
+        ):
+            sheets[name] = {key: value for key, value in old.items() if key not in FORMATS or key in formats}
+        else:
+            sheets[name] = _write_sprite(name, sheet, digest, formats, quality, source_dir, output_dir)
+        stats['sprites'] += 1
+
+    _prune(output_dir, images, sheets)
+    _write_manifest(output_dir, images, sheets)
+    reload_manifest()
+    return stats
+
+
+def _write_variants(original, path, formats, quality, output_dir):
+    """Encode and write the variants of one image, returns its manifest variants"""
+    variants = {}
+    for use in uses_for(path):
+        scaled = _variant_image(original, USES[use])
+        entry = {'width': scaled.width, 'height': scaled.height}
+        for fmt in formats:
+            data = _encode(scaled, fmt, quality[fmt])
+            name = f'{_safe_stem(path)}-{use}.{hashlib.sha256(data).hexdigest()[:10]}.{fmt}'
+            (output_dir / name).write_bytes(data)
+            entry[fmt] = name
+        variants[use] = entry
+    return variants
+
+
+def _write_sprite(name, sheet, digest, formats, quality, source_dir, output_dir):
+    """Encode and write one sprite sheet (a row of square cells), returns its manifest entry"""
+    cell = USES[sheet['use']]
+    strip = Image.new('RGBA', (cell * len(sheet['frames']), cell), (0, 0, 0, 0))
+    for index, path in enumerate(sheet['frames']):
+        with Image.open(source_dir / path) as original:
+            frame = ImageOps.exif_transpose(original).convert('RGBA')
+        if sheet['fit'] == 'cover':
+            frame = ImageOps.fit(frame, (cell, cell), Image.LANCZOS)
+        else:
+            frame = ImageOps.contain(frame, (cell, cell), Image.LANCZOS)
+        strip.paste(frame, (index * cell + (cell - frame.width) // 2, (cell - frame.height) // 2))
+
+    entry = {
+        'source': digest,
+        'use': sheet['use'],
+        'frames': list(sheet['frames']),
+        'width': strip.width,
+        'height': strip.height,
+    }
+    for fmt in formats:
+        data = _encode(strip, fmt, quality[fmt])
+        file_name = f'sprite-{_safe_stem(name)}.{hashlib.sha256(data).hexdigest()[:10]}.{fmt}'
+        (output_dir / file_name).write_bytes(data)
+        entry[fmt] = file_name
+    return entry
+
+
+def _complete(entry, path, formats, output_dir):
+    """Whether a manifest entry has every use and format of the run, with its files on disk"""
+    variants = entry.get('variants', {})
+    return all(
+        use in variants and fmt in variants[use] and (output_dir / variants[use][fmt]).is_file()
+        for use in uses_for(path) for fmt in formats
+    )
+
+
+def _read_manifest(output_dir):
+    """Images and sprites of the manifest in output_dir (empty without a valid one)"""
+    empty = {'images': {}, 'sprites': {}}
+    try:
+        with open(output_dir / MANIFEST_NAME, encoding='utf-8') as stream:
+            data = json.load(stream)
+    except (OSError, ValueError):
+        return empty
+    if data.get('version') != MANIFEST_VERSION:
+        return empty
+    return {'images': data.get('images', {}), 'sprites': data.get('sprites', {})}
+
+
+def _write_manifest(output_dir, images, sprites):
+    """Replace the manifest atomically"""
+    target = output_dir / MANIFEST_NAME
+    temporary = target.with_suffix('.tmp')
+    with open(temporary, 'w', encoding='utf-8') as stream:
+        json.dump({'version': MANIFEST_VERSION, 'images': images, 'sprites': sprites}, stream,
+                  indent=1, sort_keys=True, ensure_ascii=False)
+    temporary.replace(target)
+
+
+def _prune(output_dir, images, sprites):
+    """Delete variant files that no manifest entry refers to"""
+    keep = {
+        name
+        for entry in images.values()
+        for variant in entry['variants'].values()
+        for fmt, name in variant.items() if fmt in FORMATS
+    }
+    keep.update(name for sheet in sprites.values() for fmt, name in sheet.items() if fmt in FORMATS)
+    for file in output_dir.iterdir():
+        if file.is_file() and file.suffix[1:] in FORMATS and file.name not in keep:
+            file.unlink()
@@ -0,0 +1,236 @@
+"""
+Move Journal Module
+===================
+
+Append-only history of every committed turn step, with periodic
+checkpoints so that any version of a game can be rebuilt quickly.
+
+How it works:
+    - Every writer that bumps Game.version records exactly one GameEvent
+      (roll, move, pass or quit) for the new version, in the same
+      transaction: one INSERT per turn
+    - Every CHECKPOINT_INTERVAL versions the full board is stored as a
+      JournalCheckpoint
+    - rebuild() starts from the latest checkpoint at or before the wanted
+      version and applies the trailing events with the rules engine
+
+Events are compact: seat, dice value, piece index (seat * 4 + piece_number)
+and a bitmask of captured piece indexes. Captures are recomputed on
+replay; the recorded ones document what the server saw.
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+from array import array
+
+from . import rules
+from .shards import db_for_game
+from .models import GameEvent, JournalCheckpoint, Player
+
+
+# Versions between two checkpoints
+CHECKPOINT_INTERVAL = 50
+
+# Event columns read by replays, in this order
+EVENT_FIELDS = ('version', 'kind', 'seat', 'dice_value', 'piece', 'captured')
+
+
+class JournalError(Exception):
+    """The journal of a game cannot rebuild the requested version"""
+
+
+def captured_mask(indexes):
+    """Bitmask of piece indexes"""
+    mask = 0
+    for index in indexes:
+        mask |= 1 << index
+    return mask
+
+
+def captured_indexes(mask):
+    """Piece indexes of a bitmask"""
+    return [index for index in range(mask.bit_length()) if mask >> index & 1]
+
+
+def record(game, kind, seat=0, dice_value=0, piece=None, captured=()):
+    """
+    Append the event that produced the game's current version.
+
+    Must run inside the transaction that committed the version.
+    """
+    GameEvent.objects.using(db_for_game(game.id)).create(
+        game_id=game.id,
+        version=game.version,
+        kind=kind,
+        seat=seat,
+        dice_value=dice_value,
+        piece=piece,
+        captured=captured_mask(captured),
+    )
+
+
+def checkpoint_due(game):
+    """Whether the game's current version should get a checkpoint"""
+    return game.version % CHECKPOINT_INTERVAL == 0
+
+
+def checkpoint(game, board):
+    """Store the full state of a game at its current version"""
+    JournalCheckpoint.objects.using(db_for_game(game.id)).create(
+        game_id=game.id,
+        version=game.version,
+        status=game.status,
+        current_player_index=board.turn,
+        dice_value=board.dice,
+        progress=board.progress.tobytes(),
+    )
+
+
+def moves_between(game_id, after, upto):
+    """(version, piece, dice_value) of the moves after version after, up to version upto"""
+    return list(
+        GameEvent.objects.using(db_for_game(game_id))
+        .filter(game_id=game_id, kind='move', version__gt=after, version__lte=upto)
+        .order_by('version').values_list('version', 'piece', 'dice_value')
+    )
+
+
+# =============================================================================
+# REPLAY
+# =============================================================================
+
+class Replay:
+    """A game state being rebuilt from journal events"""
+
+    def __init__(self, board, version=0, status='in_progress'):
+        self.board = board
+        self.version = version
+        self.status = status
+
+    @classmethod
+    def start(cls, game_id):
+        """Initial state of a game, from its players' colors"""
+        colors = Player.objects.using(db_for_game(game_id)).filter(game_id=game_id).values_list('color', flat=True)
+        return cls(rules.BoardState(colors=[rules.COLOR_INDEX[color] for color in colors]))
+
+    @classmethod
+    def from_checkpoint(cls, game_id, checkpoint):
+        """State stored in a checkpoint"""
+        colors = Player.objects.using(db_for_game(game_id)).filter(game_id=game_id).values_list('color', flat=True)
+        board = rules.BoardState(
+            array('b', bytes(checkpoint.progress)),
+            colors=[rules.COLOR_INDEX[color] for color in colors],
+            turn=checkpoint.current_player_index,
+            dice=checkpoint.dice_value,
+        )
+        return cls(board, checkpoint.version, checkpoint.status)
+
+    def apply(self, version, kind, seat, dice_value, piece, captured):
+        """
+        Apply one event, the same way turns.py changed the game.
+
+        Returns:
+            List of captured piece indexes (for moves)
+        """
+        if version != self.version + 1:
+            raise JournalError(f'Journal gap: expected version {self.version + 1}, got {version}')
+        self.version = version
+        board = self.board
+
+        if kind == 'roll':
+            board.dice = dice_value
+            return []
+        if kind == 'quit':
+            self.status = 'finished'
+            return []
+        if kind == 'pass':
+            board.turn = (seat + 1) % board.seats
+            board.dice = 0
+            return []
+
+        board.turn = seat
+        board.dice = dice_value
+        hits = board.move(piece, dice_value)
+        if hits is None:
+            raise JournalError(f'Illegal move in journal at version {version}')
+        if board.has_won(seat):
+            self.status = 'finished'
+        else:
+            board.end_turn()
+        return hits
+
+    def squares(self):
+        """Board square of every piece (-1 in start)"""
+        board = self.board
+        return [board.square(index) for index in range(len(board.progress))]
+
+
+def _starting_point(game_id, version=None):
+    """Replay at the latest checkpoint at or before version (the initial state without one)"""
+    checkpoints = JournalCheckpoint.objects.using(db_for_game(game_id)).filter(game_id=game_id)
+    if version is not None:
+        checkpoints = checkpoints.filter(version__lte=version)
+    latest = checkpoints.order_by('-version').first()
+    if latest is None:
+        return Replay.start(game_id)
+    return Replay.from_checkpoint(game_id, latest)
+
+
+def rebuild(game_id, version=None):
+    """
+    Rebuild a game from its latest checkpoint plus the trailing events.
+
+    Args:
+        game_id: Game to rebuild
+        version: Version to stop at, defaults to the latest recorded one
+
+    Returns:
+        Replay with the board, status and version reached
+
+    Raises:
+        JournalError: If events are missing (e.g. games started before the journal existed)
+    """
+    replay = _starting_point(game_id, version)
+    events = GameEvent.objects.using(db_for_game(game_id)).filter(game_id=game_id, version__gt=replay.version)
+    if version is not None:
+        events = events.filter(version__lte=version)
+    for event in events.order_by('version').values_list(*EVENT_FIELDS).iterator():
+        replay.apply(*event)
+    if version is not None and replay.version != version:
+        raise JournalError(f'Journal ends at version {replay.version}')
+    return replay
+
+
+def replay_events(game_id):
+    """
+    Stream a game from its first event: returns an iterator of one dict per
+    event with the squares of all pieces afterwards.
+
+    Raises:
+        JournalError: If the journal does not start at the game's first version
+    """
+    events = GameEvent.objects.using(db_for_game(game_id)).filter(game_id=game_id).order_by('version')
+    first = events.values_list('version', flat=True).first()
+    if first not in (None, 1):
+        raise JournalError(f'Journal starts at version {first}, the game predates the journal')
+    return _replay_stream(Replay.start(game_id), events)
+
+
+def _replay_stream(replay, events):
+    """Yield the start state, then the state after every event"""
+    yield {'version': 0, 'kind': 'start', 'squares': replay.squares()}
+    for event in events.values_list(*EVENT_FIELDS).iterator():
+        version, kind, seat, dice_value, piece, captured = event
+        hits = replay.apply(*event)
+        yield {
+            'version': version,
+            'kind': kind,
+            'seat': seat,
+            'dice_value': dice_value,
+            'piece': piece,
+            'captured': hits,
+            'recorded_captured': captured_indexes(captured),
+            'turn': replay.board.turn,
+            'status': replay.status,
+            'squares': replay.squares(),
+        }
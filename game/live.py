@@ -0,0 +1,122 @@
+"""
+Live Events Module
+==================
+
+Streams live game updates (Server-Sent Events) straight from the event
+loop, in front of Django's ASGI handler.
+
+How it works:
+    - with_live_events() wraps the ASGI application (dont_b_mad/asgi.py):
+      GET requests resolving to the game_events URL are answered here,
+      everything else goes to Django
+    - The stream skips the request_started signal, the middleware chain
+      and their sync_to_async hops, so a held stream costs a coroutine and
+      its broker queue instead of worker threads
+    - The stream ends when the client disconnects (http.disconnect)
+    - Unknown games are passed on to Django, whose view answers 404 like
+      the state endpoint
+    - Elsewhere (WSGI, or Django's ASGI handler alone) the URL is served by
+      views.game_events, with the same event_stream()
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import asyncio
+from contextlib import suppress
+
+from django.urls import Resolver404, resolve
+
+from .broker import broker
+from .models import Game
+from .shards import db_for_game
+
+
+# Reconnect delay sent to EventSource clients, and idle time after which a
+# comment line is sent so proxies do not close the connection
+SSE_RETRY_MS = 3000
+SSE_KEEPALIVE_SECONDS = 15
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+async def event_stream(game_id):
+    """Server-Sent Events messages of a game, as published to the broker, until closed"""
+    queue = broker.subscribe(game_id)
+    try:
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing idle connections
+                yield ': keepalive\n\n'
+                continue
+            yield message
+    finally:
+        broker.unsubscribe(game_id, queue)
+
+
+def events_game_id(scope):
+    """Game id of an ASGI request for the game_events URL, or None for any other request"""
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return None
+    path = scope['path']
+    root_path = scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None
+    return match.kwargs['game_id'] if match.url_name == 'game_events' else None
+
+
+async def game_exists(game_id):
+    """Whether a game exists (one async ORM query on its shard)"""
+    return await Game.objects.using(db_for_game(game_id)).filter(id=game_id).aexists()
+
+
+async def _disconnected(receive):
+    """Wait until the client has gone"""
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def serve_events(game_id, receive, send):
+    """Send a game's event stream as the response of an ASGI request"""
+    await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+    messages = event_stream(game_id)
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    message = None
+    try:
+        while True:
+            message = asyncio.ensure_future(messages.__anext__())
+            await asyncio.wait([message, disconnected], return_when=asyncio.FIRST_COMPLETED)
+            if not message.done():
+                break  # Client gone
+            await send({'type': 'http.response.body', 'body': message.result().encode(), 'more_body': True})
+    finally:
+        # Stopping the pending read ends the generator, which unsubscribes from the broker
+        for task in (disconnected, message):
+            if task is not None and not task.done():
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        await messages.aclose()
+
+
+def with_live_events(application):
+    """ASGI application serving game_events streams itself and passing other requests to application"""
+
+    async def live_events_application(scope, receive, send):
+        game_id = events_game_id(scope)
+        if game_id is None or not await game_exists(game_id):
+            await application(scope, receive, send)
+        else:
+            await serve_events(game_id, receive, send)
+
+    return live_events_application
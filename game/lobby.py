@@ -0,0 +1,139 @@
+"""
+Lobby Module
+============
+
+Lists the open games for the home page and its JSON feed, one page at a
+time, in constant time however many games were ever played.
+
+How it works:
+    - Games are ordered newest first by (created_at, id); a page continues
+      after a cursor naming the last game shown (keyset pagination, no OFFSET)
+    - Every status and shard is read with its own query, a range scan of
+      the (status, created_at, id) index limited to one page, and the
+      results are merged
+    - Player count and current player come from subqueries of the same
+      query; the packed board and other turn fields are not loaded
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import heapq
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from django.db.models import Count, OuterRef, Subquery
+from django.urls import reverse
+from django.utils import dateformat, timezone as django_timezone
+
+from .models import Game, Player
+from .shards import game_shards
+
+
+# Games listed in the lobby
+LOBBY_STATUSES = ('waiting', 'in_progress')
+
+# Games per page, by default and at most (?limit= of the JSON feed)
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Game fields the lobby shows
+LOBBY_FIELDS = ['id', 'status', 'created_at', 'current_player_index']
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Bounds of a cursor's fields: the datetime range and a positive 64-bit id
+_MIN_MICROS = (datetime.min.replace(tzinfo=timezone.utc) - _EPOCH) // _MICROSECOND
+_MAX_MICROS = (datetime.max.replace(tzinfo=timezone.utc) - _EPOCH) // _MICROSECOND
+_MAX_GAME_ID = 2 ** 63 - 1
+
+# One page of games, and the cursor of the next page (None on the last page)
+LobbyPage = namedtuple('LobbyPage', ['games', 'next_cursor'])
+
+
+def encode_cursor(game):
+    """Cursor continuing after game: "<created_at in microseconds>-<id>\""""
+    return f'{(game.created_at - _EPOCH) // _MICROSECOND}-{game.id}'
+
+
+def decode_cursor(cursor):
+    """
+    (created_at, id) of a cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed or out of range
+    """
+    micros, separator, game_id = cursor.partition('-')
+    if not separator:
+        raise ValueError(f'Invalid lobby cursor {cursor!r}')
+    micros, game_id = int(micros), int(game_id)
+    if not (_MIN_MICROS <= micros <= _MAX_MICROS and 1 <= game_id <= _MAX_GAME_ID):
+        raise ValueError(f'Lobby cursor {cursor!r} out of range')
+    try:
+        return _EPOCH + micros * _MICROSECOND, game_id
+    except OverflowError as error:
+        raise ValueError(f'Lobby cursor {cursor!r} out of range') from error
+
+
+def lobby_queryset(db, status):
+    """Games of one status on one shard, newest first, with player count and current player"""
+    players = Player.objects.using(db).filter(game=OuterRef('pk'))
+    current = players.filter(order=OuterRef('current_player_index'))
+    return (
+        Game.objects.using(db)
+        .filter(status=status)
+        .only(*LOBBY_FIELDS)
+        .annotate(
+            player_count=Subquery(players.order_by().values('game').annotate(count=Count('pk')).values('count')),
+            current_player_name=Subquery(current.values('name')[:1]),
+            current_player_color=Subquery(current.values('color')[:1]),
+        )
+        .order_by('-created_at', '-id')
+    )
+
+
+def page(cursor=None, limit=PAGE_SIZE, statuses=LOBBY_STATUSES):
+    """
+    One page of open games from every shard, newest first.
+
+    Args:
+        cursor: next_cursor of the previous page, None for the first page
+        limit: Games per page
+
+    Returns:
+        LobbyPage
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    querysets = []
+    for db in game_shards():
+        for status in statuses:
+            queryset = lobby_queryset(db, status)
+            if after is not None:
+                created_at, game_id = after
+                # A range on created_at (index scan), minus the games shown before on the same instant
+                queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=game_id)
+            querysets.append(queryset[:limit + 1])
+
+    merged = heapq.merge(*querysets, key=lambda game: (game.created_at, game.id), reverse=True)
+    games = list(islice(merged, limit + 1))
+    next_cursor = encode_cursor(games[limit - 1]) if len(games) > limit else None
+    return LobbyPage(games[:limit], next_cursor)
+
+
+def serialize_game(game):
+    """JSON fields of a lobby game (for the infinite scroll of the home page)"""
+    return {
+        'id': game.id,
+        'status': game.status,
+        'status_display': game.get_status_display(),
+        'created_at': game.created_at.isoformat(),
+        'created_display': dateformat.format(django_timezone.localtime(game.created_at), 'M d, Y H:i'),
+        'player_count': game.player_count,
+        'current_player': game.current_player_name,
+        'current_player_color': game.current_player_color,
+        'url': reverse('game_board', args=[game.id]),
+    }
@@ -0,0 +1,123 @@
+"""
+Benchmark the game endpoints through the test client and check query and latency budgets.
+
+Plays against the configured database; the benchmark games are deleted
+afterwards unless --keep-games is given. Refuses to run with DEBUG off
+unless the databases are test databases (benchmark.check_database).
+
+Usage:
+    python manage.py benchmark_endpoints
+    python manage.py benchmark_endpoints --tables 8 --bot-games 1 --output bench.json
+    python manage.py benchmark_endpoints --games 0 --roll-games 2
+    python manage.py benchmark_endpoints --baseline main.json --latency-tolerance 0.5
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Play games through the endpoints, report p50/p95/p99 latency and query counts, fail on regressions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', type=int, default=4, help='Tables playing concurrently (default: 4)')
+        parser.add_argument('--games', type=int, default=1,
+                            help='Games with four scripted players per table (default: 1)')
+        parser.add_argument('--bot-games', type=int, default=0,
+                            help='Games against computer players per table (default: 0)')
+        parser.add_argument('--roll-games', type=int, default=1,
+                            help='Games per table played through the roll endpoint instead of the turn endpoint '
+                                 '(default: 1)')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for dice and move choices')
+        parser.add_argument('--board-every', type=int, default=benchmark.DEFAULT_BOARD_EVERY,
+                            help=f'Moves between board page loads (default: {benchmark.DEFAULT_BOARD_EVERY})')
+        parser.add_argument('--max-requests', type=int, default=benchmark.DEFAULT_MAX_REQUESTS,
+                            help=f'Abandon a game after this many requests (default: {benchmark.DEFAULT_MAX_REQUESTS})')
+        parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', default=None, help='Results JSON of an earlier run to compare with')
+        parser.add_argument('--budgets', default=None,
+                            help='JSON file of query budgets by endpoint label, overriding the defaults')
+        parser.add_argument('--latency-tolerance', type=float, default=benchmark.DEFAULT_LATENCY_TOLERANCE,
+                            help='Allowed relative p95 increase over the baseline '
+                                 f'(default: {benchmark.DEFAULT_LATENCY_TOLERANCE})')
+        parser.add_argument('--keep-games', action='store_true', help='Do not delete the benchmark games')
+
+    def handle(self, *args, **options):
+        for option in ('tables', 'board_every', 'max_requests'):
+            if options[option] < 1:
+                raise CommandError(f'--{option.replace("_", "-")} must be at least 1')
+        counts = [options['games'], options['roll_games'], options['bot_games']]
+        if min(counts) < 0 or sum(counts) < 1:
+            raise CommandError('--games, --roll-games and --bot-games must not be negative and add up to at least 1')
+
+        budgets = dict(benchmark.QUERY_BUDGETS)
+        if options['budgets']:
+            budgets.update(self._read_json(options['budgets']))
+        baseline = self._read_json(options['baseline']) if options['baseline'] else None
+
+        try:
+            results = benchmark.run(
+                tables=options['tables'],
+                games=options['games'],
+                bot_games=options['bot_games'],
+                roll_games=options['roll_games'],
+                seed=options['seed'],
+                board_every=options['board_every'],
+                max_requests=options['max_requests'],
+                keep_games=options['keep_games'],
+            )
+        except benchmark.UnsafeDatabaseError as e:
+            raise CommandError(str(e))
+        self._print_table(results)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                json.dump(results, stream, indent=2)
+                stream.write('\n')
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if baseline:
+            keys = ('tables', 'games_per_table', 'roll_games_per_table', 'bot_games_per_table',
+                    'database', 'game_cache', 'board_storage')
+            changed = [key for key in keys if baseline.get('run', {}).get(key) != results['run'][key]]
+            if changed:
+                self.stderr.write(self.style.WARNING(
+                    f'Baseline was run with different settings ({", ".join(changed)}), latencies may not compare'
+                ))
+
+        failures = benchmark.check(results, budgets, baseline, options['latency_tolerance'])
+        if failures:
+            for failure in failures:
+                self.stderr.write(self.style.ERROR(failure))
+            raise CommandError(f'{len(failures)} budget regressions')
+        self.stdout.write(self.style.SUCCESS(
+            f'{results["requests"]} requests in {results["wall_seconds"]:.2f}s '
+            f'({results["requests_per_second"]} req/s), all within budget'
+        ))
+
+    def _read_json(self, path):
+        """Load a JSON file or raise CommandError"""
+        try:
+            with open(path, encoding='utf-8') as stream:
+                return json.load(stream)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+
+    def _print_table(self, results):
+        """One line per endpoint label"""
+        self.stdout.write(
+            f'{"endpoint":<22} {"requests":>8} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} '
+            f'{"p99 ms":>8} {"req/s":>8} {"queries":>9}'
+        )
+        for label, endpoint in results['endpoints'].items():
+            self.stdout.write(
+                f'{label:<22} {endpoint["requests"]:>8} {endpoint["errors"]:>6} '
+                f'{endpoint["p50_ms"]:>8.2f} {endpoint["p95_ms"]:>8.2f} {endpoint["p99_ms"]:>8.2f} '
+                f'{endpoint["requests_per_second"] or 0:>8.1f} '
+                f'{endpoint["queries_mean"]:>5.1f}/{endpoint["queries_max"]:<3}'
+            )
+        games = results['games']
+        self.stdout.write(f'{games["finished"]}/{games["played"]} games finished')
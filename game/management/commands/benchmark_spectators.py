@@ -0,0 +1,75 @@
+"""
+Compare the ASGI and the WSGI request path under many concurrent spectators of one game.
+
+Calls dont_b_mad's ASGI and WSGI applications in-process (no server needed)
+against the configured database; the benchmark game is deleted afterwards unless
+--keep-games is given. Refuses to run with DEBUG off unless the databases are
+test databases (benchmark.check_database).
+
+Usage:
+    python manage.py benchmark_spectators
+    python manage.py benchmark_spectators --spectators 5000 --polls 3 --wsgi-threads 16
+    python manage.py benchmark_spectators --output spectators.json
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Serve many concurrent spectators through the async and the sync path, report latency and capacity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spectators', type=int, default=benchmark.DEFAULT_SPECTATORS,
+                            help=f'Spectators watching at the same time (default: {benchmark.DEFAULT_SPECTATORS})')
+        parser.add_argument('--polls', type=int, default=benchmark.DEFAULT_POLLS,
+                            help=f'State polls per spectator (default: {benchmark.DEFAULT_POLLS})')
+        parser.add_argument('--wsgi-threads', type=int, default=benchmark.DEFAULT_WSGI_THREADS,
+                            help=f'Threads of the WSGI pool (default: {benchmark.DEFAULT_WSGI_THREADS})')
+        parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+        parser.add_argument('--keep-games', action='store_true', help='Do not delete the benchmark game')
+
+    def handle(self, *args, **options):
+        for option in ('spectators', 'polls', 'wsgi_threads'):
+            if options[option] < 1:
+                raise CommandError(f'--{option.replace("_", "-")} must be at least 1')
+
+        try:
+            results = benchmark.run_spectators(
+                spectators=options['spectators'],
+                polls=options['polls'],
+                wsgi_threads=options['wsgi_threads'],
+                keep_games=options['keep_games'],
+            )
+        except benchmark.UnsafeDatabaseError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f'{"path":<6} {"requests":>8} {"errors":>6} {"304s":>6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} '
+            f'{"p99 ms":>8} {"max ms":>8} {"streams":>8} {"threads":>8}'
+        )
+        for path in ('asgi', 'wsgi'):
+            summary = results[path]
+            self.stdout.write(
+                f'{path:<6} {summary["requests"]:>8} {summary["errors"]:>6} {summary["not_modified"]:>6} '
+                f'{summary["requests_per_second"] or 0:>8.1f} {summary["p50_ms"]:>8.2f} {summary["p95_ms"]:>8.2f} '
+                f'{summary["p99_ms"]:>8.2f} {summary["max_ms"]:>8.2f} {summary["streams_held"]:>8} '
+                f'{summary["peak_threads"]:>8}'
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                json.dump(results, stream, indent=2)
+                stream.write('\n')
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        errors = results['asgi']['errors'] + results['wsgi']['errors']
+        if errors:
+            raise CommandError(f'{errors} requests failed')
+        self.stdout.write(self.style.SUCCESS(
+            f'{results["run"]["spectators"]} spectators: {results["asgi"]["streams_held"]} live streams held '
+            f'on the async path with {results["asgi"]["peak_threads"]} threads'
+        ))
@@ -0,0 +1,43 @@
+"""
+Convert existing games between Piece rows and the packed Game.board field.
+
+Migration 0013 packs the existing games once when GAME_BOARD_STORAGE is
+'packed'; this command re-runs the conversion after the setting changed,
+in either direction.
+
+Stop the app servers first: running processes may hold cached games in
+the old storage mode.
+
+Usage:
+    python manage.py convert_board_storage packed
+    python manage.py convert_board_storage rows --batch-size 200
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import shards
+from game.snapshot import CONVERT_BATCH_SIZE, convert_board_storage
+
+
+class Command(BaseCommand):
+    help = 'Pack Piece rows into Game.board (packed) or unpack Game.board into Piece rows (rows)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('storage', choices=['packed', 'rows'], help='Storage mode to convert to')
+        parser.add_argument('--batch-size', type=int, default=CONVERT_BATCH_SIZE,
+                            help=f'Games converted per transaction (default: {CONVERT_BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        converted = 0
+        for db in shards.game_shards():
+            done = converted
+            converted += convert_board_storage(
+                db, options['storage'], batch_size,
+                report=lambda count: self.stdout.write(f'Converted {done + count} games'),
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'{converted} games now use {options["storage"]} storage'))
@@ -0,0 +1,60 @@
+"""
+Write right-sized WebP/AVIF variants of static/images and the sprite sheets
+(game.views.SPRITE_SHEETS) with hashed names and a manifest.
+
+Run before collectstatic on deploy, then restart the app servers so they
+read the new manifest.
+
+Usage:
+    python manage.py optimize_images
+    python manage.py optimize_images --formats webp --quality webp=75
+    python manage.py optimize_images --force
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import images
+from game.views import SPRITE_SHEETS
+
+
+class Command(BaseCommand):
+    help = 'Generate sized image variants, dice and team sprite sheets and static/variants/manifest.json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formats', nargs='+', choices=images.FORMATS, default=None,
+                            help='Formats to write (default: every format Pillow supports)')
+        parser.add_argument('--quality', nargs='+', default=[], metavar='FORMAT=QUALITY',
+                            help='Encoder quality per format, e.g. webp=75 avif=50')
+        parser.add_argument('--force', action='store_true', help='Encode unchanged images again')
+
+    def handle(self, *args, **options):
+        if images.Image is None:
+            raise CommandError('Generating image variants requires Pillow: pip install Pillow')
+
+        quality = {}
+        for item in options['quality']:
+            fmt, _, value = item.partition('=')
+            if fmt not in images.FORMATS or not value.isdigit() or not 1 <= int(value) <= 100:
+                raise CommandError(f'Invalid --quality {item!r}, expected e.g. webp=80')
+            quality[fmt] = int(value)
+
+        available = images.available_formats()
+        formats = options['formats'] or available
+        missing = [fmt for fmt in formats if fmt not in available]
+        if missing:
+            raise CommandError(f'This Pillow build cannot encode {", ".join(missing)}')
+        if not formats:
+            raise CommandError('This Pillow build can encode neither AVIF nor WebP')
+        if 'avif' not in formats:
+            self.stdout.write(self.style.WARNING('Writing without AVIF, browsers get the WebP variants'))
+
+        stats = images.generate(formats=formats, quality=quality, force=options['force'], sprites=SPRITE_SHEETS)
+
+        for path in stats['skipped']:
+            self.stdout.write(self.style.WARNING(f'Skipped {path}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats["encoded"]} images encoded, {stats["reused"]} unchanged, {stats["sprites"]} sprite sheets; '
+            f'sources {stats["source_bytes"] / 1024:,.0f} KiB, '
+            f'token variants {stats["token_bytes"] / 1024:,.0f} KiB, '
+            f'manifest at {images.OUTPUT_DIR / images.MANIFEST_NAME}'
+        ))
@@ -0,0 +1,61 @@
+"""
+Pre-create games for events.
+
+Usage:
+    python manage.py provision_games 500
+    python manage.py provision_games 2000 --players Anna Boris Cveta Dimo --batch-size 250
+    python manage.py provision_games 100 --players Anna --fill-with-bots
+    python manage.py provision_games 500 --top-up
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.provisioning import create_games, unplayed_games
+
+
+class Command(BaseCommand):
+    help = 'Create N in-progress games with 4 players each using bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='Number of games to create')
+        parser.add_argument('--players', nargs='+', default=None, help='Player names used for every game')
+        parser.add_argument('--fill-with-bots', action='store_true',
+                            help='Seats without a --players name are computer players')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Games created per transaction (default: 500)')
+        parser.add_argument('--top-up', action='store_true',
+                            help='Only create the games missing for count unplayed games, so re-runs add nothing')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        batch_size = options['batch_size']
+        if count < 1:
+            raise CommandError('count must be at least 1')
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        if options['top_up']:
+            existing = unplayed_games()
+            if existing >= count:
+                self.stdout.write(self.style.SUCCESS(f'{existing} unplayed games already provisioned'))
+                return
+            count -= existing
+
+        started = time.perf_counter()
+        first_id = last_id = None
+        created = 0
+        while created < count:
+            games = create_games(
+                min(batch_size, count - created), options['players'], options['fill_with_bots']
+            )
+            first_id = games[0].id if first_id is None else first_id
+            last_id = games[-1].id
+            created += len(games)
+            self.stdout.write(f'Created {created}/{count} games')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Provisioned {created} games (ids {first_id}-{last_id}) in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,113 @@
+"""
+Move games to the shard their id maps to, after settings.GAME_SHARDS changed.
+
+Stop the app servers first (their caches flush piece rows to the shard a
+game was on) and migrate every new shard (migrate --database <alias>).
+Each game is copied with its players, pieces and journal in one
+transaction on the target, then deleted from the source; an interrupted
+run can simply be repeated.
+
+Usage:
+    python manage.py rebalance_shards --dry-run
+    python manage.py rebalance_shards
+    python manage.py rebalance_shards --drain games_3
+"""
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from game import shards
+from game.models import Game, GameEvent, JournalCheckpoint, Piece, Player
+from game.provisioning import insert_with_ids
+
+
+class Command(BaseCommand):
+    help = 'Move games (players, pieces and journal included) to the shard given by their id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drain', nargs='+', default=[], metavar='ALIAS',
+                            help='Also move all games off these databases (shards removed from GAME_SHARDS)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Game ids read per query (default: 500)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the games that would move')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        unknown = [alias for alias in options['drain'] if alias not in connections]
+        if unknown:
+            raise CommandError(f'Unknown database: {", ".join(unknown)}')
+
+        moves = Counter()
+        sources = list(dict.fromkeys(shards.game_shards() + options['drain']))
+        for source in sources:
+            last_id = 0
+            while True:
+                ids = list(
+                    Game.objects.using(source).filter(id__gt=last_id)
+                    .order_by('id').values_list('id', flat=True)[:batch_size]
+                )
+                if not ids:
+                    break
+                last_id = ids[-1]
+                for game_id in ids:
+                    target = shards.db_for_game(game_id)
+                    if target == source:
+                        continue
+                    if not options['dry_run']:
+                        self._move(game_id, source, target)
+                    moves[source, target] += 1
+
+        if not options['dry_run']:
+            shards.reset_game_ids()
+
+        for (source, target), count in sorted(moves.items()):
+            self.stdout.write(f'{source} -> {target}: {count} games')
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {sum(moves.values())} games, shards: {", ".join(shards.game_shards())}'
+        ))
+
+    def _move(self, game_id, source, target):
+        """
+        Copy one game to target, then delete it on source.
+
+        Players, pieces and journal rows get new ids on target (ids are only
+        unique per database); the journal refers to pieces by index, and
+        clients pick up the new piece ids when they reload the board.
+        """
+        game = Game.objects.using(source).get(id=game_id)
+        players = list(Player.objects.using(source).filter(game_id=game_id).order_by('order'))
+        pieces = list(Piece.objects.using(source).filter(player__game_id=game_id))
+        events = list(GameEvent.objects.using(source).filter(game_id=game_id))
+        checkpoints = list(JournalCheckpoint.objects.using(source).filter(game_id=game_id))
+
+        # Inserts stamp auto_now_add fields, the original times are written back
+        created = [(row, row.created_at) for row in [game] + events]
+
+        with transaction.atomic(using=target):
+            # Leftovers of an interrupted run are replaced
+            Game.objects.using(target).filter(id=game_id).delete()
+            game.save(using=target, force_insert=True)
+
+            old_ids = [player.id for player in players]
+            for row in players + pieces + events + checkpoints:
+                row.pk = None
+                row._state.adding = True
+            new_ids = dict(zip(old_ids, (player.id for player in insert_with_ids(players, target))))
+            for piece in pieces:
+                piece.player_id = new_ids[piece.player_id]
+            Piece.objects.using(target).bulk_create(pieces)
+            insert_with_ids(events, target)
+            JournalCheckpoint.objects.using(target).bulk_create(checkpoints)
+
+            for row, created_at in created:
+                row.created_at = created_at
+            Game.objects.using(target).filter(id=game_id).update(created_at=game.created_at)
+            GameEvent.objects.using(target).bulk_update(events, ['created_at'])
+
+        with transaction.atomic(using=source):
+            Game.objects.using(source).filter(id=game_id).delete()
@@ -0,0 +1,59 @@
+"""
+Rebuild a game from its move journal, e.g. to settle a disputed game.
+
+Usage:
+    python manage.py replay_game 42
+    python manage.py replay_game 42 --at-version 120
+    python manage.py replay_game 42 --events
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import journal, rules, shards
+from game.models import Game
+
+
+class Command(BaseCommand):
+    help = 'Rebuild a game from its latest journal checkpoint and trailing events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_id', type=int, help='Game to rebuild')
+        parser.add_argument('--at-version', type=int, default=None,
+                            help='Rebuild the state at this version (default: latest)')
+        parser.add_argument('--events', action='store_true',
+                            help='Print every event from the start of the game')
+
+    def handle(self, *args, **options):
+        game_id = options['game_id']
+        try:
+            game = Game.objects.using(shards.db_for_game(game_id)).get(id=game_id)
+        except Game.DoesNotExist:
+            raise CommandError(f'Game {game_id} does not exist')
+
+        try:
+            if options['events']:
+                for event in journal.replay_events(game_id):
+                    if event['kind'] == 'start':
+                        continue
+                    captured = f" captured {event['captured']}" if event['captured'] else ''
+                    piece = '' if event['piece'] is None else f" piece {event['piece']}"
+                    self.stdout.write(
+                        f"v{event['version']:>5} seat {event['seat']} {event['kind']:<4} "
+                        f"dice {event['dice_value']}{piece}{captured}"
+                    )
+            replay = journal.rebuild(game_id, options['at_version'])
+        except journal.JournalError as e:
+            raise CommandError(str(e))
+
+        board = replay.board
+        self.stdout.write(f'Game {game_id} at version {replay.version} ({replay.status}), '
+                          f'turn: seat {board.turn}, dice: {board.dice}')
+        for seat in range(board.seats):
+            first = seat * rules.PIECES_PER_PLAYER
+            squares = [board.square(index) for index in range(first, first + rules.PIECES_PER_PLAYER)]
+            self.stdout.write(f'  seat {seat} ({rules.COLORS[board.colors[seat]]}): squares {squares}')
+
+        if options['at_version'] is None and replay.version != game.version:
+            self.stdout.write(self.style.WARNING(
+                f'Journal ends at version {replay.version}, the game is at version {game.version}'
+            ))
@@ -0,0 +1,128 @@
+"""
+Simulate many games headlessly and report win rates, captures and game length.
+
+Usage:
+    python manage.py simulate_games 1000000 --seed 42
+    python manage.py simulate_games 10000000 --workers 8 --format csv --output report.csv
+"""
+
+import csv
+import io
+import json
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import rules
+from game import simulation
+
+
+class Command(BaseCommand):
+    help = 'Run a Monte Carlo simulation over a process pool and write a JSON or CSV report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('games', type=int, help='Number of games to simulate')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Root seed; the same seed and shard size reproduce a run (default: random)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (default: number of CPUs)')
+        parser.add_argument('--shard-size', type=int, default=simulation.DEFAULT_SHARD_SIZE,
+                            help=f'Games per worker task (default: {simulation.DEFAULT_SHARD_SIZE})')
+        parser.add_argument('--batch-size', type=int, default=simulation.DEFAULT_BATCH_SIZE,
+                            help=f'Games simulated side by side in memory (default: {simulation.DEFAULT_BATCH_SIZE})')
+        parser.add_argument('--max-rolls', type=int, default=simulation.DEFAULT_MAX_ROLLS,
+                            help=f'Abandon games after this many rolls (default: {simulation.DEFAULT_MAX_ROLLS})')
+        parser.add_argument('--policy', choices=simulation.POLICIES, default='random',
+                            help='Move selection policy (default: random)')
+        parser.add_argument('--players', type=int, default=4, help='Players per game, 2-4 (default: 4)')
+        parser.add_argument('--format', choices=['json', 'csv'], default='json', help='Report format')
+        parser.add_argument('--output', default=None, help='Report file (default: stdout)')
+
+    def handle(self, *args, **options):
+        if simulation.np is None:
+            raise CommandError('The simulator requires NumPy: pip install numpy')
+
+        games = options['games']
+        if games < 1:
+            raise CommandError('games must be at least 1')
+        for option in ('shard_size', 'batch_size', 'max_rolls'):
+            if options[option] < 1:
+                raise CommandError(f'--{option.replace("_", "-")} must be at least 1')
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        if not 2 <= options['players'] <= len(rules.COLORS):
+            raise CommandError('--players must be between 2 and 4')
+
+        # Without a seed, draw one and report it so the run can be repeated
+        seed = options['seed']
+        if seed is None:
+            seed = simulation.np.random.SeedSequence().entropy
+
+        # Progress goes to stderr when the report is written to stdout
+        progress = self.stderr if options['output'] is None else self.stdout
+        started = time.perf_counter()
+        result = None
+        for done, result in simulation.simulate_parallel(
+            games,
+            seed,
+            workers=options['workers'],
+            shard_size=options['shard_size'],
+            policy=options['policy'],
+            players=options['players'],
+            batch_size=options['batch_size'],
+            max_rolls=options['max_rolls'],
+        ):
+            elapsed = time.perf_counter() - started
+            progress.write(f'Simulated {done}/{games} games ({done / elapsed:,.0f} games/s)')
+        elapsed = time.perf_counter() - started
+
+        report = result.to_dict()
+        report['run'] = {
+            'seed': seed,
+            'policy': options['policy'],
+            'players': options['players'],
+            'workers': options['workers'] or multiprocessing.cpu_count(),
+            'shard_size': options['shard_size'],
+            'max_rolls': options['max_rolls'],
+            'elapsed_seconds': round(elapsed, 3),
+            'games_per_second': round(games / elapsed, 1) if elapsed else None,
+        }
+
+        text = self._format_report(report, options['format'])
+        if options['output'] is None:
+            self.stdout.write(text, ending='')
+        else:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as stream:
+                stream.write(text)
+            progress.write(self.style.SUCCESS(
+                f'Simulated {games} games in {elapsed:.2f}s, report written to {options["output"]}'
+            ))
+
+    def _format_report(self, report, report_format):
+        """Render the report as JSON or as one CSV row per seat"""
+        if report_format == 'json':
+            return json.dumps(report, indent=2) + '\n'
+
+        stream = io.StringIO()
+        writer = csv.writer(stream)
+        writer.writerow([
+            'seat', 'color', 'games', 'finished', 'wins', 'win_rate',
+            'captures', 'captures_per_game', 'mean_length', 'length_p50', 'length_p95', 'seed',
+        ])
+        for seat in range(report['run']['players']):
+            writer.writerow([
+                seat,
+                rules.COLORS[seat],
+                report['games'],
+                report['finished'],
+                report['wins_by_seat'][seat],
+                f"{report['win_rate_by_seat'][seat]:.6f}",
+                report['captures_by_seat'][seat],
+                f"{report['captures_by_seat'][seat] / report['games']:.6f}",
+                f"{report['mean_length']:.3f}",
+                report['length_p50'],
+                report['length_p95'],
+                report['run']['seed'],
+            ])
+        return stream.getvalue()
@@ -0,0 +1,299 @@
+"""
+Request Metrics Module
+======================
+
+Per-view request counts, latency, SQL queries and response sizes,
+exposed in the Prometheus text format at /metrics.
+
+How it works:
+    - MetricsMiddleware times every request and labels it with the name of
+      the view it resolved to (e.g. game_board) and its HTTP method (unknown
+      methods count as "other"), so label values stay few
+    - SQL queries are counted by a database execute wrapper that every new
+      connection gets (connection_created signal). It charges the query to
+      the request in a context variable, which also follows the async ORM
+      into its worker thread
+    - Histograms and counters live in memory, per process: scrape every
+      worker, or read them as per-worker numbers
+    - With GAME_METRICS['ENABLED'] off, the middleware removes itself at
+      startup (MiddlewareNotUsed), no wrapper is installed and /metrics
+      answers 404, so requests pay nothing
+
+Metrics:
+    - http_requests_total{view, method, status}
+    - http_request_duration_seconds{view, method} (histogram)
+    - http_request_db_queries{view} (histogram of queries per request)
+    - http_request_db_duration_seconds_total{view}
+    - http_response_size_bytes{view} (histogram, not for streamed responses)
+    - game_cache_hits_total, game_cache_misses_total, game_cache_entries,
+      game_cache_pending_flush
+
+Streamed responses (Server-Sent Events, replays) are timed until their
+headers are ready.
+
+Configuration (settings.GAME_METRICS):
+    ENABLED, TOKEN (if set, /metrics requires "Authorization: Bearer <token>")
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    'TOKEN': None,
+}
+
+# Histogram upper bounds (Prometheus "le" labels)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Label for requests that matched no URL pattern
+UNMATCHED = 'unmatched'
+
+# HTTP methods with their own label value, any other method is counted as OTHER_METHOD
+METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+OTHER_METHOD = 'other'
+
+
+def metrics_settings():
+    """GAME_METRICS settings merged over the defaults"""
+    return {**DEFAULTS, **getattr(settings, 'GAME_METRICS', {})}
+
+
+def enabled():
+    """Whether requests are measured and /metrics is served"""
+    return metrics_settings()['ENABLED']
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot: above every bound (+Inf)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Count one value"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """(le, cumulative count) pairs, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """Thread-safe store of the request metrics of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self.requests = defaultdict(int)  # (view, method, status) -> count
+            self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (view, method)
+            self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))  # view
+            self.db_seconds = defaultdict(float)  # view
+            self.sizes = defaultdict(lambda: Histogram(SIZE_BUCKETS))  # view
+
+    def observe(self, view, method, status, seconds, queries, db_seconds, size=None):
+        """Record one finished request"""
+        with self._lock:
+            self.requests[view, method, status] += 1
+            self.latency[view, method].observe(seconds)
+            self.queries[view].observe(queries)
+            self.db_seconds[view] += db_seconds
+            if size is not None:
+                self.sizes[view].observe(size)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            _counter(lines, 'http_requests_total', 'Requests by view, method and status',
+                     (({'view': view, 'method': method, 'status': status}, count)
+                      for (view, method, status), count in sorted(self.requests.items())))
+            _histogram(lines, 'http_request_duration_seconds', 'Request latency in seconds',
+                       (({'view': view, 'method': method}, histogram)
+                        for (view, method), histogram in sorted(self.latency.items())))
+            _histogram(lines, 'http_request_db_queries', 'SQL queries per request',
+                       (({'view': view}, histogram) for view, histogram in sorted(self.queries.items())))
+            _counter(lines, 'http_request_db_duration_seconds_total', 'Time spent in SQL queries',
+                     (({'view': view}, seconds) for view, seconds in sorted(self.db_seconds.items())))
+            _histogram(lines, 'http_response_size_bytes', 'Response body size in bytes',
+                       (({'view': view}, histogram) for view, histogram in sorted(self.sizes.items())))
+        _game_cache_metrics(lines)
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+# =============================================================================
+# EXPOSITION FORMAT
+# =============================================================================
+
+def _labels(labels):
+    """Render a label set, escaping backslashes, quotes and newlines"""
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _number(value):
+    """Render a sample value"""
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _counter(lines, name, help_text, samples, kind='counter'):
+    """Append a counter (or gauge) family"""
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for labels, value in samples:
+        lines.append(f'{name}{_labels(labels)} {_number(value)}')
+
+
+def _histogram(lines, name, help_text, samples):
+    """Append a histogram family"""
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, histogram in samples:
+        count = 0
+        for bound, count in histogram.samples():
+            lines.append(f'{name}_bucket{_labels({**labels, "le": bound})} {count}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(histogram.sum)}')
+        lines.append(f'{name}_count{_labels(labels)} {count}')
+
+
+def _game_cache_metrics(lines):
+    """Append the hot game cache counters, read at scrape time"""
+    from .cache import game_cache
+
+    _counter(lines, 'game_cache_hits_total', 'Game loads served from the hot cache',
+             [({}, game_cache.hits)])
+    _counter(lines, 'game_cache_misses_total', 'Game loads that went to the database',
+             [({}, game_cache.misses)])
+    _counter(lines, 'game_cache_entries', 'Games held in the hot cache', [({}, len(game_cache))], 'gauge')
+    _counter(lines, 'game_cache_pending_flush', 'Games with piece rows waiting for the flusher',
+             [({}, game_cache.pending())], 'gauge')
+
+
+# =============================================================================
+# QUERY COUNTING
+# =============================================================================
+
+class QueryCounter:
+    """SQL queries and their total time for one request"""
+
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+_current_counter = ContextVar('game_metrics_counter', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    """Database execute wrapper charging the query to the current request"""
+    counter = _current_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter.count += 1
+        counter.seconds += time.perf_counter() - started
+
+
+def _install_wrapper(sender, connection, **kwargs):
+    """connection_created receiver: count the queries of the new connection"""
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def install_query_counting():
+    """Count queries on connections opened from now on, and on this thread's open ones"""
+    connection_created.connect(_install_wrapper, dispatch_uid='game_metrics_count_query')
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(None, connection)
+
+
+# =============================================================================
+# MIDDLEWARE
+# =============================================================================
+
+class MetricsMiddleware:
+    """Record latency, queries and response size of every request (sync and async)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed('GAME_METRICS is disabled')
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install_query_counting()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        token = _current_counter.set(counter)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_counter.reset(token)
+        self._record(request, response, time.perf_counter() - started, counter)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        token = _current_counter.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_counter.reset(token)
+        self._record(request, response, time.perf_counter() - started, counter)
+        return response
+
+    def _record(self, request, response, seconds, counter):
+        """Store the measurements under the resolved view name"""
+        match = request.resolver_match
+        view = match.view_name if match is not None else UNMATCHED
+        method = request.method if request.method in METHODS else OTHER_METHOD
+        size = None if response.streaming else len(response.content)
+        registry.observe(view, method, str(response.status_code),
+                         seconds, counter.count, counter.seconds, size)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0003_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='piece',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_piece_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='is_bot',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_player_is_bot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('status', models.CharField(max_length=20)),
+                ('current_player_index', models.IntegerField(default=0)),
+                ('dice_value', models.IntegerField(default=0)),
+                ('progress', models.BinaryField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='game.game')),
+            ],
+            options={
+                'ordering': ['version'],
+                'unique_together': {('game', 'version')},
+            },
+        ),
+        migrations.CreateModel(
+            name='GameEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('roll', 'Roll'), ('move', 'Move'), ('pass', 'Pass'), ('quit', 'Quit')], max_length=4)),
+                ('seat', models.PositiveSmallIntegerField(default=0)),
+                ('dice_value', models.PositiveSmallIntegerField(default=0)),
+                ('piece', models.SmallIntegerField(blank=True, null=True)),
+                ('captured', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='game.game')),
+            ],
+            options={
+                'ordering': ['version'],
+                'unique_together': {('game', 'version')},
+            },
+        ),
+    ]
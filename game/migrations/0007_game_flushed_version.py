@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:10
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_pieces_flushed(apps, schema_editor):
+    # Pieces of existing games were written synchronously, they are up to date
+    Game = apps.get_model('game', 'Game')
+    Game.objects.using(schema_editor.connection.alias).update(flushed_version=F('version'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_game_journal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='flushed_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(mark_pieces_flushed, migrations.RunPython.noop),
+    ]
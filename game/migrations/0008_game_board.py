@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_game_flushed_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='board',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:16
+
+import struct
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_pieces_home(apps, schema_editor):
+    Player = apps.get_model('game', 'Player')
+    db = schema_editor.connection.alias
+    # Games with Piece rows
+    players = Player.objects.using(db).filter(game__board__isnull=True).annotate(
+        home=Count('pieces', filter=Q(pieces__in_home=True))
+    ).filter(home__gt=0)
+    for player in players.iterator():
+        Player.objects.using(db).filter(id=player.id).update(pieces_home=player.home)
+
+    # Packed games: one progress byte per piece in seat order, home from 40 on
+    for player in Player.objects.using(db).filter(game__board__isnull=False).select_related('game').iterator():
+        data = bytes(player.game.board)
+        count = len(data) // 5
+        progress = struct.unpack(f'<{count}b', data[:count])[player.order * 4:player.order * 4 + 4]
+        home = sum(1 for value in progress if value >= 40)
+        if home:
+            Player.objects.using(db).filter(id=player.id).update(pieces_home=home)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_game_board'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='pieces_home',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(count_pieces_home, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0009_player_pieces_home'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='tries',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
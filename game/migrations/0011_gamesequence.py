@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_game_tries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_gamesequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='game_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+"""
+Pack the boards of existing games into Game.board when
+settings.GAME_BOARD_STORAGE is 'packed', so that deployments that only run
+migrate convert them. With 'rows' nothing changes; convert_board_storage
+re-runs the conversion after the setting changes.
+
+Runs per database (migrate --database <shard>). Stop the app servers
+first: running processes may hold cached games in the old storage mode.
+"""
+
+from django.db import migrations
+
+
+def pack_existing_boards(apps, schema_editor):
+    # The conversion works on the current models (snapshots, journal
+    # catch-up), which match the schema as of this migration
+    from game.snapshot import board_storage, convert_board_storage
+
+    if board_storage() == 'packed':
+        convert_board_storage(schema_editor.connection.alias, 'packed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0012_game_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(pack_existing_boards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,136 @@
+"""
+Game Provisioning Module
+========================
+
+Creates games together with their players and pieces using bulk inserts.
+
+Features:
+    - One INSERT per table (Game, Player, Piece) for any number of games
+    - Everything runs inside a single transaction per shard (see game.shards;
+      with several shards the game ids are reserved up front)
+    - Used by the create_game view and the provision_games command; with
+      --top-up the command only creates the games missing from a target of
+      unplayed games (unplayed_games()), so it can be re-run safely
+    - Empty seats can be filled with computer players (see game.ai)
+    - With GAME_BOARD_STORAGE = 'packed' the board is packed into the Game
+      row and no Piece rows are created
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+from django.db import connections, transaction
+
+from . import rules, shards
+from .models import Game, Player, Piece
+from .snapshot import board_storage, initial_board
+
+
+DEFAULT_PLAYER_NAMES = ['Player 1', 'Player 2', 'Player 3', 'Player 4']
+BOT_NAME = 'Computer'
+
+
+def normalize_player_names(player_names):
+    """Fall back to default names unless at least 2 names were given"""
+    if not player_names or len(player_names) < 2:
+        return list(DEFAULT_PLAYER_NAMES)
+    return list(player_names)
+
+
+def seat_assignments(player_names=None, fill_with_bots=False):
+    """
+    Decide the (name, is_bot) of every seat.
+
+    Without bots, every color gets a human player as before. With bots,
+    empty or missing names become computer players, keeping at least one
+    human seat so that someone drives the game.
+    """
+    if not fill_with_bots:
+        names = normalize_player_names(player_names)
+        return [
+            (names[i] if i < len(names) and names[i] else f'Player {i+1}', False)
+            for i in range(len(rules.COLORS))
+        ]
+
+    names = [name.strip() for name in (player_names or [])[:len(rules.COLORS)]]
+    names += [''] * (len(rules.COLORS) - len(names))
+    if not any(names):
+        names[0] = DEFAULT_PLAYER_NAMES[0]
+    return [
+        (name, False) if name else (f'{BOT_NAME} ({color.title()})', True)
+        for name, color in zip(names, rules.COLORS)
+    ]
+
+
+def insert_with_ids(objects, db):
+    """Bulk insert objects so that their primary keys are set afterwards"""
+    if not objects:
+        return objects
+    if connections[db].features.can_return_rows_from_bulk_insert:
+        return type(objects[0]).objects.using(db).bulk_create(objects)
+    # Backends without RETURNING support need one INSERT per row
+    for obj in objects:
+        obj.save(using=db)
+    return objects
+
+
+def create_games(count, player_names=None, fill_with_bots=False):
+    """
+    Create count in-progress games with 4 players and 16 pieces each.
+
+    Args:
+        count: Number of games to create
+        player_names: Optional list of player names, shared by all games
+        fill_with_bots: Seats without a name are played by the computer
+
+    Returns:
+        List of created Game instances
+    """
+    seats = seat_assignments(player_names, fill_with_bots)
+    board = initial_board() if board_storage() == 'packed' else None
+
+    game_ids = shards.allocate_game_ids(count)
+    if game_ids is None:
+        games = [Game(status='in_progress', board=board) for _ in range(count)]
+        return _insert_games(games, seats, shards.game_shards()[0])
+
+    games = []
+    for db, ids in shards.by_shard(game_ids).items():
+        games += _insert_games([Game(id=game_id, status='in_progress', board=board) for game_id in ids], seats, db)
+    return sorted(games, key=lambda game: game.id)
+
+
+def _insert_games(games, seats, db):
+    """Insert unsaved games with their players and pieces into one database, in one transaction"""
+    with transaction.atomic(using=db):
+        games = insert_with_ids(games, db)
+
+        players = insert_with_ids([
+            Player(game=game, name=name, color=color, order=i, is_bot=is_bot)
+            for game in games
+            for i, (color, (name, is_bot)) in enumerate(zip(rules.COLORS, seats))
+        ], db)
+
+        if games[0].board is not None:
+            return games
+
+        # Create 4 pieces for each player, all in the starting area
+        Piece.objects.using(db).bulk_create([
+            Piece(player=player, piece_number=piece_num, position=rules.IN_START)
+            for player in players
+            for piece_num in range(rules.PIECES_PER_PLAYER)
+        ])
+
+    return games
+
+
+def unplayed_games():
+    """Number of games on every shard that are in progress but have no turn yet (version 0)"""
+    return sum(
+        Game.objects.using(db).filter(status='in_progress', version=0).count()
+        for db in shards.game_shards()
+    )
+
+
+def create_game(player_names=None, fill_with_bots=False):
+    """Create a single in-progress game"""
+    return create_games(1, player_names, fill_with_bots)[0]
@@ -0,0 +1,300 @@
+"""
+Rules Engine Module
+===================
+
+Pure-Python implementation of the movement rules, usable without Django.
+
+Board Layout:
+    - Main path: squares 0-39, shared by all colors
+    - Home lanes: red 40-43, blue 44-47, green 48-51, yellow 52-55
+    - Start area: square -1
+
+Progress Encoding:
+    Every piece is described by one small integer, its progress:
+    - -1: waiting in the start area
+    - 0-39: steps taken along the main path from the color's start square
+    - 40-43: steps taken into the color's home lane
+
+    The board square follows from the color and the progress, so a whole
+    game fits into 16 small integers plus the turn and the dice value.
+
+Turns:
+    A player without a legal move passes. A player that only a 6 can help
+    (rolls_allowed()) rolls up to ROLLS_FROM_START times before passing.
+
+Occupancy Index:
+    BoardState also keeps one bitmask of piece indexes per main path
+    square, updated by move(). Finding the pieces a move captures is a
+    single lookup instead of a scan over all pieces.
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+from array import array
+from collections import namedtuple
+
+
+# =============================================================================
+# BOARD CONSTANTS
+# =============================================================================
+
+COLORS = ('red', 'blue', 'green', 'yellow')
+COLOR_INDEX = {color: index for index, color in enumerate(COLORS)}
+
+START_SQUARES = (0, 10, 20, 30)
+HOME_STARTS = (40, 44, 48, 52)
+
+TRACK_LENGTH = 40
+HOME_LENGTH = 4
+LAST_STEP = TRACK_LENGTH + HOME_LENGTH - 1
+PIECES_PER_PLAYER = 4
+IN_START = -1
+ENTER_ROLL = 6
+
+# Rolls per turn for a player that only a 6 can help (pieces in start or stuck in home)
+ROLLS_FROM_START = 3
+
+
+# =============================================================================
+# TRANSITION TABLES
+# =============================================================================
+
+# Tables are indexed by (color, progress, dice value). Progress -1..43 maps
+# to slots 0..44 and dice values 0..6 are stored as-is (0 means "not rolled").
+PROGRESS_SLOTS = LAST_STEP + 2
+DICE_SLOTS = ENTER_ROLL + 1
+
+# Bitmask of the piece indexes of every seat, for the occupancy index
+SEAT_MASKS = tuple(((1 << PIECES_PER_PLAYER) - 1) << seat * PIECES_PER_PLAYER for seat in range(len(COLORS)))
+
+Transition = namedtuple('Transition', ['square', 'progress', 'enters_home', 'illegal'])
+
+
+def _compute_square(color, progress):
+    """Board square of a piece, computed from scratch"""
+    if progress < 0:
+        return IN_START
+    if progress < TRACK_LENGTH:
+        return (START_SQUARES[color] + progress) % TRACK_LENGTH
+    return HOME_STARTS[color] + progress - TRACK_LENGTH
+
+
+def _compute_advance(progress, dice_value):
+    """Progress after a move, computed from scratch, or None if illegal"""
+    # Can only leave start with a 6
+    if progress < 0:
+        return 0 if dice_value == ENTER_ROLL else None
+
+    # Pieces in home never move again, and a roll of 0 means "not rolled"
+    if progress >= TRACK_LENGTH or dice_value < 1:
+        return None
+
+    new_progress = progress + dice_value
+    if new_progress > LAST_STEP:
+        return None  # Can't move past home
+    return new_progress
+
+
+def _build_squares():
+    """Build the (color, progress) -> square table"""
+    return tuple(
+        _compute_square(color, progress)
+        for color in range(len(COLORS))
+        for progress in range(IN_START, LAST_STEP + 1)
+    )
+
+
+def _build_transitions():
+    """Build the (color, progress, dice) -> Transition table"""
+    table = []
+    for color in range(len(COLORS)):
+        for progress in range(IN_START, LAST_STEP + 1):
+            for dice_value in range(DICE_SLOTS):
+                new_progress = _compute_advance(progress, dice_value)
+                if new_progress is None:
+                    table.append(Transition(_compute_square(color, progress), progress, False, True))
+                else:
+                    enters_home = progress < TRACK_LENGTH <= new_progress
+                    table.append(Transition(_compute_square(color, new_progress), new_progress, enters_home, False))
+    return tuple(table)
+
+
+SQUARES = _build_squares()
+TRANSITIONS = _build_transitions()
+
+
+def transition(color, progress, dice_value):
+    """Look up the Transition for a color index, progress and dice value (0-6)"""
+    return TRANSITIONS[(color * PROGRESS_SLOTS + progress + 1) * DICE_SLOTS + dice_value]
+
+
+# =============================================================================
+# PIECE RULES
+# =============================================================================
+
+def square_for(color, progress):
+    """Get the board square of a piece from its color index and progress"""
+    return SQUARES[color * PROGRESS_SLOTS + progress + 1]
+
+
+def can_move(progress, dice_value):
+    """Check if a piece with the given progress can move by dice_value (0-6)"""
+    return not TRANSITIONS[(progress + 1) * DICE_SLOTS + dice_value].illegal
+
+
+# =============================================================================
+# BOARD STATE
+# =============================================================================
+
+class BoardState:
+    """
+    Compact, mutable state of one game.
+
+    Pieces are indexed seat * 4 + piece_number. ``colors`` maps every seat
+    (the player's ``order``) to its color index. ``occupancy`` holds, for
+    every main path square, the bitmask of the pieces standing on it; it is
+    built from ``progress`` here and kept in sync by move(), so assign new
+    progress values through the constructor rather than in place.
+    """
+    __slots__ = ('progress', 'colors', 'turn', 'dice', 'occupancy')
+
+    def __init__(self, progress=None, colors=(0, 1, 2, 3), turn=0, dice=0):
+        self.colors = tuple(colors)
+        if progress is None:
+            progress = [IN_START] * (len(self.colors) * PIECES_PER_PLAYER)
+        self.progress = array('b', progress)
+        self.turn = turn
+        self.dice = dice
+        self.occupancy = self._build_occupancy()
+
+    def _build_occupancy(self):
+        """Bitmask of the pieces on every main path square, computed from progress"""
+        occupancy = array('H', bytes(2 * TRACK_LENGTH))
+        colors = self.colors
+        for piece, value in enumerate(self.progress):
+            if 0 <= value < TRACK_LENGTH:
+                occupancy[SQUARES[colors[piece // PIECES_PER_PLAYER] * PROGRESS_SLOTS + value + 1]] |= 1 << piece
+        return occupancy
+
+    def __repr__(self):
+        return f"BoardState(progress={list(self.progress)}, turn={self.turn}, dice={self.dice})"
+
+    @property
+    def seats(self):
+        """Number of players in the game"""
+        return len(self.colors)
+
+    def copy(self):
+        """Return an independent copy of this state"""
+        clone = BoardState.__new__(BoardState)
+        clone.progress = array('b', self.progress)
+        clone.colors = self.colors
+        clone.turn = self.turn
+        clone.dice = self.dice
+        clone.occupancy = array('H', self.occupancy)
+        return clone
+
+    def color_of(self, piece):
+        """Get the color index of a piece"""
+        return self.colors[piece // PIECES_PER_PLAYER]
+
+    def square(self, piece):
+        """Get the board square of a piece"""
+        return square_for(self.colors[piece // PIECES_PER_PLAYER], self.progress[piece])
+
+    def in_home(self, piece):
+        """Check if a piece has reached its home lane"""
+        return self.progress[piece] >= TRACK_LENGTH
+
+    def can_move(self, piece, dice_value=None):
+        """Check if a piece can move with the given (or current) dice value"""
+        if dice_value is None:
+            dice_value = self.dice
+        return can_move(self.progress[piece], dice_value)
+
+    def movable_pieces(self, dice_value=None):
+        """Get the indexes of the current player's pieces that can move"""
+        if dice_value is None:
+            dice_value = self.dice
+        first = self.turn * PIECES_PER_PLAYER
+        progress = self.progress
+        return [piece for piece in range(first, first + PIECES_PER_PLAYER)
+                if can_move(progress[piece], dice_value)]
+
+    def rolls_allowed(self, seat):
+        """
+        Rolls a seat gets per turn to find a legal move: ROLLS_FROM_START if
+        no piece could move by 1-5 (all waiting in start or stuck at the end
+        of the home lane), otherwise one.
+        """
+        first = seat * PIECES_PER_PLAYER
+        progress = self.progress
+        for piece in range(first, first + PIECES_PER_PLAYER):
+            for dice_value in range(1, ENTER_ROLL):
+                if can_move(progress[piece], dice_value):
+                    return 1
+        return ROLLS_FROM_START
+
+    def move(self, piece, dice_value=None):
+        """
+        Move a piece and send captured opponents back to start.
+
+        Args:
+            piece: Index of the piece to move
+            dice_value: Dice value to move by, defaults to the current dice
+
+        Returns:
+            List of captured piece indexes, or None if the move is illegal
+        """
+        if dice_value is None:
+            dice_value = self.dice
+        progress = self.progress
+        colors = self.colors
+        seat = piece // PIECES_PER_PLAYER
+        old_progress = progress[piece]
+        entry = TRANSITIONS[(colors[seat] * PROGRESS_SLOTS + old_progress + 1) * DICE_SLOTS + dice_value]
+        if entry.illegal:
+            return None
+        progress[piece] = entry.progress
+
+        occupancy = self.occupancy
+        bit = 1 << piece
+        if 0 <= old_progress < TRACK_LENGTH:
+            occupancy[SQUARES[colors[seat] * PROGRESS_SLOTS + old_progress + 1]] &= ~bit
+        if entry.progress >= TRACK_LENGTH:
+            # Moving into home never captures
+            return []
+
+        target = entry.square
+        victims = occupancy[target] & ~SEAT_MASKS[seat]
+        # Entering the board never captures either
+        if old_progress < 0:
+            victims = 0
+        occupancy[target] = (occupancy[target] & ~victims) | bit
+
+        captured = []
+        while victims:
+            lowest = victims & -victims
+            other = lowest.bit_length() - 1
+            progress[other] = IN_START
+            captured.append(other)
+            victims ^= lowest
+        return captured
+
+    def end_turn(self):
+        """Pass the turn to the next player unless a 6 was rolled"""
+        if self.dice != ENTER_ROLL:
+            self.turn = (self.turn + 1) % len(self.colors)
+        self.dice = 0
+
+    def has_won(self, seat):
+        """Check if all pieces of a seat are in home"""
+        first = seat * PIECES_PER_PLAYER
+        return all(p >= TRACK_LENGTH for p in self.progress[first:first + PIECES_PER_PLAYER])
+
+    def winner(self):
+        """Get the seat that has won, or None"""
+        for seat in range(len(self.colors)):
+            if self.has_won(seat):
+                return seat
+        return None
@@ -0,0 +1,139 @@
+"""
+Game Shards Module
+==================
+
+Spreads games over several databases by game id, so that turns of
+different games commit to different SQLite files (or database servers)
+instead of queueing on one writer lock.
+
+How it works:
+    - settings.GAME_SHARDS lists database aliases; a game lives, with its
+      players, pieces and journal, on GAME_SHARDS[game_id % len(GAME_SHARDS)]
+    - Code working on one game reads and writes through db_for_game()
+      (Model.objects.using(db), transaction.atomic(using=db)); objects
+      loaded from a shard keep using it for related queries and saves
+    - With more than one shard, game ids come from a single counter in the
+      'default' database (GameSequence), so they are unique across shards
+    - The lobby (game.lobby) queries every shard and merges the results
+    - GameShardRouter (settings.DATABASE_ROUTERS) creates the game tables on
+      every shard and keeps users, sessions and the id counter on 'default'
+
+Changing GAME_SHARDS moves games to other shards: stop the app servers
+(they flush their cached games on exit), migrate new shards and run
+`python manage.py rebalance_shards`.
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models import F, Max
+
+from .models import Game, GameSequence
+
+
+# Apps created on every shard: the game tables and the user tables they refer to
+SHARD_APPS = ('game', 'auth', 'contenttypes')
+
+# Models of the game app that only exist on 'default'
+UNSHARDED_MODELS = ('gamesequence',)
+
+
+def game_shards():
+    """Database aliases games are spread over, in settings.GAME_SHARDS order"""
+    return getattr(settings, 'GAME_SHARDS', None) or [DEFAULT_DB_ALIAS]
+
+
+def db_for_game(game_id):
+    """Database alias of the shard that stores a game"""
+    shards = game_shards()
+    return shards[int(game_id) % len(shards)]
+
+
+def by_shard(game_ids):
+    """Group game ids by shard: {alias: [game_id, ...]}, in the order given"""
+    groups = defaultdict(list)
+    for game_id in game_ids:
+        groups[db_for_game(game_id)].append(game_id)
+    return dict(groups)
+
+
+def allocate_game_ids(count):
+    """
+    Reserve count consecutive game ids for new games.
+
+    Returns:
+        range of ids, or None with a single shard (its database numbers new games)
+    """
+    if len(game_shards()) == 1:
+        return None
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        # The UPDATE locks the counter row until the transaction ends
+        if not GameSequence.objects.filter(pk=1).update(last_id=F('last_id') + count):
+            _create_sequence()
+            GameSequence.objects.filter(pk=1).update(last_id=F('last_id') + count)
+        last_id = GameSequence.objects.values_list('last_id', flat=True).get(pk=1)
+    return range(last_id - count + 1, last_id + 1)
+
+
+def _create_sequence():
+    """Start the id counter after the highest game id on any shard (first game after sharding)"""
+    highest = max(
+        Game.objects.using(db).aggregate(highest=Max('id'))['highest'] or 0
+        for db in game_shards()
+    )
+    try:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            GameSequence.objects.create(pk=1, last_id=highest)
+    except IntegrityError:
+        pass  # Another request created it first
+
+
+def reset_game_ids():
+    """
+    Restart game numbering after games moved between shards: the id counter
+    is dropped (the next allocation continues after the highest id on any
+    shard) and database sequences are moved past explicitly inserted ids.
+    """
+    GameSequence.objects.filter(pk=1).delete()
+    for db in game_shards():
+        connection = connections[db]
+        statements = connection.ops.sequence_reset_sql(no_style(), [Game])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+class GameShardRouter:
+    """
+    Database router for sharded games (listed in settings.DATABASE_ROUTERS).
+
+    Queries are routed with .using(db_for_game(...)) by the code that knows
+    the game; the router places unsaved games by id and decides which
+    tables each database gets.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if isinstance(instance, Game) and instance._state.db is None and instance.pk is not None:
+            return db_for_game(instance.pk)
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A game's rows share one shard; rows on different databases cannot refer to each other
+        if obj1._state.db is None or obj2._state.db is None:
+            return None
+        return obj1._state.db == obj2._state.db
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in game_shards():
+            return None
+        if app_label == 'game':
+            return model_name not in UNSHARDED_MODELS
+        return app_label in SHARD_APPS
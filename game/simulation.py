@@ -0,0 +1,318 @@
+"""
+Monte Carlo Simulation Module
+=============================
+
+Headless simulator that plays many games at once as NumPy arrays, using
+the rules engine's transition tables (the same rules as
+rules.BoardState.move, which game.turns applies to real games).
+
+Features:
+    - games x seats x pieces progress array, vectorized dice, moves and captures
+    - Turns as on the server (game.turns): up to rules.ROLLS_FROM_START rolls
+      when only a 6 can help, and a roll without a legal move (a 6 included)
+      passes once the tries are used up
+    - Per-game square occupancy bitmasks and home counters, so captures and
+      wins are resolved without scanning all 16 pieces
+    - Per-square landing histogram (how often each special square is hit)
+    - Game length distribution, wins and captures per seat
+    - Deterministic for a given seed
+    - Sharded runs over a process pool (simulate_parallel), one child seed
+      per shard so results do not depend on the number of workers
+
+Requires NumPy (optional dependency, see requirements.txt).
+
+Example:
+    >>> from game.simulation import simulate
+    >>> result = simulate(100_000, seed=42)
+    >>> result.to_dict()['first_player_advantage']
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import multiprocessing
+
+from . import rules
+from .special_tasks import SPECIAL_TASKS
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional for the web app
+    np = None
+
+
+# Move-selection policies understood by simulate()
+POLICIES = ('random', 'leader')
+
+DEFAULT_BATCH_SIZE = 100_000
+DEFAULT_MAX_ROLLS = 5_000
+DEFAULT_SHARD_SIZE = 100_000
+
+
+def _require_numpy():
+    """Raise a helpful error when NumPy is not installed"""
+    if np is None:
+        raise ImportError('The simulator requires NumPy: pip install numpy')
+
+
+def _build_tables():
+    """Flat NumPy copies of rules.SQUARES and rules.TRANSITIONS (same indexing as rules.transition)"""
+    next_progress = np.array([entry.progress for entry in rules.TRANSITIONS], dtype=np.int8)
+    legal = np.array([not entry.illegal for entry in rules.TRANSITIONS], dtype=bool)
+    squares = np.array(rules.SQUARES, dtype=np.int8)
+    return next_progress, legal, squares
+
+
+class SimulationResult:
+    """Aggregated statistics of a batch of simulated games"""
+
+    def __init__(self, players=4):
+        _require_numpy()
+        self.players = players
+        self.games = 0
+        self.finished = 0
+        self.rolls = 0
+        self.wins_by_seat = np.zeros(players, dtype=np.int64)
+        self.captures_by_seat = np.zeros(players, dtype=np.int64)
+        self.square_hits = np.zeros(rules.TRACK_LENGTH, dtype=np.int64)
+        self.length_histogram = np.zeros(0, dtype=np.int64)
+
+    def add_lengths(self, lengths):
+        """Add finished game lengths (in dice rolls) to the histogram"""
+        self._add_length_counts(np.bincount(lengths))
+
+    def _add_length_counts(self, counts):
+        """Add a length histogram to this one, growing it when needed"""
+        if len(counts) > len(self.length_histogram):
+            counts = counts.astype(np.int64)
+            counts[:len(self.length_histogram)] += self.length_histogram
+            self.length_histogram = counts
+        else:
+            self.length_histogram[:len(counts)] += counts
+
+    def merge(self, other):
+        """Add the statistics of another result to this one"""
+        self.games += other.games
+        self.finished += other.finished
+        self.rolls += other.rolls
+        self.wins_by_seat += other.wins_by_seat
+        self.captures_by_seat += other.captures_by_seat
+        self.square_hits += other.square_hits
+        self._add_length_counts(other.length_histogram)
+        return self
+
+    def mean_length(self):
+        """Average number of dice rolls per finished game"""
+        if not self.finished:
+            return 0.0
+        return float(np.dot(np.arange(len(self.length_histogram)), self.length_histogram) / self.finished)
+
+    def length_percentile(self, percent):
+        """Game length (in rolls) below which the given percentage of finished games end"""
+        if not self.finished:
+            return 0
+        cumulative = np.cumsum(self.length_histogram)
+        return int(np.searchsorted(cumulative, self.finished * percent / 100.0))
+
+    def to_dict(self):
+        """Serializable summary"""
+        win_rates = self.wins_by_seat / self.finished if self.finished else np.zeros(self.players)
+        return {
+            'games': self.games,
+            'finished': self.finished,
+            'rolls': self.rolls,
+            'wins_by_seat': self.wins_by_seat.tolist(),
+            'win_rate_by_seat': win_rates.tolist(),
+            'win_rate_by_color': dict(zip(rules.COLORS, win_rates.tolist())),
+            'first_player_advantage': float(win_rates[0] - 1.0 / self.players) if self.finished else 0.0,
+            'captures_by_seat': self.captures_by_seat.tolist(),
+            'mean_length': self.mean_length(),
+            'length_p50': self.length_percentile(50),
+            'length_p95': self.length_percentile(95),
+            'length_histogram': self.length_histogram.tolist(),
+            'square_hits': self.square_hits.tolist(),
+            'special_square_hits': {
+                position: int(self.square_hits[position]) for position in sorted(SPECIAL_TASKS)
+            },
+        }
+
+
+def simulate(games, seed=None, policy='random', players=4,
+             batch_size=DEFAULT_BATCH_SIZE, max_rolls=DEFAULT_MAX_ROLLS):
+    """
+    Simulate games and aggregate their statistics.
+
+    Args:
+        games: Number of games to play
+        seed: Seed or numpy.random.SeedSequence for reproducible runs
+        policy: 'random' (any movable piece) or 'leader' (most advanced movable piece)
+        players: Number of seats (2-4), seat i plays rules.COLORS[i]
+        batch_size: Games simulated side by side in one array
+        max_rolls: Games still running after this many rolls are abandoned
+
+    Returns:
+        SimulationResult
+    """
+    _require_numpy()
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown policy {policy!r}, expected one of {POLICIES}')
+    if not 2 <= players <= len(rules.COLORS):
+        raise ValueError('players must be between 2 and 4')
+
+    rng = np.random.default_rng(seed)
+    tables = _build_tables()
+    result = SimulationResult(players)
+    remaining = games
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        _simulate_batch(size, rng, policy, players, max_rolls, tables, result)
+        remaining -= size
+    return result
+
+
+def _simulate_shard(task):
+    """Pool worker: simulate one shard with its own seed"""
+    games, seed, options = task
+    return simulate(games, seed=seed, **options)
+
+
+def simulate_parallel(games, seed, workers=None, shard_size=DEFAULT_SHARD_SIZE, **options):
+    """
+    Simulate games in shards over a process pool.
+
+    The seed is split into one child seed per shard (SeedSequence.spawn), so
+    a run is reproducible for the same seed and shard size whatever the
+    number of workers. Only the aggregated statistics of a shard leave its
+    worker, memory does not grow with the number of games.
+
+    Args:
+        games: Number of games to play
+        seed: Root seed (int or numpy.random.SeedSequence)
+        workers: Worker processes, defaults to the number of CPUs
+        shard_size: Games per shard (unit of work handed to a worker)
+        **options: Passed on to simulate() (policy, players, batch_size, max_rolls)
+
+    Yields:
+        Tuple of (games done, SimulationResult) after every finished shard;
+        the result object is the running total and is updated in place
+    """
+    _require_numpy()
+    if shard_size < 1:
+        raise ValueError('shard_size must be at least 1')
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    sizes = [shard_size] * (games // shard_size)
+    if games % shard_size:
+        sizes.append(games % shard_size)
+    tasks = [(size, child, options) for size, child in zip(sizes, root.spawn(len(sizes)))]
+
+    total = SimulationResult(options.get('players', 4))
+    workers = min(workers or multiprocessing.cpu_count(), len(tasks)) or 1
+    if workers == 1:
+        for task in tasks:
+            total.merge(_simulate_shard(task))
+            yield total.games, total
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(_simulate_shard, tasks):
+            total.merge(result)
+            yield total.games, total
+
+
+def _simulate_batch(size, rng, policy, players, max_rolls, tables, result):
+    """Play one batch of games to completion, adding their statistics to result"""
+    next_progress, legal_moves, squares = tables
+    per_seat = rules.PIECES_PER_PLAYER
+    slots = rules.PROGRESS_SLOTS
+    dice_slots = rules.DICE_SLOTS
+    piece_bits = np.uint16(1) << np.arange(players * per_seat, dtype=np.uint16)
+    seat_masks = piece_bits.reshape(players, per_seat).sum(axis=1, dtype=np.uint16)
+
+    # Per game: progress and board square of every piece (seat index == color index),
+    # a bitmask of the pieces on every main-path square and the pieces home per seat
+    progress = np.full((size, players, per_seat), rules.IN_START, dtype=np.int8)
+    board_squares = np.full((size, players, per_seat), rules.IN_START, dtype=np.int8)
+    occupancy = np.zeros((size, rules.TRACK_LENGTH), dtype=np.uint16)
+    home = np.zeros((size, players), dtype=np.int8)
+    turn = np.zeros(size, dtype=np.intp)
+    tries = np.zeros(size, dtype=np.int8)  # Rolls without a legal move in the current turn
+    rolls = np.zeros(size, dtype=np.int64)
+    result.games += size
+    steps = np.arange(1, rules.ENTER_ROLL)
+
+    while len(turn):
+        count = len(turn)
+        dice = rng.integers(1, rules.ENTER_ROLL + 1, size=count)
+
+        # Legal moves of the current seat's four pieces (legality does not depend on color)
+        own = progress[np.arange(count), turn]
+        slot = (own.astype(np.intp) + 1) * dice_slots
+        legal = legal_moves.take(slot + dice[:, None])
+        # rules.BoardState.rolls_allowed(): three rolls if no piece could move by 1-5
+        only_six = ~legal_moves.take(slot[:, :, None] + steps).any(axis=(1, 2))
+
+        if policy == 'random':
+            scores = np.where(legal, rng.random((count, per_seat), dtype=np.float32), -1.0)
+        else:
+            scores = np.where(legal, own, -2)
+        choice = scores.argmax(axis=1)
+
+        rows = np.flatnonzero(legal.any(axis=1))
+        movers = turn[rows]
+        pieces = choice[rows]
+        old = own[rows, pieces].astype(np.intp)
+        new = next_progress.take((movers * slots + old + 1) * dice_slots + dice[rows])
+        landed = squares.take(movers * slots + new + 1).astype(np.intp)
+        old_squares = board_squares[rows, movers, pieces]
+        progress[rows, movers, pieces] = new
+        board_squares[rows, movers, pieces] = landed
+        bits = piece_bits[movers * per_seat + pieces]
+
+        # Leave the old main-path square
+        leaving = old_squares >= 0
+        occupancy[rows[leaving], old_squares[leaving]] &= ~bits[leaving]
+
+        # Captures: only moves along the main path, never entering from start
+        on_track = new < rules.TRACK_LENGTH
+        capturing = np.flatnonzero(on_track & leaving)
+        victims = occupancy[rows[capturing], landed[capturing]] & ~seat_masks[movers[capturing]]
+        captured = victims != 0
+        if captured.any():
+            capture_rows = rows[capturing[captured]]
+            hit = (victims[captured, None] & piece_bits) != 0
+            hit_games, hit_pieces = np.nonzero(hit)
+            hit_rows = capture_rows[hit_games]
+            hit_seats, hit_numbers = np.divmod(hit_pieces, per_seat)
+            progress[hit_rows, hit_seats, hit_numbers] = rules.IN_START
+            board_squares[hit_rows, hit_seats, hit_numbers] = rules.IN_START
+            occupancy[capture_rows, landed[capturing[captured]]] &= ~victims[captured]
+            result.captures_by_seat += np.bincount(movers[capturing[captured]][hit_games], minlength=players)
+
+        # Arrive on the new main-path square, or count the piece as home
+        occupancy[rows[on_track], landed[on_track]] |= bits[on_track]
+        result.square_hits += np.bincount(landed[on_track], minlength=rules.TRACK_LENGTH)
+        entered_home = ~on_track
+        home[rows[entered_home], movers[entered_home]] += 1
+
+        # Winner: all four pieces of the mover in home
+        won = np.zeros(count, dtype=bool)
+        won[rows[entered_home]] = home[rows[entered_home], movers[entered_home]] == per_seat
+
+        rolls += 1
+        result.wins_by_seat += np.bincount(turn[won], minlength=players)
+        # A move keeps the turn on a 6; a roll without a move keeps it while tries are left, then passes
+        moved = np.zeros(count, dtype=bool)
+        moved[rows] = True
+        tries = np.where(moved, 0, tries + 1).astype(np.int8)
+        passed = ~moved & (tries >= np.where(only_six, rules.ROLLS_FROM_START, 1))
+        tries[passed] = 0
+        keep_turn = np.where(moved, dice == rules.ENTER_ROLL, ~passed)
+        turn = np.where(keep_turn, turn, (turn + 1) % players)
+
+        done = won | (rolls >= max_rolls)
+        if done.any():
+            result.finished += int(won.sum())
+            result.rolls += int(rolls[done].sum())
+            result.add_lengths(rolls[won])
+            keep = ~done
+            progress, board_squares, occupancy = progress[keep], board_squares[keep], occupancy[keep]
+            home, turn, tries, rolls = home[keep], turn[keep], tries[keep], rolls[keep]
@@ -0,0 +1,410 @@
+"""
+Game Snapshot Module
+====================
+
+Loads a game with all its players and pieces in a fixed number of queries
+and serializes it for the JSON endpoints.
+
+Features:
+    - One Game query (winner joined), one Player query, one Piece query
+    - Prefetch caches are filled, so Game/Player helpers such as
+      get_current_player(), next_turn() and check_winner() run without
+      further queries on a loaded snapshot
+    - Moves are applied in memory through the rules engine and written back
+      with a single bulk UPDATE
+    - The snapshot keeps its rules.BoardState (with the occupancy index) and
+      moves it along with the pieces, so it is built once per cached game,
+      not per request or per call
+    - Piece rows that lag behind the game version (write-behind, see
+      game.cache) are caught up from the move journal on load
+    - Packed games (Game.board set, no Piece rows) get unsaved Piece
+      instances built from the packed field, so the Piece API keeps working;
+      they refuse save() and delete() (Piece.packed)
+    - convert_board_storage() moves existing games between Piece rows and
+      Game.board (migration 0013 and the convert_board_storage command)
+    - Shared serializers for every JSON endpoint, plus a compact encoding
+      (pieces as positional arrays) for clients that ask for it
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import struct
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+
+from . import journal, rules
+from .shards import db_for_game
+from .models import Game, Player, Piece
+
+
+# Piece fields written back after a move
+PIECE_STATE_FIELDS = ['position', 'steps_taken', 'in_home', 'version']
+
+# Games converted per transaction by convert_board_storage()
+CONVERT_BATCH_SIZE = 500
+
+# Compact encoding, sent when the Accept header asks for this media type:
+# every piece is an array of COMPACT_PIECE_FIELDS, and seat indexes the
+# 'colors' list of the response (player colors in turn order)
+COMPACT_MEDIA_TYPE = 'application/vnd.mensch.compact+json'
+COMPACT_PIECE_FIELDS = ('id', 'seat', 'position', 'in_home', 'piece_number')
+
+
+# =============================================================================
+# PACKED BOARD
+# =============================================================================
+
+def pack_board(progress, versions):
+    """
+    Pack a board into bytes for Game.board.
+
+    Layout (little endian): one signed byte of rules-engine progress per
+    piece in seat order, then one unsigned 32-bit version per piece (the
+    game version at which it last changed). Position, steps and in_home
+    follow from progress and the player's color.
+    """
+    count = len(progress)
+    return struct.pack(f'<{count}b{count}I', *progress, *versions)
+
+
+def unpack_board(data):
+    """Unpack Game.board into (progress list, versions list)"""
+    data = bytes(data)
+    count = len(data) // 5
+    values = struct.unpack(f'<{count}b{count}I', data)
+    return list(values[:count]), list(values[count:])
+
+
+def initial_board(players=len(rules.COLORS)):
+    """Packed board of a new game: every piece in start"""
+    count = players * rules.PIECES_PER_PLAYER
+    return pack_board([rules.IN_START] * count, [0] * count)
+
+
+def board_storage():
+    """Storage mode of new games: 'rows' or 'packed' (settings.GAME_BOARD_STORAGE)"""
+    return getattr(settings, 'GAME_BOARD_STORAGE', 'rows')
+
+
+def _attach_packed_pieces(player, seat, progress, versions):
+    """Give a player of a packed game unsaved Piece instances as its prefetched pieces"""
+    pieces = []
+    for number in range(rules.PIECES_PER_PLAYER):
+        index = seat * rules.PIECES_PER_PLAYER + number
+        value = progress[index]
+        piece = Piece(
+            id=index + 1,  # Only unique within the game
+            player=player,
+            piece_number=number,
+            position=rules.square_for(player.color_index, value),
+            steps_taken=max(value, 0),
+            in_home=value >= rules.TRACK_LENGTH,
+            version=versions[index],
+        )
+        piece.packed = True  # save() and delete() refuse, the id may belong to another game's row
+        piece._state.adding = False
+        pieces.append(piece)
+
+    queryset = Piece.objects.none()
+    queryset._result_cache = pieces
+    queryset._prefetch_done = True
+    player._prefetched_objects_cache['pieces'] = queryset
+
+
+def snapshot_queryset():
+    """Game queryset that loads winner, players and pieces in three queries"""
+    return Game.objects.select_related('winner').prefetch_related(
+        Prefetch('players', queryset=Player.objects.prefetch_related(
+            Prefetch('pieces', queryset=Piece.objects.order_by('piece_number'))
+        ))
+    )
+
+
+def load_snapshot(game_id):
+    """Load a GameSnapshot or raise Http404"""
+    queryset = snapshot_queryset().using(db_for_game(game_id))
+    snapshot = GameSnapshot(get_object_or_404(queryset, id=game_id))
+    game = snapshot.game
+    if not snapshot.packed and game.flushed_version < game.version:
+        snapshot.catch_up(journal.moves_between(game.id, game.flushed_version, game.version))
+    return snapshot
+
+
+class GameSnapshot:
+    """In-memory view of a game, its players (in turn order) and pieces"""
+
+    def __init__(self, game):
+        self.game = game
+        self.players = list(game.players.all())
+        self.pieces = []
+        self.unflushed = False  # Piece rows in the database are behind this snapshot
+        self._piece_index = {}
+        self._board = None  # rules.BoardState, built on first use (cached with the snapshot)
+        if self.packed:
+            progress, versions = unpack_board(game.board)
+            for seat, player in enumerate(self.players):
+                _attach_packed_pieces(player, seat, progress, versions)
+        for seat, player in enumerate(self.players):
+            for piece in player.pieces.all():
+                self.pieces.append(piece)
+                self._piece_index[piece.id] = seat * rules.PIECES_PER_PLAYER + piece.piece_number
+
+    @property
+    def packed(self):
+        """Whether the game stores its pieces in Game.board instead of Piece rows"""
+        return self.game.board is not None
+
+    def pack(self):
+        """Packed board of the in-memory pieces"""
+        return pack_board([piece.progress for piece in self.pieces], [piece.version for piece in self.pieces])
+
+    @property
+    def current_player(self):
+        """Player whose turn it is"""
+        return self.game.get_current_player()
+
+    def get_piece(self, piece_id):
+        """Get a piece of this game by id, or None"""
+        for piece in self.pieces:
+            if piece.id == piece_id:
+                return piece
+        return None
+
+    def piece_index(self, piece):
+        """Rules-engine piece index (seat * 4 + piece_number) of a piece of this game"""
+        return self._piece_index[piece.id]
+
+    def piece_at(self, index):
+        """Get the piece with a rules-engine piece index (seat * 4 + piece_number)"""
+        for piece in self.pieces:
+            if self._piece_index[piece.id] == index:
+                return piece
+        return None
+
+    def board_state(self):
+        """
+        rules.BoardState of this game, with turn and dice taken from the game.
+
+        Built on the first call and moved by apply_move() and catch_up()
+        afterwards; callers must not move pieces on it (search on a copy()).
+        """
+        board = self._board
+        if board is None:
+            board = self._board = self.game.board_state()
+        else:
+            board.turn = self.game.current_player_index % len(self.players) if self.players else 0
+            board.dice = self.game.dice_value
+        return board
+
+    def apply_move(self, piece, dice_value):
+        """
+        Move a piece through the rules engine, updating the in-memory pieces only.
+
+        Args:
+            piece: Piece of this snapshot to move
+            dice_value: Dice value to move by
+
+        Returns:
+            List of changed pieces (moved piece first), or None if the move is illegal
+        """
+        board = self.board_state()
+        captured = board.move(self._piece_index[piece.id], dice_value)
+        if captured is None:
+            return None
+
+        by_index = {self._piece_index[p.id]: p for p in self.pieces}
+        changed = [piece] + [by_index[index] for index in captured]
+        for changed_piece in changed:
+            index = self._piece_index[changed_piece.id]
+            changed_piece.position = board.square(index)
+            changed_piece.steps_taken = max(board.progress[index], 0)
+            changed_piece.in_home = board.in_home(index)
+        return changed
+
+    def catch_up(self, moves):
+        """
+        Replay journal moves that are committed but not yet in the Piece rows.
+
+        Args:
+            moves: (version, piece index, dice value) tuples in version order
+        """
+        board = self.board_state()
+        for version, index, dice_value in moves:
+            captured = board.move(index, dice_value)
+            for changed in [index] + captured:
+                piece = self.piece_at(changed)
+                piece.position = board.square(changed)
+                piece.steps_taken = max(board.progress[changed], 0)
+                piece.in_home = board.in_home(changed)
+                piece.version = version
+        self.unflushed = True
+
+    def stamp_pieces(self, pieces, version=None):
+        """Mark pieces as changed at a game version, the current one by default (for ?since= deltas)"""
+        for piece in pieces:
+            piece.version = self.game.version if version is None else version
+
+    def save_pieces(self, pieces):
+        """
+        Persist the given pieces with a single bulk UPDATE, stamped with the game version.
+
+        All pieces are written when the rows were behind, so that they match
+        the game version afterwards.
+        """
+        self.stamp_pieces(pieces)
+        if self.unflushed:
+            pieces = self.pieces
+            self.unflushed = False
+        Piece.objects.using(db_for_game(self.game.id)).bulk_update(pieces, PIECE_STATE_FIELDS)
+
+
+# =============================================================================
+# SERIALIZERS
+# =============================================================================
+
+def serialize_piece(piece, player):
+    """Serialize one piece for the JSON endpoints"""
+    return {
+        'id': piece.id,
+        'player_color': player.color,
+        'position': piece.position,
+        'in_home': piece.in_home,
+        'piece_number': piece.piece_number,
+    }
+
+
+def compact_piece(piece, seat):
+    """Serialize one piece as a positional array (COMPACT_PIECE_FIELDS)"""
+    return [piece.id, seat, piece.position, int(piece.in_home), piece.piece_number]
+
+
+def serialize_pieces(snapshot, since=None, compact=False):
+    """
+    Serialize all pieces of a snapshot in turn order, or only those changed
+    after version since; as positional arrays if compact.
+    """
+    return [
+        compact_piece(piece, seat) if compact else serialize_piece(piece, player)
+        for seat, player in enumerate(snapshot.players)
+        for piece in player.pieces.all()
+        if since is None or piece.version > since
+    ]
+
+
+def serialize_colors(snapshot):
+    """Player colors in turn order, the seats of compact pieces"""
+    return [player.color for player in snapshot.players]
+
+
+def serialize_game(snapshot):
+    """Serialize the game-level fields (turn, dice, status, version)"""
+    game = snapshot.game
+    current_player = snapshot.current_player
+    return {
+        'version': game.version,
+        'status': game.status,
+        'current_player': current_player.name if current_player else None,
+        'current_player_color': current_player.color if current_player else None,
+        'dice_value': game.dice_value,
+        'winner': game.winner.username if game.winner else None,
+    }
+
+
+def serialize_state(snapshot, since=None, compact=False):
+    """
+    Serialize the game state.
+
+    Args:
+        snapshot: Loaded GameSnapshot
+        since: Optional game version the client already has; only pieces
+            changed after it are included and the response carries 'since'
+        compact: Encode pieces as positional arrays and add 'colors'
+
+    Returns:
+        Dictionary ready for JsonResponse
+    """
+    state = serialize_game(snapshot)
+    state['pieces'] = serialize_pieces(snapshot, since, compact)
+    if compact:
+        state['colors'] = serialize_colors(snapshot)
+    if since is not None:
+        state['since'] = since
+    return state
+
+
+def serialize_delta(snapshot, pieces):
+    """Serialize the game-level fields plus only the given (changed) pieces"""
+    delta = serialize_game(snapshot)
+    delta['pieces'] = [serialize_piece(piece, piece.player) for piece in pieces]
+    return delta
+
+
+# =============================================================================
+# STORAGE CONVERSION
+# =============================================================================
+
+def convert_board_storage(db, storage, batch_size=CONVERT_BATCH_SIZE, report=None):
+    """
+    Convert the games of one database to a storage mode, one transaction per batch.
+
+    Stop the app servers first: running processes may hold cached games in
+    the old storage mode.
+
+    Args:
+        db: Database alias (a shard)
+        storage: 'packed' (Piece rows into Game.board) or 'rows' (the reverse)
+        batch_size: Games converted per transaction
+        report: Optional callable, given the number of games converted so far after each batch
+
+    Returns:
+        Number of games converted
+    """
+    to_packed = storage == 'packed'
+    converted = 0
+    while True:
+        games = list(snapshot_queryset().using(db).filter(board__isnull=to_packed).order_by('id')[:batch_size])
+        if not games:
+            return converted
+        with transaction.atomic(using=db):
+            if to_packed:
+                _pack_games(games, db)
+            else:
+                _unpack_games(games, db)
+        converted += len(games)
+        if report is not None:
+            report(converted)
+
+
+def _pack_games(games, db):
+    """Pack the pieces of row games into Game.board and delete their Piece rows"""
+    for game in games:
+        snapshot = GameSnapshot(game)
+        # Pieces still waiting for the write-behind flusher are taken from the journal
+        if game.flushed_version < game.version:
+            snapshot.catch_up(journal.moves_between(game.id, game.flushed_version, game.version))
+        game.board = snapshot.pack()
+        game.flushed_version = game.version
+    Game.objects.using(db).bulk_update(games, ['board', 'flushed_version'])
+    Piece.objects.using(db).filter(player__game__in=games).delete()
+
+
+def _unpack_games(games, db):
+    """Create Piece rows from the packed board of games and clear Game.board"""
+    pieces = []
+    for game in games:
+        for piece in GameSnapshot(game).pieces:
+            pieces.append(Piece(
+                player=piece.player,
+                piece_number=piece.piece_number,
+                position=piece.position,
+                steps_taken=piece.steps_taken,
+                in_home=piece.in_home,
+                version=piece.version,
+            ))
+        game.board = None
+        game.flushed_version = game.version
+    Piece.objects.using(db).bulk_create(pieces)
+    Game.objects.using(db).bulk_update(games, ['board', 'flushed_version'])
@@ -0,0 +1,63 @@
+"""
+Template tags for the right-sized image variants (see game.images).
+
+Usage:
+    {% load game_images %}
+    <image href="{% image_url 'dollar/cent1.png' 'token' %}" .../>
+    <div style="{% image_background piece.team_image 'token' %}"></div>
+    <div style="{% sprite_background 'dice' 0 'dice/dice1.png' 'dice' %}"></div>
+"""
+
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from game import images
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def image_url(path, use='token'):
+    """URL of the WebP variant of an image for a use, or of the original"""
+    return images.variant_url(path, use)
+
+
+def _background_image(urls, fallback):
+    """
+    CSS background-image declarations: a plain url() first, then an
+    image-set() preferring AVIF for browsers that support it.
+    """
+    if len(urls) < 2:
+        return format_html("background-image: url('{}');", fallback)
+    return format_html(
+        "background-image: url('{}'); background-image: image-set({});",
+        fallback,
+        format_html_join(', ', "url('{}') type('{}')", (
+            (url, images.MIME_TYPES[fmt]) for fmt, url in urls.items()
+        )),
+    )
+
+
+@register.simple_tag
+def image_background(path, use='token'):
+    """Background-image declarations for the variant of an image"""
+    urls = images.variant_urls(path, use)
+    return _background_image(urls, urls.get('webp') or images.variant_url(path, use))
+
+
+@register.simple_tag
+def sprite_background(name, frame, path, use='token'):
+    """
+    Background declarations showing one frame of a sprite sheet (including
+    background-size and -position), or the image at path without the sheet.
+    """
+    position = images.sprite_position(name, frame)
+    urls = images.sprite_urls(name)
+    if position is None or 'webp' not in urls:
+        return image_background(path, use)
+    size, offset = position
+    return format_html(
+        '{} background-size: {}; background-position: {};',
+        _background_image(urls, urls['webp']), size, offset,
+    )
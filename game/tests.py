@@ -0,0 +1,910 @@
+"""
+Game Tests
+==========
+
+Run with `python manage.py test game`.
+
+Query counts are pinned for the endpoints a turn goes through, with the
+hot game cache on (the default) and off. Inside a TestCase every
+transaction.atomic() block runs as a savepoint, so a commit counts as
+SAVEPOINT and RELEASE SAVEPOINT where production runs BEGIN and COMMIT.
+
+The cache's flusher thread is replaced by explicit flush_all() calls, so
+piece rows are written on the test's connection, inside its transaction.
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+import asyncio
+import importlib
+import io
+import random
+from datetime import timedelta
+from unittest import mock
+
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache as fragment_cache
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F, QuerySet
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import benchmark, cache, journal, live, lobby, rules, shards, turns
+from .models import Game, GameEvent, JournalCheckpoint, Piece, Player
+from .provisioning import create_games, unplayed_games
+from .snapshot import (
+    COMPACT_MEDIA_TYPE, COMPACT_PIECE_FIELDS, convert_board_storage, load_snapshot, pack_board, serialize_state,
+    unpack_board,
+)
+
+
+def roll(value):
+    """Make every dice roll inside the block come up value"""
+    return mock.patch('game.models.random.randint', return_value=value)
+
+
+class GameTestCase(TestCase):
+    """Fresh caches and one new four-player game per test"""
+
+    def setUp(self):
+        cache.game_cache.clear()
+        fragment_cache.clear()
+        patcher = mock.patch.object(cache.game_cache, '_start_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Pending piece rows belong to this test's transaction
+        self.addCleanup(cache.game_cache.flush_all)
+        self.game = create_games(1)[0]
+
+    def url(self, name, *args):
+        """URL of a game endpoint of self.game"""
+        return reverse(name, args=[self.game.id, *args])
+
+    def place(self, seat, progress):
+        """Put a seat's pieces at the given rules-engine progress values and bump the game version"""
+        for piece_number, value in enumerate(progress):
+            Piece.objects.filter(player__game=self.game, player__order=seat, piece_number=piece_number).update(
+                position=rules.square_for(seat, value), steps_taken=max(value, 0),
+                in_home=value >= rules.TRACK_LENGTH,
+            )
+        Game.objects.filter(id=self.game.id).update(version=F('version') + 1)
+
+
+# =============================================================================
+# QUERY COUNTS
+# =============================================================================
+
+class QueryCountTests(GameTestCase):
+    """SQL queries per request of the board, state and turn endpoints"""
+
+    def test_game_board(self):
+        # Version check plus the snapshot (game, players, pieces), then a cache hit
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get(self.url('game_board')).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url('game_board')).status_code, 200)
+
+    def test_get_game_state(self):
+        self.client.get(self.url('game_board'))
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url('game_state'))
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url('game_state'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_roll_dice(self):
+        self.client.get(self.url('game_board'))
+        # Version check, then SAVEPOINT, game UPDATE, journal INSERT, RELEASE
+        with roll(6), self.assertNumQueries(5):
+            response = self.client.post(self.url('roll_dice'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['movable_pieces']), 4)
+
+    def test_move_piece(self):
+        self.client.get(self.url('game_board'))
+        with roll(6):
+            piece_id = self.client.post(self.url('roll_dice')).json()['movable_pieces'][0]
+        # Piece rows are written behind, so a move commits like a roll
+        with self.assertNumQueries(5):
+            response = self.client.post(self.url('move_piece', piece_id))
+        self.assertTrue(response.json()['success'])
+
+    def test_play_turn(self):
+        self.client.get(self.url('game_board'))
+        # Roll and move in one commit
+        with roll(6), self.assertNumQueries(5):
+            response = self.client.post(self.url('play_turn'), {'policy': 'furthest'})
+        self.assertIsNotNone(response.json()['moved_piece'])
+        # The 6 keeps the turn; the next roll moves the piece on and hands the turn over
+        with roll(3):
+            self.client.post(self.url('play_turn'), {'policy': 'furthest'})
+        # A roll without a legal move is committed on its own as well
+        with roll(3), self.assertNumQueries(5):
+            response = self.client.post(self.url('play_turn'), {'policy': 'furthest'})
+        self.assertIsNone(response.json()['moved_piece'])
+        self.assertEqual(response.json()['tries_left'], 2)
+
+    @override_settings(GAME_STATE_CACHE={'ENABLED': False})
+    def test_without_cache(self):
+        # Every request loads the snapshot in three queries, moves write their pieces
+        with self.assertNumQueries(3):
+            self.client.get(self.url('game_board'))
+        with self.assertNumQueries(4):
+            self.client.get(self.url('game_state'))
+        with roll(6), self.assertNumQueries(8):
+            self.client.post(self.url('play_turn'), {'policy': 'furthest'})
+
+
+# =============================================================================
+# PROVISIONING
+# =============================================================================
+
+class ProvisioningTests(TestCase):
+    """Games are created with bulk inserts, complete, in one transaction"""
+
+    def test_create_games(self):
+        # SAVEPOINT, one INSERT each for games, players and pieces, RELEASE; however many games
+        # (up to SQLite's 999 parameters per INSERT: ten games)
+        for count in (1, 10):
+            with self.subTest(count=count), self.assertNumQueries(5):
+                games = create_games(count, ['Anna', 'Boris'])
+        self.assertEqual(len(games), 10)
+        for game in games:
+            players = list(Player.objects.filter(game=game).order_by('order'))
+            self.assertEqual(game.status, 'in_progress')
+            self.assertEqual(
+                [(player.name, player.color, player.order, player.is_bot) for player in players],
+                [('Anna', 'red', 0, False), ('Boris', 'blue', 1, False),
+                 ('Player 3', 'green', 2, False), ('Player 4', 'yellow', 3, False)],
+            )
+            pieces = Piece.objects.filter(player__game=game)
+            self.assertEqual(pieces.count(), 16)
+            self.assertEqual(
+                sorted(pieces.values_list('player__order', 'piece_number')),
+                [(seat, number) for seat in range(4) for number in range(4)],
+            )
+            self.assertFalse(pieces.exclude(position=rules.IN_START).exists())
+
+    def test_bot_seats(self):
+        game = create_games(1, ['Anna'], fill_with_bots=True)[0]
+        self.assertEqual(
+            list(Player.objects.filter(game=game).order_by('order').values_list('is_bot', flat=True)),
+            [False, True, True, True],
+        )
+
+    def test_failed_insert_leaves_nothing(self):
+        bulk_create = QuerySet.bulk_create
+
+        def fail_on_pieces(queryset, objs, *args, **kwargs):
+            if queryset.model is Piece:
+                raise DatabaseError('disk full')
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=fail_on_pieces):
+            with self.assertRaises(DatabaseError):
+                create_games(3)
+        self.assertFalse(Game.objects.exists())
+        self.assertFalse(Player.objects.exists())
+
+    def test_command_top_up_is_idempotent(self):
+        call_command('provision_games', '4', '--batch-size', '3', stdout=io.StringIO())
+        self.assertEqual(Game.objects.count(), 4)
+        self.assertEqual(Piece.objects.count(), 4 * 16)
+
+        call_command('provision_games', '4', '--top-up', stdout=io.StringIO())
+        self.assertEqual(Game.objects.count(), 4)
+
+        # A game that started playing no longer counts as provisioned
+        Game.objects.filter(id=Game.objects.first().id).update(version=1)
+        call_command('provision_games', '4', '--top-up', stdout=io.StringIO())
+        self.assertEqual(Game.objects.count(), 5)
+        self.assertEqual(unplayed_games(), 4)
+
+
+# =============================================================================
+# STATE DELTAS
+# =============================================================================
+
+class StateDeltaTests(GameTestCase):
+    """?since= on the state endpoint sends only the pieces changed after a version"""
+
+    def setUp(self):
+        super().setUp()
+        # v1: red enters, v2: red moves on and passes, v3: blue enters
+        for dice_value in (6, 3, 6):
+            with roll(dice_value):
+                turns.play_turn(self.game.id, 'furthest')
+        self.red, self.blue = [
+            Piece.objects.get(player__game=self.game, player__order=seat, piece_number=0).id for seat in (0, 1)
+        ]
+
+    def state(self, since):
+        """Response of the state endpoint with ?since="""
+        return self.client.get(self.url('game_state'), {'since': since})
+
+    def piece_ids(self, since):
+        """Ids of the pieces sent for a since, and the version and since of the response"""
+        data = self.state(since).json()
+        return [piece['id'] for piece in data['pieces']], data['version'], data.get('since')
+
+    def test_current_version_sends_no_pieces(self):
+        self.assertEqual(self.piece_ids(3), ([], 3, 3))
+
+    def test_older_version_sends_changed_pieces(self):
+        self.assertEqual(self.piece_ids(0), ([self.red, self.blue], 3, 0))
+        self.assertEqual(self.piece_ids(1), ([self.red, self.blue], 3, 1))
+        self.assertEqual(self.piece_ids(2), ([self.blue], 3, 2))
+
+    def test_versions_outside_the_history_send_full_state(self):
+        # Before the first version, or past the current one (e.g. a reset database)
+        for since in (-1, 4, 10 ** 6):
+            with self.subTest(since=since):
+                pieces, version, sent_since = self.piece_ids(since)
+                self.assertEqual((len(pieces), version, sent_since), (16, 3, None))
+
+    def test_malformed_since(self):
+        for since in ('abc', '1.5', ''):
+            with self.subTest(since=since):
+                self.assertEqual(self.state(since).status_code, 400)
+
+
+# =============================================================================
+# LIVE EVENTS
+# =============================================================================
+
+class LiveEventsTests(GameTestCase):
+    """The events URL as served by dont_b_mad.asgi (live.with_live_events)"""
+
+    def setUp(self):
+        super().setUp()
+        # Like the test client: the test's connection stays open between requests
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    async def get_events(self, game_id):
+        """Status, content type and first body of the events URL, disconnecting after that body"""
+        application = live.with_live_events(get_asgi_application())
+        path = reverse('game_events', args=[game_id])
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+            'query_string': b'', 'headers': [], 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        messages = []
+        first_body = asyncio.Event()
+        requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await first_body.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if message['type'] == 'http.response.body':
+                first_body.set()
+
+        await asyncio.wait_for(application(scope, receive, send), timeout=5)
+        start, body = messages[0], messages[1]
+        return start['status'], dict(start['headers']).get(b'content-type'), body['body']
+
+    async def test_game_streams_events(self):
+        status, content_type, body = await self.get_events(self.game.id)
+        self.assertEqual((status, content_type), (200, b'text/event-stream'))
+        self.assertEqual(body, f'retry: {live.SSE_RETRY_MS}\n\n'.encode())
+
+    async def test_unknown_game_is_404(self):
+        status, content_type, body = await self.get_events(self.game.id + 1000)
+        self.assertEqual(status, 404)
+        self.assertNotEqual(content_type, b'text/event-stream')
+
+
+# =============================================================================
+# COMPACT ENCODING
+# =============================================================================
+
+def decode_pieces(pieces, colors):
+    """Expand compact pieces the way decodePieces() in static/js/game.js does"""
+    return [
+        {'id': id_, 'player_color': colors[seat], 'position': position, 'in_home': in_home == 1,
+         'piece_number': piece_number}
+        for id_, seat, position, in_home, piece_number in pieces
+    ]
+
+
+class CompactEncodingTests(GameTestCase):
+    """The compact encoding decodes to exactly what the JSON encoding sends"""
+
+    def setUp(self):
+        super().setUp()
+        random.seed(2)
+        for _ in range(80):
+            turns.play_turn(self.game.id, 'furthest')
+
+    def decoded(self, data):
+        """A compact response with its pieces decoded and the colors dropped"""
+        data = dict(data)
+        colors = data.pop('colors')
+        for key in ('pieces', 'all_pieces'):
+            if key in data:
+                data[key] = decode_pieces(data[key], colors)
+        return data
+
+    def test_state_round_trip(self):
+        snapshot = cache.load(self.game.id)
+        self.assertTrue(any(piece.in_home for piece in snapshot.pieces))
+        self.assertTrue(any(0 <= piece.progress < rules.TRACK_LENGTH for piece in snapshot.pieces))
+        compact = serialize_state(snapshot, compact=True)
+        self.assertEqual(len(compact['pieces'][0]), len(COMPACT_PIECE_FIELDS))
+        self.assertEqual(self.decoded(compact), serialize_state(snapshot))
+        since = snapshot.game.version - 10
+        self.assertEqual(self.decoded(serialize_state(snapshot, since, compact=True)), serialize_state(snapshot, since))
+
+    def test_endpoints_negotiate_compact(self):
+        response = self.client.get(self.url('game_state'), HTTP_ACCEPT=COMPACT_MEDIA_TYPE)
+        self.assertEqual(response['Content-Type'], COMPACT_MEDIA_TYPE)
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(self.decoded(response.json()), self.client.get(self.url('game_state')).json())
+
+        with roll(6):
+            response = self.client.post(self.url('play_turn'), {'policy': 'furthest'}, HTTP_ACCEPT=COMPACT_MEDIA_TYPE)
+        self.assertEqual(response['Content-Type'], COMPACT_MEDIA_TYPE)
+        self.assertIsNotNone(response.json()['moved_piece'])
+        pieces = self.decoded(response.json())['all_pieces']
+        self.assertEqual(pieces, self.client.get(self.url('game_state')).json()['pieces'])
+
+
+# =============================================================================
+# RULES ENGINE
+# =============================================================================
+
+def reference_move(color, progress, dice_value):
+    """
+    (square, progress) after a move as the original Piece model computed it,
+    or None if the move is illegal.
+    """
+    if progress == rules.IN_START:
+        return (rules.START_SQUARES[color], 0) if dice_value == rules.ENTER_ROLL else None
+    if progress >= rules.TRACK_LENGTH:
+        return None  # Pieces in home do not move again
+    steps = progress + dice_value
+    if steps >= rules.TRACK_LENGTH:
+        into_home = steps - rules.TRACK_LENGTH
+        return (rules.HOME_STARTS[color] + into_home, steps) if into_home < rules.HOME_LENGTH else None
+    return ((rules.START_SQUARES[color] + steps) % rules.TRACK_LENGTH, steps)
+
+
+class RulesParityTests(SimpleTestCase):
+    """The transition tables agree with the movement rules of the original model code"""
+
+    def test_transitions_match_reference(self):
+        for color in range(len(rules.COLORS)):
+            for progress in range(rules.IN_START, rules.LAST_STEP + 1):
+                for dice_value in range(1, rules.ENTER_ROLL + 1):
+                    with self.subTest(color=color, progress=progress, dice=dice_value):
+                        expected = reference_move(color, progress, dice_value)
+                        entry = rules.transition(color, progress, dice_value)
+                        self.assertEqual(entry.illegal, expected is None)
+                        self.assertEqual(rules.can_move(progress, dice_value), expected is not None)
+                        if expected is not None:
+                            self.assertEqual((entry.square, entry.progress), expected)
+                            self.assertEqual(entry.enters_home, progress < rules.TRACK_LENGTH <= expected[1])
+
+    def test_board_state_captures(self):
+        # Blue (seat 1) stands on square 5; red moves from square 2 onto it
+        board = rules.BoardState([2, -1, -1, -1, 35, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1])
+        self.assertEqual(board.square(4), 5)
+        self.assertEqual(board.move(0, 3), [4])
+        self.assertEqual(board.progress[4], rules.IN_START)
+        self.assertEqual(board.occupancy[5], 1 << 0)
+
+    def test_entering_never_captures(self):
+        # Blue stands on red's start square; red entering with a 6 shares it
+        board = rules.BoardState([-1, -1, -1, -1, 30, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1], dice=6)
+        self.assertEqual(board.move(0), [])
+        self.assertEqual(board.progress[4], 30)
+
+
+# =============================================================================
+# TURNS
+# =============================================================================
+
+class StaleTurnTests(GameTestCase):
+    """A turn computed from an outdated version is rejected before anything is written"""
+
+    def test_commit_game_rejects_stale_version(self):
+        snapshot = cache.load(self.game.id)
+        Game.objects.filter(id=self.game.id).update(version=F('version') + 1)
+        snapshot.game.dice_value = 4
+        with self.assertRaises(turns.StaleTurnError), transaction.atomic():
+            turns.commit_game(snapshot.game)
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.version, self.game.dice_value), (1, 0))
+
+    def test_overtaken_roll_answers_409(self):
+        stale = cache.load(self.game.id)
+        with roll(6):
+            self.assertEqual(self.client.post(self.url('roll_dice')).status_code, 200)
+        with roll(6), mock.patch.object(turns.cache, 'load', return_value=stale):
+            response = self.client.post(self.url('play_turn'), {'policy': 'furthest'})
+        self.assertEqual(response.status_code, 409)
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.version, 1)
+        self.assertEqual(GameEvent.objects.filter(game=self.game).count(), 1)
+        # The failed commit evicted the game, the next request reloads it
+        self.assertIsNone(cache.game_cache.get(self.game.id, 1))
+
+
+
+class PassTests(GameTestCase):
+    """A player without a legal move rolls again while tries are left, then passes"""
+
+    def test_three_rolls_from_start_then_pass(self):
+        results = []
+        for _ in range(rules.ROLLS_FROM_START):
+            with roll(3):
+                results.append(turns.play_turn(self.game.id, 'furthest'))
+        self.assertEqual([result.tries_left for result in results], [2, 1, 0])
+        self.assertEqual([result.passed for result in results], [False, False, True])
+        self.assertEqual({result.player.order for result in results}, {0})
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.current_player_index, self.game.tries, self.game.dice_value), (1, 0, 0))
+        self.assertEqual(
+            list(GameEvent.objects.filter(game=self.game).order_by('version').values_list('kind', 'seat')),
+            [('roll', 0), ('roll', 0), ('pass', 0)],
+        )
+
+    def test_pass_without_legal_move(self):
+        # Red has three pieces in home and one two squares before it: a 6 moves none of them
+        self.place(0, [38, 40, 41, 42])
+        with roll(6):
+            result = turns.play_turn(self.game.id, 'furthest')
+        self.assertEqual((result.movable_pieces, result.passed, result.tries_left), ([], True, 0))
+        self.assertEqual(cache.load(self.game.id).current_player.order, 1)
+        self.assertEqual(GameEvent.objects.get(game=self.game).kind, 'pass')
+
+
+class SnapshotBoardTests(GameTestCase):
+    """The snapshot's BoardState is built once and follows every move"""
+
+    def test_board_follows_moves_without_rebuilding(self):
+        random.seed(4)
+        turns.play_turn(self.game.id, 'furthest')
+        with mock.patch.object(Game, 'board_state', autospec=True, side_effect=Game.board_state) as build:
+            for _ in range(60):
+                turns.play_turn(self.game.id, 'ai')
+            snapshot = cache.load(self.game.id)
+            board = snapshot.board_state()
+        self.assertEqual(build.call_count, 0)
+
+        rebuilt = snapshot.game.board_state()
+        self.assertEqual(list(board.progress), list(rebuilt.progress))
+        self.assertEqual(list(board.occupancy), list(rebuilt.occupancy))
+        self.assertEqual((board.turn, board.dice), (rebuilt.turn, rebuilt.dice))
+
+
+class BotSeatTests(GameTestCase):
+    """Human requests never roll or move for a computer player"""
+
+    def setUp(self):
+        super().setUp()
+        self.game = create_games(1, ['Human'], fill_with_bots=True)[0]
+        random.seed(5)
+
+    def hand_to_bot(self):
+        """Leave the turn with the first computer player, as play_bots does at MAX_BOT_TURNS"""
+        Game.objects.filter(id=self.game.id).update(
+            current_player_index=1, dice_value=0, tries=0, version=F('version') + 1,
+        )
+
+    def test_roll_on_bot_seat_resumes_bots(self):
+        for name in ('roll_dice', 'play_turn'):
+            with self.subTest(endpoint=name):
+                self.hand_to_bot()
+                response = self.client.post(self.url(name), {'policy': 'furthest'})
+                self.assertEqual(response.status_code, 409)
+                self.assertFalse(GameEvent.objects.filter(game=self.game, seat=0).exists())
+                self.assertFalse(cache.load(self.game.id).current_player.is_bot)
+        # The computer players rolled instead
+        self.assertTrue(GameEvent.objects.filter(game=self.game).exists())
+
+    def test_move_on_bot_seat_resumes_bots(self):
+        self.hand_to_bot()
+        piece = Piece.objects.filter(player__game=self.game, player__order=0).first()
+        response = self.client.post(self.url('move_piece', piece.id))
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(GameEvent.objects.filter(game=self.game, seat=0).exists())
+        self.assertFalse(cache.load(self.game.id).current_player.is_bot)
+
+
+# =============================================================================
+# JOURNAL
+# =============================================================================
+
+class JournalReplayTests(GameTestCase):
+    """Rebuilding a game from its journal gives the state the turns committed"""
+
+    def play(self, turns_to_play, seed=7):
+        """Play turns with seeded dice, moving the furthest piece"""
+        random.seed(seed)
+        for _ in range(turns_to_play):
+            turns.play_turn(self.game.id, 'furthest')
+        return cache.load(self.game.id)
+
+    def test_rebuild_matches_live_state(self):
+        snapshot = self.play(150)
+        live = snapshot.board_state()
+        self.assertGreater(snapshot.game.version, journal.CHECKPOINT_INTERVAL)
+        self.assertTrue(JournalCheckpoint.objects.filter(game=self.game).exists())
+
+        replay = journal.rebuild(self.game.id)
+        self.assertEqual(replay.version, snapshot.game.version)
+        self.assertEqual(list(replay.board.progress), list(live.progress))
+        self.assertEqual((replay.board.turn, replay.board.dice), (live.turn, live.dice))
+
+    def test_replay_from_start_matches_checkpoints(self):
+        self.play(150)
+        states = {event['version']: event['squares'] for event in journal.replay_events(self.game.id)}
+        for checkpoint in JournalCheckpoint.objects.filter(game=self.game):
+            with self.subTest(version=checkpoint.version):
+                rebuilt = journal.rebuild(self.game.id, checkpoint.version)
+                self.assertEqual(rebuilt.squares(), states[checkpoint.version])
+
+
+# =============================================================================
+# GAME CACHE
+# =============================================================================
+
+class WriteBehindTests(GameTestCase):
+    """Piece rows written behind by the cache catch up from the journal or the flusher"""
+
+    def positions(self):
+        """(position, steps_taken, in_home) of the game's Piece rows, in piece order"""
+        return list(
+            Piece.objects.filter(player__game=self.game)
+            .order_by('player__order', 'piece_number')
+            .values_list('position', 'steps_taken', 'in_home')
+        )
+
+    def snapshot_positions(self, snapshot):
+        """The same fields of a snapshot's in-memory pieces"""
+        return [(piece.position, piece.steps_taken, piece.in_home) for piece in snapshot.pieces]
+
+    def play_moves(self):
+        """Enter a piece and move it on, returns the cached snapshot"""
+        with roll(6):
+            turns.play_turn(self.game.id, 'furthest')
+        with roll(4):
+            turns.play_turn(self.game.id, 'furthest')
+        return cache.load(self.game.id)
+
+    def test_rows_lag_until_flushed(self):
+        before = self.positions()
+        snapshot = self.play_moves()
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.version, 2)
+        self.assertEqual(self.game.flushed_version, 0)
+        self.assertEqual(self.positions(), before)
+        self.assertEqual(cache.game_cache.pending(), 1)
+
+        cache.game_cache.flush_all()
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.flushed_version, 2)
+        self.assertEqual(self.positions(), self.snapshot_positions(snapshot))
+        self.assertEqual(cache.game_cache.pending(), 0)
+
+    def test_load_catches_up_from_journal(self):
+        snapshot = self.play_moves()
+        # Another worker (or a restart) loads the game from the database before the flush
+        cache.game_cache.clear()
+        loaded = load_snapshot(self.game.id)
+        self.assertTrue(loaded.unflushed)
+        self.assertEqual(self.snapshot_positions(loaded), self.snapshot_positions(snapshot))
+        self.assertEqual([piece.version for piece in loaded.pieces], [piece.version for piece in snapshot.pieces])
+
+
+# =============================================================================
+# HOME COUNTERS
+# =============================================================================
+
+class HomeCounterTests(GameTestCase):
+    """Player.pieces_home follows captures and home entries and decides the winner"""
+
+    def counters(self):
+        """pieces_home of every seat, from the database"""
+        return list(Player.objects.filter(game=self.game).order_by('order').values_list('pieces_home', flat=True))
+
+    def test_capture_and_home_entry(self):
+        # Red: one piece before home, one on square 5, two in home; blue stands on square 11
+        self.place(0, [38, 5, 40, 41])
+        self.place(1, [1, -1, -1, -1])
+        Player.objects.filter(game=self.game, order=0).update(pieces_home=2)
+        red = Piece.objects.filter(player__game=self.game, player__order=0)
+
+        # A 6 captures blue and keeps the turn; captures leave the counters alone
+        with roll(6):
+            turns.play_turn(self.game.id, piece_id=red.get(piece_number=1).id)
+        snapshot = cache.load(self.game.id)
+        self.assertEqual(snapshot.board_state().progress[rules.PIECES_PER_PLAYER], rules.IN_START)
+        self.assertEqual(self.counters(), [2, 0, 0, 0])
+
+        with roll(4):
+            turns.play_turn(self.game.id, piece_id=red.get(piece_number=0).id)
+        self.assertEqual(self.counters(), [3, 0, 0, 0])
+        self.assertFalse(any(player.has_won() for player in cache.load(self.game.id).players))
+
+        # Replaying the unflushed moves from the journal agrees with the counters
+        cache.game_cache.clear()
+        snapshot = load_snapshot(self.game.id)
+        self.assertTrue(snapshot.unflushed)
+        self.assertEqual([player.count_pieces_home() for player in snapshot.players], self.counters())
+        call_command('check_home_counters', stdout=io.StringIO())
+
+    def test_last_piece_home_wins(self):
+        self.place(0, [38, 40, 41, 43])
+        Player.objects.filter(game=self.game, order=0).update(pieces_home=3)
+        with roll(4):
+            result = turns.play_turn(self.game.id, 'furthest')
+        self.assertTrue(result.game_over)
+        self.assertEqual(self.counters(), [4, 0, 0, 0])
+        snapshot = cache.load(self.game.id)
+        self.assertEqual(snapshot.game.status, 'finished')
+        self.assertTrue(snapshot.players[0].has_won())
+
+    def test_check_home_counters_reports_and_fixes_drift(self):
+        self.place(0, [40, 41, -1, -1])
+        Player.objects.filter(game=self.game, order=0).update(pieces_home=2)
+        Player.objects.filter(game=self.game, order=2).update(pieces_home=3)
+
+        output = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '1 drifted counters'):
+            call_command('check_home_counters', stdout=output)
+        self.assertIn('counter 3, pieces in home 0', output.getvalue())
+        self.assertEqual(self.counters(), [2, 0, 3, 0])
+
+        call_command('check_home_counters', '--fix', stdout=io.StringIO())
+        self.assertEqual(self.counters(), [2, 0, 0, 0])
+        call_command('check_home_counters', stdout=io.StringIO())
+
+
+# =============================================================================
+# PACKED BOARD
+# =============================================================================
+
+class PackedBoardTests(GameTestCase):
+    """Games stored in Game.board play and serialize like games with Piece rows"""
+
+    def test_pack_round_trip(self):
+        progress = [-1, 0, 39, 43, 5, 17, 40, -1, 12, -1, 41, 2, -1, -1, -1, 38]
+        versions = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 2 ** 32 - 1, 0, 0, 99]
+        self.assertEqual(unpack_board(pack_board(progress, versions)), (progress, versions))
+
+    def test_packed_game_plays_like_rows(self):
+        with self.settings(GAME_BOARD_STORAGE='packed'):
+            packed = create_games(1)[0]
+        self.assertFalse(Piece.objects.filter(player__game=packed).exists())
+        for game in (self.game, packed):
+            random.seed(3)
+            for _ in range(60):
+                turns.play_turn(game.id, 'furthest')
+        cache.game_cache.flush_all()
+        cache.game_cache.clear()
+
+        rows, board = load_snapshot(self.game.id), load_snapshot(packed.id)
+        self.assertTrue(any(piece.progress >= 0 for piece in rows.pieces))
+        self.assertEqual(list(board.board_state().progress), list(rows.board_state().progress))
+        self.assertEqual(board.pack(), bytes(Game.objects.get(id=packed.id).board))
+        state = serialize_state(board)
+        self.assertEqual(state['version'], rows.game.version)
+        self.assertEqual(
+            [(piece['position'], piece['in_home']) for piece in state['pieces']],
+            [(piece['position'], piece['in_home']) for piece in serialize_state(rows)['pieces']],
+        )
+
+    def test_convert_storage_round_trip(self):
+        random.seed(3)
+        for _ in range(40):
+            turns.play_turn(self.game.id, 'furthest')
+        cache.game_cache.clear()
+        progress = list(load_snapshot(self.game.id).board_state().progress)
+
+        # The data migration packs existing games (unflushed moves included) when storage is packed
+        migration = importlib.import_module('game.migrations.0013_pack_existing_boards')
+        schema_editor = mock.Mock(connection=mock.Mock(alias='default'))
+        migration.pack_existing_boards(None, schema_editor)
+        self.assertIsNone(Game.objects.get(id=self.game.id).board)
+        with self.settings(GAME_BOARD_STORAGE='packed'):
+            migration.pack_existing_boards(None, schema_editor)
+        self.assertFalse(Piece.objects.filter(player__game=self.game).exists())
+        self.assertEqual(list(load_snapshot(self.game.id).board_state().progress), progress)
+
+        self.assertEqual(convert_board_storage('default', 'rows'), 1)
+        self.assertEqual(Piece.objects.filter(player__game=self.game).count(), 16)
+        snapshot = load_snapshot(self.game.id)
+        self.assertFalse(snapshot.packed)
+        self.assertEqual(list(snapshot.board_state().progress), progress)
+
+    def test_packed_pieces_refuse_writes(self):
+        with self.settings(GAME_BOARD_STORAGE='packed'):
+            packed = create_games(1)[0]
+        piece = load_snapshot(packed.id).pieces[0]
+        with self.assertRaises(ValueError):
+            piece.save()
+        with self.assertRaises(ValueError):
+            piece.delete()
+
+
+# =============================================================================
+# SHARDS
+# =============================================================================
+
+TWO_SHARDS = ['default', 'shard_test']
+
+
+@override_settings(GAME_SHARDS=TWO_SHARDS)
+class ShardTests(GameTestCase):
+    """Games, their rows and their turns live on the shard given by the game id"""
+
+    databases = set(TWO_SHARDS)
+
+    def rows(self, db, game_id):
+        """Counts of a game's (game, players, pieces, events, checkpoints) rows on one database"""
+        return (
+            Game.objects.using(db).filter(id=game_id).count(),
+            Player.objects.using(db).filter(game_id=game_id).count(),
+            Piece.objects.using(db).filter(player__game_id=game_id).count(),
+            GameEvent.objects.using(db).filter(game_id=game_id).count(),
+            JournalCheckpoint.objects.using(db).filter(game_id=game_id).count(),
+        )
+
+    def test_games_and_turns_land_on_their_shard(self):
+        games = create_games(3)
+        self.assertEqual([game.id for game in games], list(range(games[0].id, games[0].id + 3)))
+        for game in games:
+            with self.subTest(game=game.id):
+                db, other = shards.db_for_game(game.id), shards.db_for_game(game.id + 1)
+                self.assertEqual(db, TWO_SHARDS[game.id % 2])
+                self.assertEqual(game._state.db, db)
+                with roll(6):
+                    turns.play_turn(game.id, 'furthest')
+                cache.game_cache.flush_all()
+                self.assertEqual(self.rows(db, game.id), (1, 4, 16, 1, 0))
+                self.assertEqual(self.rows(other, game.id), (0, 0, 0, 0, 0))
+                self.assertEqual(Game.objects.using(db).get(id=game.id).flushed_version, 1)
+                self.assertEqual(Piece.objects.using(db).filter(player__game_id=game.id, position=0).count(), 1)
+
+    def test_router(self):
+        router = shards.GameShardRouter()
+        self.assertEqual(router.db_for_read(Game, instance=Game(id=7)), 'shard_test')
+        self.assertEqual(router.db_for_write(Game, instance=Game(id=8)), 'default')
+        self.assertIsNone(router.db_for_read(Game))
+
+        here, there = self.game, create_games(1)[0]
+        self.assertNotEqual(here._state.db, there._state.db)
+        player = Player.objects.using(here._state.db).filter(game=here).first()
+        self.assertTrue(router.allow_relation(here, player))
+        self.assertFalse(router.allow_relation(there, player))
+        self.assertIsNone(router.allow_relation(Game(), player))
+
+        self.assertIsNone(router.allow_migrate('default', 'game', 'game'))
+        self.assertTrue(router.allow_migrate('shard_test', 'game', 'piece'))
+        self.assertFalse(router.allow_migrate('shard_test', 'game', 'gamesequence'))
+        self.assertTrue(router.allow_migrate('shard_test', 'auth', 'user'))
+        self.assertFalse(router.allow_migrate('shard_test', 'sessions', 'session'))
+        with self.settings(GAME_SHARDS=['default']):
+            self.assertIsNone(router.allow_migrate('shard_test', 'game', 'piece'))
+
+    def test_rebalance_moves_games(self):
+        with self.settings(GAME_SHARDS=['default']):
+            games = create_games(2)
+            random.seed(11)
+            for game in games:
+                for _ in range(journal.CHECKPOINT_INTERVAL + 10):
+                    turns.play_turn(game.id, 'furthest')
+            cache.game_cache.flush_all()
+            before = {game.id: self.rows('default', game.id) for game in games}
+            self.assertTrue(all(rows[4] for rows in before.values()))
+            boards = {game.id: list(load_snapshot(game.id).board_state().progress) for game in games}
+        cache.game_cache.clear()
+
+        call_command('rebalance_shards', stdout=io.StringIO())
+        for game in games:
+            with self.subTest(game=game.id):
+                db = shards.db_for_game(game.id)
+                self.assertEqual(self.rows(db, game.id), before[game.id])
+                self.assertEqual(list(load_snapshot(game.id).board_state().progress), boards[game.id])
+                if db != 'default':
+                    self.assertEqual(self.rows('default', game.id), (0, 0, 0, 0, 0))
+        moved = [game for game in games if shards.db_for_game(game.id) != 'default']
+        self.assertEqual(len(moved), 1)
+        self.assertEqual(Player.objects.using('default').filter(game__isnull=True).count(), 0)
+        self.assertFalse(Piece.objects.using('default').filter(player__game_id=moved[0].id).exists())
+
+
+# =============================================================================
+# LOBBY
+# =============================================================================
+
+class LobbyPagingTests(TestCase):
+    """Keyset pages of the lobby list every open game once, newest first"""
+
+    def setUp(self):
+        self.games = create_games(7)
+        # Three games share one timestamp, so the cursor's id has to break the tie
+        now = timezone.now()
+        for offset, game in zip([0, 1, 1, 1, 2, 3, 4], self.games):
+            game.created_at = now - timedelta(minutes=offset)
+        Game.objects.bulk_update(self.games, ['created_at'])
+        Game.objects.filter(id=self.games[-1].id).update(status='finished')
+        self.open_ids = sorted(((game.created_at, game.id) for game in self.games[:-1]), reverse=True)
+
+    def pages(self, limit):
+        """Ids of every page, following next_cursor to the end"""
+        pages, cursor = [], None
+        while True:
+            result = lobby.page(cursor, limit)
+            pages.append([game.id for game in result.games])
+            cursor = result.next_cursor
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_open_game_once(self):
+        expected = [game_id for _, game_id in self.open_ids]
+        for limit in (1, 2, 4, 5, 6, 20):
+            with self.subTest(limit=limit):
+                pages = self.pages(limit)
+                self.assertEqual([game_id for page in pages for game_id in page], expected)
+                self.assertTrue(all(len(page) == limit for page in pages[:-1]))
+
+    def test_last_full_page_has_no_cursor(self):
+        # Six open games in pages of three: the second page is full and the last
+        self.assertEqual([len(page) for page in self.pages(3)], [3, 3])
+        self.assertEqual([len(page) for page in self.pages(6)], [6])
+
+    def test_cursor_round_trip(self):
+        game = Game.objects.get(id=self.games[2].id)
+        self.assertEqual(lobby.decode_cursor(lobby.encode_cursor(game)), (game.created_at, game.id))
+
+    def test_invalid_cursor_and_limit(self):
+        for query in ({'before': 'nonsense'}, {'before': '12x-3'}, {'limit': 0}, {'limit': 'many'},
+                      {'limit': lobby.MAX_PAGE_SIZE + 1},
+                      # Out of range for timedelta, datetime and a SQLite integer
+                      {'before': '99999999999999999999-1'}, {'before': '253402300800000000-1'},
+                      {'before': '1-99999999999999999999999'}, {'before': '1-0'}):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(reverse('lobby_games'), query).status_code, 400)
+        response = self.client.get(reverse('lobby_games'), {'limit': 4})
+        self.assertEqual(len(response.json()['games']), 4)
+        self.assertIsNotNone(response.json()['next_cursor'])
+        # The home page shows the first page instead
+        self.assertEqual(self.client.get(reverse('home'), {'before': '99999999999999999999-1'}).status_code, 200)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+class BenchmarkDatabaseTests(SimpleTestCase):
+    """The benchmarks only write to development or test databases"""
+
+    databases = {'default'}
+
+    def test_test_database_allowed(self):
+        # The test runner turns DEBUG off and points 'default' at the test database
+        self.assertTrue(benchmark.is_test_database('default'))
+        benchmark.check_database()
+
+    def test_live_database_refused(self):
+        with mock.patch.object(benchmark, 'is_test_database', return_value=False):
+            with self.assertRaisesMessage(benchmark.UnsafeDatabaseError, 'default'):
+                benchmark.check_database()
+            with self.assertRaises(CommandError):
+                call_command('benchmark_endpoints', stdout=io.StringIO())
+            with self.settings(DEBUG=True):
+                benchmark.check_database()
@@ -0,0 +1,404 @@
+"""
+Turn Processing Module
+======================
+
+Runs dice rolls and piece moves as atomic, concurrency-safe units.
+
+How it works:
+    1. The game is loaded through a snapshot without holding any lock
+    2. The turn is validated and applied in memory by the rules engine
+    3. Inside one transaction the Game row is updated with a
+       compare-and-swap on its version column, then the changed pieces
+       are written
+
+If another request committed a turn in between, the compare-and-swap
+matches no row and the request is rejected with StaleTurnError before
+anything is written. Every writer of turn state must bump Game.version.
+Committed turns are published to live clients through the broker.
+
+Every commit also appends its event to the move journal (game.journal).
+Games are read through the hot game cache (game.cache); with the cache
+enabled, the Game row and journal event are written at commit time and
+the Piece rows are written behind. Packed games (Game.board) write the
+board together with the Game row.
+Every transaction runs on the game's shard (game.shards.db_for_game), so
+turns of games on different shards do not wait for each other.
+
+A player without a legal move passes on the server, after up to three
+rolls if only a 6 can help (rules.BoardState.rolls_allowed). play_turn()
+rolls and, given a piece or a policy, moves in one commit.
+
+Computer players (Player.is_bot) take their turns right after the human
+move or pass that hands them the turn, inside the same request (play_bots),
+so the response carries them to clients without a live event stream. At
+most MAX_BOT_TURNS rolls are played per request; a roll or move request
+arriving while a computer player still holds the turn plays the next
+computer turns instead and is rejected with BotTurnError.
+
+Author: Mensch, ärgere dich nicht! Team
+"""
+
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import F
+
+from . import ai, cache, journal, rules
+from .broker import broker
+from .models import Game, Player
+from .shards import db_for_game
+from .snapshot import serialize_delta
+
+
+# Game fields that a turn may change
+TURN_FIELDS = ['status', 'winner', 'current_player_index', 'dice_value', 'tries']
+
+# Computer turns played in a row by one request (a bot rolling 6s keeps the turn)
+MAX_BOT_TURNS = 12
+
+# How play_turn() picks among the legal moves when the client leaves it to the server:
+# game.ai's choice, the piece furthest along, or the one furthest behind (enters from start first)
+PIECE_POLICIES = ('ai', 'furthest', 'nearest')
+
+# Outcome of a roll by player: piece is the piece moved right away (or None),
+# passed tells whether the turn went to the next player without a move
+TurnResult = namedtuple('TurnResult', [
+    'snapshot', 'player', 'dice_value', 'movable_pieces', 'piece', 'passed', 'tries_left', 'game_over',
+])
+
+
+class TurnError(Exception):
+    """A turn request that was rejected, with the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class StaleTurnError(TurnError):
+    """Another request changed the game after it was loaded"""
+
+    def __init__(self, message='Game was updated by another request, please retry'):
+        super().__init__(message, status=409)
+
+
+class BotTurnError(TurnError):
+    """A human action arrived while a computer player holds the turn"""
+
+    def __init__(self, message='Computer players are still moving, please retry'):
+        super().__init__(message, status=409)
+
+
+def commit_game(game, fields=TURN_FIELDS, flushed=False):
+    """
+    Write game fields only if the game still has the version it was loaded with.
+
+    Must run inside a transaction together with the piece writes of the turn.
+
+    Args:
+        game: Game with the new field values and the version it was loaded at
+        fields: Game fields to write
+        flushed: The Piece rows match the new version (written in the same
+            transaction, or unchanged and already up to date)
+
+    Raises:
+        StaleTurnError: If another request bumped the version first
+    """
+    values = {field: getattr(game, field) for field in fields}
+    if flushed:
+        values['flushed_version'] = F('version') + 1
+    updated = Game.objects.using(db_for_game(game.id)).filter(id=game.id, version=game.version).update(
+        version=F('version') + 1, **values
+    )
+    if not updated:
+        cache.game_cache.invalidate(game.id)
+        raise StaleTurnError()
+    game.version += 1
+    if flushed:
+        game.flushed_version = game.version
+
+
+def publish(snapshot, event_type, pieces=(), **extra):
+    """
+    Push a committed change to the game's live subscribers.
+
+    Events of a roll that ended the turn (a pass, or a move chosen right
+    after the roll) name the player who rolled and whether it is a bot.
+    """
+    event = serialize_delta(snapshot, pieces)
+    event['type'] = event_type
+    event.update(extra)
+    broker.publish(snapshot.game.id, event)
+
+
+def roll(game_id):
+    """
+    Roll the dice for the current player.
+
+    Without a legal move the player rolls again while tries are left
+    (rules.ROLLS_FROM_START when only a 6 helps), otherwise the turn passes.
+
+    Returns:
+        TurnResult (piece is None)
+    """
+    return play_turn(game_id)
+
+
+def play_turn(game_id, policy=None, piece_id=None):
+    """
+    Roll for the current player and, given a piece or a policy, move at once.
+
+    The roll and the move are committed together, so a turn costs one
+    request and one commit. Without a piece to move the roll is committed
+    on its own and the client moves with move().
+
+    Args:
+        game_id: Game to play
+        policy: None, or one of PIECE_POLICIES to choose among the legal moves
+        piece_id: Piece to move if it can; the policy decides otherwise
+
+    Returns:
+        TurnResult
+    """
+    if policy is not None and policy not in PIECE_POLICIES:
+        raise TurnError(f'Unknown piece policy {policy!r}')
+
+    snapshot = cache.load(game_id)
+    game = snapshot.game
+
+    if game.status != 'in_progress':
+        raise TurnError('Game is not in progress')
+
+    _check_human_turn(snapshot)
+    current_player = snapshot.current_player
+    if game.dice_value and _movable_pieces(current_player, game.dice_value):
+        raise TurnError('Move a piece first')
+
+    dice_value = game.roll_dice(save=False)
+    movable_pieces = _movable_pieces(current_player, dice_value)
+
+    piece = _choose_piece(snapshot, movable_pieces, policy, piece_id)
+    if piece is not None:
+        changed = _commit_move(snapshot, piece, dice_value)
+        publish(snapshot, 'move', changed, moved_piece=piece.id,
+                player=current_player.name, is_bot=current_player.is_bot, rolled=dice_value)
+        game_over = game.status == 'finished'
+        return TurnResult(snapshot, current_player, dice_value, movable_pieces, piece, False, 0, game_over)
+
+    if movable_pieces:
+        seat = game.current_player_index % len(snapshot.players)
+        with transaction.atomic(using=db_for_game(game.id)):
+            commit_game(game, ['dice_value'], flushed=not snapshot.unflushed)
+            journal.record(game, 'roll', seat, dice_value)
+            _checkpoint_if_due(snapshot)
+        cache.store(snapshot)
+        publish(snapshot, 'roll', movable_pieces=movable_pieces)
+        return TurnResult(snapshot, current_player, dice_value, movable_pieces, None, False, 0, False)
+
+    tries_left = _commit_no_move(snapshot, snapshot.board_state(), dice_value)
+    if tries_left:
+        publish(snapshot, 'roll', movable_pieces=[])
+    else:
+        publish(snapshot, 'pass', player=current_player.name, is_bot=current_player.is_bot, rolled=dice_value)
+    return TurnResult(snapshot, current_player, dice_value, [], None, not tries_left, tries_left, False)
+
+
+def _check_human_turn(snapshot):
+    """
+    Make sure a human player holds the turn before acting for them.
+
+    If play_bots() stopped at MAX_BOT_TURNS with a computer player still to
+    move, its next turns are played now instead of the requested action.
+
+    Raises:
+        BotTurnError: If a computer player held the turn
+    """
+    player = snapshot.current_player
+    if player is not None and player.is_bot:
+        play_bots(snapshot)
+        raise BotTurnError()
+
+
+def _movable_pieces(player, dice_value):
+    """Ids of a player's pieces that can move by dice_value"""
+    if player is None:
+        return []
+    return [piece.id for piece in player.pieces.all() if piece.can_move(dice_value)]
+
+
+def _choose_piece(snapshot, movable_pieces, policy, piece_id):
+    """The piece to move right after the roll (piece_id if it can move, else by policy), or None"""
+    if not movable_pieces:
+        return None
+    if piece_id in movable_pieces:
+        return snapshot.get_piece(piece_id)
+    if policy == 'ai':
+        index = ai.choose_move(snapshot.board_state())
+        return snapshot.piece_at(index) if index is not None else None
+    candidates = [snapshot.get_piece(movable_id) for movable_id in movable_pieces]
+    if policy == 'furthest':
+        return max(candidates, key=lambda piece: piece.progress)
+    if policy == 'nearest':
+        return min(candidates, key=lambda piece: piece.progress)
+    return None
+
+
+def _commit_no_move(snapshot, board, dice_value):
+    """
+    Commit a roll that moves no piece: the player keeps the turn while
+    tries are left (journal 'roll'), otherwise it passes (journal 'pass').
+
+    Args:
+        board: rules.BoardState of the game before the roll
+
+    Returns:
+        Rolls the player has left this turn (0 if the turn passed)
+    """
+    game = snapshot.game
+    seat = game.current_player_index % len(snapshot.players)
+    game.tries += 1
+    tries_left = max(board.rolls_allowed(seat) - game.tries, 0)
+    if not tries_left:
+        game.next_turn(save=False)
+    with transaction.atomic(using=db_for_game(game.id)):
+        commit_game(game, flushed=not snapshot.unflushed)
+        journal.record(game, 'roll' if tries_left else 'pass', seat, dice_value)
+        _checkpoint_if_due(snapshot)
+    cache.store(snapshot)
+    return tries_left
+
+
+def move(game_id, piece_id):
+    """
+    Move a piece of the current player by the rolled dice value.
+
+    Returns:
+        Tuple of (snapshot, moved piece, whether the game is over)
+    """
+    snapshot = cache.load(game_id)
+    game = snapshot.game
+    piece = snapshot.get_piece(piece_id)
+    if piece is None:
+        raise TurnError('Piece not found', status=404)
+
+    if game.status != 'in_progress':
+        raise TurnError('Game is not in progress')
+
+    _check_human_turn(snapshot)
+    if piece.player != snapshot.current_player:
+        raise TurnError('Not your turn', status=403)
+
+    dice_value = game.dice_value
+    if dice_value == 0:
+        raise TurnError('Roll the dice first')
+
+    changed = _commit_move(snapshot, piece, dice_value)
+    if changed is None:
+        raise TurnError('Invalid move')
+
+    publish(snapshot, 'move', changed, moved_piece=piece.id)
+    return snapshot, piece, game.status == 'finished'
+
+
+def _commit_move(snapshot, piece, dice_value):
+    """
+    Apply a move in memory, pass the turn and commit the game and changed pieces.
+
+    Returns:
+        List of changed pieces, or None if the move is illegal
+    """
+    game = snapshot.game
+    index = snapshot.piece_index(piece)
+    was_in_home = piece.in_home
+
+    # Move the piece in memory (captured pieces included)
+    changed = snapshot.apply_move(piece, dice_value)
+    if changed is None:
+        return None
+
+    # Home counters make the winner check O(1) (captures never touch home pieces)
+    entered_home = piece.in_home and not was_in_home
+    if entered_home:
+        piece.player.pieces_home += 1
+
+    # Check for winner, otherwise move to next turn (unless rolled a 6)
+    game_over = game.check_winner(save=False)
+    if not game_over:
+        if dice_value != 6:
+            game.next_turn(save=False)
+        else:
+            game.dice_value = 0
+            game.tries = 0
+
+    with transaction.atomic(using=db_for_game(game.id)):
+        if snapshot.packed:
+            # The whole board is a column of the Game row: one row per turn
+            snapshot.stamp_pieces(changed, game.version + 1)
+            game.board = snapshot.pack()
+            commit_game(game, TURN_FIELDS + ['board'], flushed=True)
+        elif cache.enabled():
+            # Piece rows are written behind by the cache's flusher
+            commit_game(game)
+            snapshot.stamp_pieces(changed)
+            snapshot.unflushed = True
+        else:
+            commit_game(game, flushed=True)
+            snapshot.save_pieces(changed)
+        if entered_home:
+            Player.objects.using(db_for_game(game.id)).filter(id=piece.player_id).update(
+                pieces_home=F('pieces_home') + 1
+            )
+        journal.record(
+            game, 'move', index // rules.PIECES_PER_PLAYER, dice_value, index,
+            [snapshot.piece_index(captured) for captured in changed[1:]],
+        )
+        _checkpoint_if_due(snapshot)
+    cache.store(snapshot)
+    return changed
+
+
+def _checkpoint_if_due(snapshot):
+    """Store a journal checkpoint every journal.CHECKPOINT_INTERVAL versions"""
+    if journal.checkpoint_due(snapshot.game):
+        journal.checkpoint(snapshot.game, snapshot.board_state())
+
+
+def play_bots(snapshot, max_turns=MAX_BOT_TURNS, time_budget=ai.DEFAULT_TIME_BUDGET):
+    """
+    Play the turns of computer players until a human player is to move.
+
+    Each roll lets game.ai choose a piece within time_budget seconds and
+    commits like a human move. A bot without a legal move rolls again or
+    passes like a human (each roll counts towards max_turns).
+
+    Returns:
+        List of played rolls as dicts (player, color, dice_value, piece_id)
+    """
+    game = snapshot.game
+    played = []
+    while len(played) < max_turns and game.status == 'in_progress':
+        player = snapshot.current_player
+        if player is None or not player.is_bot:
+            break
+
+        dice_value = game.roll_dice(save=False)
+        board = snapshot.board_state()
+        index = ai.choose_move(board, time_budget=time_budget)
+        piece = snapshot.piece_at(index) if index is not None else None
+
+        if piece is None:
+            if _commit_no_move(snapshot, board, dice_value):
+                publish(snapshot, 'roll', movable_pieces=[])
+            else:
+                publish(snapshot, 'pass', player=player.name, is_bot=True, rolled=dice_value)
+        else:
+            changed = _commit_move(snapshot, piece, dice_value)
+            publish(snapshot, 'move', changed, moved_piece=piece.id, player=player.name, is_bot=True, rolled=dice_value)
+
+        played.append({
+            'player': player.name,
+            'color': player.color,
+            'dice_value': dice_value,
+            'piece_id': piece.id if piece else None,
+        })
+    return played
@@ -5,25 +5,48 @@ Game Views Module
 Handles all HTTP requests and responses for the board game.
 
 Main Functions:
-    - home(): Display home page with active games
+    - home(): Display home page with the newest active games
+    - lobby_games(): Active games as JSON, one page per request (infinite scroll)
     - create_game(): Create new game with 4 players
-    - game_board(): Render main game interface
-    - roll_dice(): Handle dice rolling logic
-    - move_piece(): Execute piece movement and special tasks
-    - get_game_state(): Return current game state as JSON
+    - game_board(): Render main game interface from cached fragments
+    - roll_dice(): Handle dice rolling logic (passes without a legal move)
+    - play_turn(): Roll and move in one request
+    - move_piece(): Execute piece movement, special tasks and computer turns
+    - get_game_state(): Return current game state as JSON (compact on request)
+    - game_events(): Stream live game updates (Server-Sent Events, ASGI only)
+    - game_replay(): Stream a game's journal, one JSON line per event
     - quit_game(): End game and mark as finished
+    - metrics(): Request metrics in the Prometheus text format
+
+The endpoints spectators use (game_board, get_game_state, game_events) are
+async views, so under ASGI an idle live stream does not tie up a sync worker.
+dont_b_mad.asgi serves the live streams before the middleware (game.live).
+Turn endpoints stay sync: their commits need transaction.atomic(), which
+the async ORM does not offer, so Django runs them in a worker thread.
 
 Author: Mensch, ärgere dich nicht! Team
 Date: October 2025
 """
 
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.core.cache import cache as fragment_cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import F
 from .models import Game, Player, Piece
 from .currency_mapping import CURRENCY_MAPPING
-from .special_tasks import get_task, is_special_position, get_all_special_positions
+from .special_tasks import SPECIAL_TASKS, get_task, is_special_position
+from .snapshot import COMPACT_MEDIA_TYPE, serialize_colors, serialize_pieces, serialize_state
+from .provisioning import create_game as create_game_with_players
+from .broker import broker
+from . import cache, images, journal, live, lobby, metrics as request_metrics, shards, turns
+import hmac
 import json
 
 
@@ -59,65 +82,147 @@ TEAM_PIECE_IMAGES = {
     ]
 }
 
+# Sprite sheets written by optimize_images: the dice faces and each team's four tokens
+SPRITE_SHEETS = {
+    'dice': {'use': 'dice', 'fit': 'contain', 'frames': [f'dice/dice{value}.png' for value in range(1, 7)]},
+    **{
+        f'team-{color}': {'use': 'token', 'fit': 'cover', 'frames': paths}
+        for color, paths in TEAM_PIECE_IMAGES.items()
+    },
+}
+
+# Images game.js shows, by image variant use (see game/images.py)
+CLIENT_IMAGES = {
+    'token': [path for paths in TEAM_PIECE_IMAGES.values() for path in paths],
+    'dice': [f'dice/dice{value}.png' for value in range(1, 7)],
+    'card': [task['image'] for task in SPECIAL_TASKS.values() if task.get('image')],
+}
+
+# Seconds a rendered game state stays in the fragment cache (settings.CACHES
+# 'default'; use a shared backend so several workers share fragments)
+BOARD_CACHE_TIMEOUT = 15 * 60
+
 
 def home(request):
-    """Home page showing available games"""
-    games = Game.objects.filter(status__in=['waiting', 'in_progress']).order_by('-created_at')
-    return render(request, 'game/home.html', {'games': games})
+    """Home page showing the newest active games; older ones load while scrolling"""
+    try:
+        games = lobby.page(request.GET.get('before'))
+    except ValueError:
+        games = lobby.page()
+    return render(request, 'game/home.html', {'games': games.games, 'next_cursor': games.next_cursor})
+
+
+def lobby_games(request):
+    """
+    One page of active games as JSON, newest first.
+    
+    ?before=<next_cursor of the previous page> continues the list,
+    ?limit= sets the page size (up to lobby.MAX_PAGE_SIZE).
+    """
+    try:
+        limit = int(request.GET.get('limit', lobby.PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number'}, status=400)
+    if not 1 <= limit <= lobby.MAX_PAGE_SIZE:
+        return JsonResponse({'error': f'limit must be between 1 and {lobby.MAX_PAGE_SIZE}'}, status=400)
+    
+    try:
+        games = lobby.page(request.GET.get('before'), limit)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    return JsonResponse({
+        'games': [lobby.serialize_game(game) for game in games.games],
+        'next_cursor': games.next_cursor,
+    })
 
 
 def create_game(request):
     """Create a new game"""
     if request.method == 'POST':
-        game = Game.objects.create(status='waiting')
-        
-        # Create 4 players with different colors
-        colors = ['red', 'blue', 'green', 'yellow']
-        player_names = request.POST.getlist('player_names[]')
-        
-        if not player_names or len(player_names) < 2:
-            player_names = ['Player 1', 'Player 2', 'Player 3', 'Player 4']
+        # Create the game with 4 players and 16 pieces in one transaction
+        fill_with_bots = request.POST.get('fill_with_bots') == 'on'
+        game = create_game_with_players(request.POST.getlist('player_names[]'), fill_with_bots)
         
-        for i, color in enumerate(colors):
-            player_name = player_names[i] if i < len(player_names) else f'Player {i+1}'
-            player = Player.objects.create(
-                game=game,
-                name=player_name,
-                color=color,
-                order=i
-            )
-            
-            # Create 4 pieces for each player
-            for piece_num in range(4):
-                Piece.objects.create(
-                    player=player,
-                    piece_number=piece_num,
-                    position=-1  # Start in starting area
-                )
-        
-        game.status = 'in_progress'
-        game.save()
+        # A computer player on the first seat opens the game
+        if fill_with_bots:
+            turns.play_bots(cache.load(game.id))
         
         return redirect('game_board', game_id=game.id)
     
     return render(request, 'game/create_game.html')
 
 
-def game_board(request, game_id):
+async def game_board(request, game_id):
     """Display the game board"""
-    game = get_object_or_404(Game, id=game_id)
-    players = game.players.all().order_by('order')
-    current_player = game.get_current_player()
+    snapshot = await cache.aload(game_id)
+    # The fragment cache and template rendering block: one worker thread hop for both
+    return await sync_to_async(_render_board)(request, snapshot)
+
+
+def _render_board(request, snapshot):
+    """Render the board page of a loaded game"""
+    context = {
+        'game': snapshot.game,
+        'current_player': snapshot.current_player,
+        'board': {**_board_static(), **_board_state(snapshot)},
+    }
     
-    # Get all pieces for all players with team images
+    return render(request, 'game/game_board.html', context)
+
+
+# =============================================================================
+# BOARD RENDERING - cached fragments of the game board page
+# =============================================================================
+
+def _board_cache_key(*parts):
+    """Fragment cache key; includes the image manifest, whose URLs the fragments embed"""
+    return ':'.join(['game_board', images.manifest_token(), *map(str, parts)])
+
+
+def _board_static():
+    """
+    Parts of the board page that are the same for every game: the SVG board
+    with its special squares and decorations, and the image data for game.js.
+    Rendered once and kept until the image manifest changes.
+    """
+    key = _board_cache_key('static')
+    fragment = fragment_cache.get(key)
+    if fragment is None:
+        fragment = {
+            'svg': render_to_string('game/partials/board_svg.html'),
+            'image_variants': json.dumps(images.client_variants(CLIENT_IMAGES)),
+            'sprite_sheets': json.dumps(images.client_sprites(SPRITE_SHEETS)),
+        }
+        fragment_cache.set(key, fragment, None)
+    return fragment
+
+
+def _board_state(snapshot):
+    """
+    Players sidebar and pieces JSON of one game state, built in a single
+    pass over the pieces and cached by game version (every commit bumps it).
+    """
+    game = snapshot.game
+    key = _board_cache_key(game.id, game.version)
+    fragment = fragment_cache.get(key)
+    if fragment is not None:
+        return fragment
+    
+    players = []
     pieces_data = []
-    for player in players:
+    for player in snapshot.players:
         currency_info = CURRENCY_MAPPING.get(player.color, {})
         team_imgs = TEAM_PIECE_IMAGES.get(player.color, [])
+        pieces = []
         for piece in player.pieces.all():
             # Get the specific team image for this piece
             team_image = team_imgs[piece.piece_number] if piece.piece_number < len(team_imgs) else ''
-            
+            pieces.append({
+                'piece_number': piece.piece_number,
+                'in_home': piece.in_home,
+                'team_image': team_image,
+            })
             pieces_data.append({
                 'id': piece.id,
                 'player_color': player.color,
@@ -128,175 +233,293 @@ def game_board(request, game_id):
                 'currency_symbol': currency_info.get('symbol', ''),
                 'team_image': team_image,
             })
+        players.append({
+            'name': player.name,
+            'color': player.color,
+            'currency_info': currency_info,
+            'pieces': pieces,
+        })
     
-    # Add currency info and team images to players and pieces
-    players_with_currency = []
-    for player in players:
-        player.currency_info = CURRENCY_MAPPING.get(player.color, {})
-        player.team_images = TEAM_PIECE_IMAGES.get(player.color, [])
-        
-        # Attach specific team image to each piece and cache the pieces list
-        pieces_list = []
-        for piece in player.pieces.all():
-            team_imgs = TEAM_PIECE_IMAGES.get(player.color, [])
-            if piece.piece_number < len(team_imgs):
-                piece.team_image = team_imgs[piece.piece_number]
-            else:
-                piece.team_image = ''
-            pieces_list.append(piece)
-        
-        # Cache the pieces list with team images
-        player.pieces_with_images = pieces_list
-        
-        players_with_currency.append(player)
-    
-    context = {
-        'game': game,
-        'players': players_with_currency,
-        'current_player': current_player,
+    fragment = {
+        'players_html': render_to_string('game/partials/board_players.html', {'players': players}),
         'pieces_data': json.dumps(pieces_data),
-        'currency_mapping': CURRENCY_MAPPING,
-        'special_positions': get_all_special_positions(),
     }
-    
-    return render(request, 'game/game_board.html', context)
+    fragment_cache.set(key, fragment, BOARD_CACHE_TIMEOUT)
+    return fragment
 
 
 @require_POST
 def roll_dice(request, game_id):
-    """Roll the dice for the current player"""
-    game = get_object_or_404(Game, id=game_id)
+    """Roll the dice for the current player; without a legal move the server rolls again or passes"""
+    try:
+        result = turns.roll(game_id)
+    except turns.TurnError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
     
-    if game.status != 'in_progress':
-        return JsonResponse({'error': 'Game is not in progress'}, status=400)
+    return _turn_response(request, game_id, result)
+
+
+@require_POST
+def play_turn(request, game_id):
+    """
+    Roll and, with a piece or a policy, move in one request.
     
-    dice_value = game.roll_dice()
-    current_player = game.get_current_player()
+    POST fields (both optional):
+        piece: Id of the piece to move if it can move
+        policy: How to choose otherwise (turns.PIECE_POLICIES); without
+            one, the legal moves are returned and the client calls move_piece
+    """
+    policy = request.POST.get('policy') or None
+    piece_id = request.POST.get('piece') or None
+    if piece_id is not None:
+        try:
+            piece_id = int(piece_id)
+        except ValueError:
+            return JsonResponse({'error': 'piece must be a piece id'}, status=400)
     
-    # Check which pieces can move
-    movable_pieces = []
-    if current_player:
-        for piece in current_player.pieces.all():
-            if piece.can_move(dice_value):
-                movable_pieces.append(piece.id)
+    try:
+        result = turns.play_turn(game_id, policy, piece_id)
+    except turns.TurnError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
     
-    return JsonResponse({
-        'dice_value': dice_value,
+    return _turn_response(request, game_id, result)
+
+
+def _play_bots(game_id, snapshot):
+    """
+    Let computer players take their turns after a committed human turn.
+    
+    Returns:
+        Tuple of (snapshot, bot turns); a fresh snapshot and no turns if
+        another request overtook the bots
+    """
+    try:
+        return snapshot, turns.play_bots(snapshot)
+    except turns.StaleTurnError:
+        return cache.load(game_id), []
+
+
+def _winner_name(snapshot):
+    """Name of the winner of a finished game"""
+    game = snapshot.game
+    if game.winner:
+        return game.winner.username
+    return next((player.name for player in snapshot.players if player.has_won()), None)
+
+
+def _turn_response(request, game_id, result):
+    """Response to a roll or combined turn, after the computer turns it handed over to"""
+    snapshot = result.snapshot
+    bot_turns = []
+    if (result.passed or result.piece is not None) and not result.game_over:
+        snapshot, bot_turns = _play_bots(game_id, snapshot)
+    game = snapshot.game
+    game_over = game.status == 'finished'
+    current_player = snapshot.current_player
+    compact = _wants_compact(request)
+    
+    response = {
+        'version': game.version,
+        'player': result.player.name,
+        'dice_value': result.dice_value,
+        'movable_pieces': [] if result.piece else result.movable_pieces,
+        'moved_piece': result.piece.id if result.piece else None,
+        'tries_left': result.tries_left,
+        'passed': result.passed,
         'current_player': current_player.name if current_player else None,
         'current_player_color': current_player.color if current_player else None,
-        'movable_pieces': movable_pieces
-    })
+        'game_over': game_over,
+        'winner': _winner_name(snapshot) if game_over else None,
+        'bot_turns': bot_turns,
+    }
+    if result.piece is not None or bot_turns:
+        response['all_pieces'] = serialize_pieces(snapshot, compact=compact)
+        if compact:
+            response['colors'] = serialize_colors(snapshot)
+    if result.piece is not None and is_special_position(result.piece.position):
+        response['special_task'] = get_task(result.piece.position)
+    
+    return _negotiated_response(response, compact)
+
+
+def _wants_compact(request):
+    """Whether the Accept header asks for the compact encoding (snapshot.COMPACT_MEDIA_TYPE)"""
+    return any(
+        f'{media.main_type}/{media.sub_type}' == COMPACT_MEDIA_TYPE and media.params.get('q') != '0'
+        for media in request.accepted_types
+    )
+
+
+def _negotiated_response(data, compact):
+    """JsonResponse labelled with the encoding used, varying on Accept"""
+    response = JsonResponse(data, content_type=COMPACT_MEDIA_TYPE if compact else 'application/json')
+    patch_vary_headers(response, ['Accept'])
+    return response
 
 
 @require_POST
 def move_piece(request, game_id, piece_id):
-    """Move a piece on the board"""
-    game = get_object_or_404(Game, id=game_id)
-    piece = get_object_or_404(Piece, id=piece_id)
-    
-    if game.status != 'in_progress':
-        return JsonResponse({'error': 'Game is not in progress'}, status=400)
-    
-    current_player = game.get_current_player()
-    if piece.player != current_player:
-        return JsonResponse({'error': 'Not your turn'}, status=403)
+    """
+    Move a piece on the board, then let computer players take their turns.
     
-    if game.dice_value == 0:
-        return JsonResponse({'error': 'Roll the dice first'}, status=400)
-    
-    if not piece.can_move(game.dice_value):
-        return JsonResponse({'error': 'Invalid move'}, status=400)
+    all_pieces is sent compact (with 'colors') when the Accept header asks for it.
+    """
+    try:
+        snapshot, piece, game_over = turns.move(game_id, piece_id)
+    except turns.TurnError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
     
-    # Move the piece
-    piece.move(game.dice_value)
+    # The human move is committed; if another request overtakes the bots, answer with fresh state
+    bot_turns = []
+    if not game_over:
+        snapshot, bot_turns = _play_bots(game_id, snapshot)
+        piece = snapshot.get_piece(piece.id)
+    game = snapshot.game
+    compact = _wants_compact(request)
     
     # Check if landed on a special position (Yellow section)
     special_task = None
     if is_special_position(piece.position):
         special_task = get_task(piece.position)
     
-    # Check for winner
-    if game.check_winner():
+    if game.status == 'finished':
         response = {
             'success': True,
+            'version': game.version,
             'piece_position': piece.position,
             'in_home': piece.in_home,
             'game_over': True,
-            'winner': game.winner.username if game.winner else current_player.name
+            'winner': _winner_name(snapshot) or piece.player.name,
+            'bot_turns': bot_turns,
         }
+        if bot_turns:
+            response['all_pieces'] = serialize_pieces(snapshot, compact=compact)
+            if compact:
+                response['colors'] = serialize_colors(snapshot)
         if special_task:
             response['special_task'] = special_task
-        return JsonResponse(response)
-    
-    # Move to next turn (unless rolled a 6, then get another turn)
-    if game.dice_value != 6:
-        game.next_turn()
-    else:
-        game.dice_value = 0
-        game.save()
+        return _negotiated_response(response, compact)
     
     # Get all pieces positions for update
-    all_pieces = []
-    for player in game.players.all():
-        for p in player.pieces.all():
-            all_pieces.append({
-                'id': p.id,
-                'position': p.position,
-                'in_home': p.in_home,
-                'player_color': p.player.color
-            })
+    all_pieces = serialize_pieces(snapshot, compact=compact)
     
-    next_player = game.get_current_player()
+    next_player = snapshot.current_player
     
     response = {
         'success': True,
+        'version': game.version,
         'all_pieces': all_pieces,
         'next_player': next_player.name if next_player else None,
         'next_player_color': next_player.color if next_player else None,
-        'game_over': False
+        'game_over': False,
+        'bot_turns': bot_turns,
     }
+    if compact:
+        response['colors'] = serialize_colors(snapshot)
     
     if special_task:
         response['special_task'] = special_task
     
-    return JsonResponse(response)
+    return _negotiated_response(response, compact)
+
+
+def _state_etag(version, compact):
+    """ETag of one version of the game state in one encoding"""
+    return f'"v{version}-c"' if compact else f'"v{version}"'
 
 
-def get_game_state(request, game_id):
-    """Get the current state of the game"""
-    game = get_object_or_404(Game, id=game_id)
-    current_player = game.get_current_player()
+def _state_headers(response, etag):
+    """Caching headers of a state response (also on 304)"""
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+async def get_game_state(request, game_id):
+    """
+    Get the current state of the game.
     
-    pieces_data = []
-    for player in game.players.all():
-        for piece in player.pieces.all():
-            pieces_data.append({
-                'id': piece.id,
-                'player_color': player.color,
-                'position': piece.position,
-                'in_home': piece.in_home,
-                'piece_number': piece.piece_number
-            })
+    Answers 304 when If-None-Match carries the current version. With
+    ?since=<version>, only the pieces changed after that version are sent.
+    With "Accept: application/vnd.mensch.compact+json" pieces are positional
+    arrays (see snapshot.COMPACT_PIECE_FIELDS).
     
-    return JsonResponse({
-        'status': game.status,
-        'current_player': current_player.name if current_player else None,
-        'current_player_color': current_player.color if current_player else None,
-        'dice_value': game.dice_value,
-        'pieces': pieces_data,
-        'winner': game.winner.username if game.winner else None
-    })
+    Async, since spectators poll it: the version query uses the async ORM
+    and a 304 or a cache hit needs no sync worker.
+    """
+    since = request.GET.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return JsonResponse({'error': 'since must be a version number'}, status=400)
+    
+    compact = _wants_compact(request)
+    games = Game.objects.using(shards.db_for_game(game_id))
+    version = await games.filter(id=game_id).values_list('version', flat=True).afirst()
+    if version is None:
+        raise Http404('No Game matches the given query.')
+    etag = _state_etag(version, compact)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return _state_headers(not_modified, etag)
+    
+    snapshot = await cache.aload(game_id, version)
+    
+    # Versions from the future (e.g. a reset database) get the full state
+    if since is not None and not 0 <= since <= snapshot.game.version:
+        since = None
+    
+    response = _negotiated_response(serialize_state(snapshot, since, compact), compact)
+    return _state_headers(response, _state_etag(snapshot.game.version, compact))
+
+
+async def game_events(request, game_id):
+    """
+    Stream live game updates as Server-Sent Events.
+    
+    dont_b_mad.asgi serves this URL before Django sees it (game.live); the
+    view answers when Django's ASGI handler is used on its own.
+    """
+    if not await live.game_exists(game_id):
+        raise Http404('No Game matches the given query.')
+    
+    # Streaming needs the ASGI server; WSGI clients keep polling /state/
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    
+    response = StreamingHttpResponse(live.event_stream(game_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def game_replay(request, game_id):
+    """Stream the journal of a game as newline-delimited JSON (state after every event)"""
+    get_object_or_404(Game.objects.using(shards.db_for_game(game_id)), id=game_id)
+    try:
+        events = journal.replay_events(game_id)
+    except journal.JournalError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    
+    lines = (json.dumps(event) + '\n' for event in events)
+    return StreamingHttpResponse(lines, content_type='application/x-ndjson')
 
 
 @require_POST
 def quit_game(request, game_id):
     """End/quit the current game"""
     try:
-        game = get_object_or_404(Game, id=game_id)
+        db = shards.db_for_game(game_id)
+        game = get_object_or_404(Game.objects.using(db), id=game_id)
         
-        # Mark game as finished
-        game.status = 'finished'
-        game.save()
+        # Mark game as finished, bumping the version so in-flight turns are rejected
+        with transaction.atomic(using=db):
+            Game.objects.using(db).filter(id=game.id).update(status='finished', version=F('version') + 1)
+            game.refresh_from_db(fields=['status', 'version'])
+            journal.record(game, 'quit', game.current_player_index)
+        broker.publish(game.id, {'type': 'quit', 'status': 'finished', 'version': game.version})
         
         return JsonResponse({
             'success': True,
@@ -308,3 +531,15 @@ def quit_game(request, game_id):
             'error': str(e)
         }, status=400)
 
+
+def metrics(request):
+    """Request metrics of this process in the Prometheus text format (404 unless enabled)"""
+    config = request_metrics.metrics_settings()
+    if not config['ENABLED']:
+        return JsonResponse({'error': 'Metrics are disabled'}, status=404)
+    
+    token = config['TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return JsonResponse({'error': 'Invalid metrics token'}, status=401)
+    
+    return HttpResponse(request_metrics.registry.render(), content_type=request_metrics.CONTENT_TYPE)
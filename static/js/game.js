@@ -9,34 +9,103 @@ const currencyImages = {
     'yellow': '/static/images/liri/5kr.jpg'
 };
 
-// Team piece images - each team has 4 unique pieces
+// Team piece images - each team has 4 unique pieces (paths under static/images)
 const teamPieceImages = {
     'red': [
-        '/static/images/team1/Leonardo.jpg',
-        '/static/images/team1/raph.webp',
-        '/static/images/team1/doni.jpeg',
-        '/static/images/team1/mickey.png'
+        'team1/Leonardo.jpg',
+        'team1/raph.webp',
+        'team1/doni.jpeg',
+        'team1/mickey.png'
     ],
     'blue': [
-        '/static/images/team2/hegel.jpeg',
-        '/static/images/team2/karl marx.jpeg',
-        '/static/images/team2/nietzsche.jpg',
-        '/static/images/team2/Schopenhauer_by_Jules_Lunteschütz.jpg'
+        'team2/hegel.jpeg',
+        'team2/karl marx.jpeg',
+        'team2/nietzsche.jpg',
+        'team2/Schopenhauer_by_Jules_Lunteschütz.jpg'
     ],
     'green': [
-        '/static/images/team3/Beethoven.jpg',
-        '/static/images/team3/liszt.jpg',
-        '/static/images/team3/schumann.jpg',
-        '/static/images/team3/todor_kolev.jpg'
+        'team3/Beethoven.jpg',
+        'team3/liszt.jpg',
+        'team3/schumann.jpg',
+        'team3/todor_kolev.jpg'
     ],
     'yellow': [
-        '/static/images/team4/bengal.jpg',
-        '/static/images/team4/black.jpeg',
-        '/static/images/team4/siberian_tiger.jpg',
-        '/static/images/team4/white-tiger-Bengal.webp'
+        'team4/bengal.jpg',
+        'team4/black.jpeg',
+        'team4/siberian_tiger.jpg',
+        'team4/white-tiger-Bengal.webp'
     ]
 };
 
+// Compact wire format (game/snapshot.py): pieces as [id, seat, position, in_home, piece_number]
+const COMPACT_MEDIA_TYPE = 'application/vnd.mensch.compact+json';
+
+// Expand compact pieces into the objects the JSON format sends
+function decodePieces(pieces, colors) {
+    return pieces.map(([id, seat, position, inHome, pieceNumber]) => ({
+        id: id,
+        player_color: colors[seat],
+        position: position,
+        in_home: inHome === 1,
+        piece_number: pieceNumber,
+    }));
+}
+
+// Read a game response in either format; compact pieces come back as objects
+async function readGameData(response) {
+    const data = await response.json();
+    if ((response.headers.get('Content-Type') || '').startsWith(COMPACT_MEDIA_TYPE)) {
+        ['pieces', 'all_pieces'].forEach(key => {
+            if (data[key]) {
+                data[key] = decodePieces(data[key], data.colors);
+            }
+        });
+    }
+    return data;
+}
+
+// Right-sized variants of the images (game/images.py), passed in by the board page
+function imageVariantUrls(path, use) {
+    const variants = (typeof imageVariants !== 'undefined' && imageVariants[path]) || {};
+    return variants[use] || {};
+}
+
+// URL of the WebP variant of an image, or of the original image
+function imageUrl(path, use = 'token') {
+    return imageVariantUrls(path, use).webp || `/static/images/${path}`;
+}
+
+// Show frame `index` of a sprite sheet (a row of square cells) as the element's background
+function applySprite(element, name, index) {
+    const sheet = (typeof spriteSheets !== 'undefined' && spriteSheets[name]) || null;
+    if (!sheet || index < 0 || index >= sheet.frames.length) {
+        return false;
+    }
+    const count = sheet.frames.length;
+    element.style.backgroundImage = `url('${sheet.webp}')`;
+    if (sheet.avif) {
+        // Ignored by browsers without image-set() type() support, which keep the WebP
+        element.style.backgroundImage = `image-set(url('${sheet.avif}') type('image/avif'), url('${sheet.webp}') type('image/webp'))`;
+    }
+    element.style.backgroundSize = `${count * 100}% 100%`;
+    element.style.backgroundPosition = `${count > 1 ? index / (count - 1) * 100 : 0}% 0`;
+    return true;
+}
+
+// Show a dice face: a sprite frame (no request) or, without the sheet, the face image
+function setDiceFace(element, value) {
+    if (!applySprite(element, 'dice', value - 1)) {
+        element.style.backgroundImage = `url('${imageUrl(`dice/dice${value}.png`, 'dice')}')`;
+    }
+}
+
+// <picture> letting the browser choose AVIF, then WebP, then the original
+function pictureHTML(path, use, alt) {
+    const urls = imageVariantUrls(path, use);
+    const sources = urls.avif ? `<source srcset="${urls.avif}" type="image/avif">` : '';
+    return `<picture>${sources}<img src="${imageUrl(path, use)}" alt="${alt}"></picture>`;
+}
+
 // Real positions from hardware project (SkaliranePozicije.txt)
 // Scaled 4x from 150mm to 600px
 const boardPositions = {
@@ -151,14 +220,16 @@ function createPieceElement(piece) {
     pieceElement.id = `piece-${piece.id}`;
     pieceElement.dataset.pieceId = piece.id;
     
-    // Use team character image as background
-    if (piece.team_image) {
-        pieceElement.style.backgroundImage = `url('/static/images/${piece.team_image}')`;
-    } else {
-        // Fallback to team images array if not in piece data
-        const teamImages = teamPieceImages[piece.player_color];
-        if (teamImages && teamImages[piece.piece_number]) {
-            pieceElement.style.backgroundImage = `url('${teamImages[piece.piece_number]}')`;
+    // Use team character image as background: a frame of the team's sprite sheet, or the single image
+    if (!applySprite(pieceElement, `team-${piece.player_color}`, piece.piece_number)) {
+        if (piece.team_image) {
+            pieceElement.style.backgroundImage = `url('${imageUrl(piece.team_image)}')`;
+        } else {
+            // Fallback to team images array if not in piece data
+            const teamImages = teamPieceImages[piece.player_color];
+            if (teamImages && teamImages[piece.piece_number]) {
+                pieceElement.style.backgroundImage = `url('${imageUrl(teamImages[piece.piece_number])}')`;
+            }
         }
     }
     
@@ -207,6 +278,25 @@ function updatePiecePosition(pieceId, position, playerColor, pieceNumber) {
     }
 }
 
+// Apply a piece from a server response to the local state and the board
+function applyPieceUpdate(piece) {
+    const pieceData = piecesData.find(p => p.id === piece.id);
+    if (pieceData) {
+        pieceData.position = piece.position;
+        pieceData.in_home = piece.in_home;
+    }
+    updatePiecePosition(piece.id, piece.position, piece.player_color,
+                        pieceData ? pieceData.piece_number : 0);
+}
+
+// Highlight the pieces that can move with the current roll
+function highlightMovablePieces(pieceIds) {
+    movablePieces = pieceIds;
+    document.querySelectorAll('.game-piece').forEach(piece => {
+        piece.classList.toggle('movable', movablePieces.includes(parseInt(piece.dataset.pieceId)));
+    });
+}
+
 // Animate dice rolling by quickly changing images
 function animateDiceRoll(finalValue, duration = 600) {
     const diceImage = document.getElementById('dice-image');
@@ -225,19 +315,19 @@ function animateDiceRoll(finalValue, duration = 600) {
     
     const rollInterval = setInterval(() => {
         const randomFace = Math.floor(Math.random() * 6) + 1;
-        diceImage.src = `/static/images/dice/dice${randomFace}.png`;
+        setDiceFace(diceImage, randomFace);
         currentIteration++;
         
         if (currentIteration >= iterations) {
             clearInterval(rollInterval);
             // Show final result
-            diceImage.src = `/static/images/dice/dice${finalValue}.png`;
+            setDiceFace(diceImage, finalValue);
             diceImage.classList.remove('rolling');
         }
     }, interval);
 }
 
-// Roll dice
+// Roll dice: one turn request; the server rolls again or passes when no piece can move
 async function rollDice() {
     const rollButton = document.getElementById('roll-button');
     const diceImage = document.getElementById('dice-image');
@@ -246,15 +336,27 @@ async function rollDice() {
     rollButton.disabled = true;
     
     try {
-        const response = await fetch(`/game/${gameId}/roll/`, {
+        const response = await fetch(`/game/${gameId}/turn/`, {
             method: 'POST',
             headers: {
                 'X-CSRFToken': csrfToken,
-                'Content-Type': 'application/json',
+                'Accept': COMPACT_MEDIA_TYPE,
             }
         });
         
-        const data = await response.json();
+        const data = await readGameData(response);
+        
+        // Rejected roll (e.g. another player's request was committed first)
+        if (!response.ok) {
+            addLogMessage(data.error || 'Could not roll the dice');
+            rollButton.disabled = false;
+            // The game moved on without this page (other players or computer turns)
+            if (response.status === 409) {
+                resyncState();
+            }
+            return;
+        }
+        stateVersion = Math.max(stateVersion, data.version);
         
         // Animate the dice roll
         animateDiceRoll(data.dice_value);
@@ -264,35 +366,32 @@ async function rollDice() {
             diceValueDisplay.textContent = data.dice_value;
             diceValueDisplay.classList.remove('hidden');
             
-            currentPlayerColor = data.current_player_color;
-            movablePieces = data.movable_pieces;
-            
-            addLogMessage(`${data.current_player} rolled a ${data.dice_value}`);
+            addLogMessage(`${data.player} rolled a ${data.dice_value}`);
             
             // Highlight movable pieces
-            document.querySelectorAll('.game-piece').forEach(piece => {
-                piece.classList.remove('movable');
-            });
+            highlightMovablePieces(data.movable_pieces);
             
-            movablePieces.forEach(pieceId => {
-                const pieceElement = document.getElementById(`piece-${pieceId}`);
-                if (pieceElement) {
-                    pieceElement.classList.add('movable');
-                }
-            });
+            if (movablePieces.length > 0) {
+                currentPlayerColor = data.current_player_color;
+                return;
+            }
+            if (data.tries_left > 0) {
+                addLogMessage(`No valid moves. Roll again (${data.tries_left} left)!`);
+                rollButton.disabled = false;
+                return;
+            }
             
-            if (movablePieces.length === 0) {
-                addLogMessage('No valid moves available. Next turn!');
-                setTimeout(() => {
-                    fetch(`/game/${gameId}/state/`)
-                        .then(res => res.json())
-                        .then(state => {
-                            updateCurrentPlayer(state.current_player, state.current_player_color);
-                            diceValueDisplay.classList.add('hidden');
-                            rollButton.disabled = false;
-                        });
-                }, 2000);
+            // The server passed the turn, computer players may have moved since
+            addLogMessage('No valid moves available. Next turn!');
+            (data.all_pieces || []).forEach(applyPieceUpdate);
+            (data.bot_turns || []).forEach(logBotTurn);
+            if (data.game_over) {
+                showWinnerModal(data.winner);
+                return;
             }
+            updateCurrentPlayer(data.current_player, data.current_player_color);
+            diceValueDisplay.classList.add('hidden');
+            rollButton.disabled = false;
         }, 650); // Wait for animation to complete
         
     } catch (error) {
@@ -314,10 +413,11 @@ async function handlePieceClick(pieceId) {
             headers: {
                 'X-CSRFToken': csrfToken,
                 'Content-Type': 'application/json',
+                'Accept': COMPACT_MEDIA_TYPE,
             }
         });
         
-        const data = await response.json();
+        const data = await readGameData(response);
         
         if (data.success) {
             // Check for special task
@@ -326,15 +426,13 @@ async function handlePieceClick(pieceId) {
             }
             
             // Update all pieces
-            data.all_pieces.forEach(piece => {
-                const pieceData = piecesData.find(p => p.id === piece.id);
-                if (pieceData) {
-                    pieceData.position = piece.position;
-                    pieceData.in_home = piece.in_home;
-                }
-                updatePiecePosition(piece.id, piece.position, piece.player_color, 
-                                  pieceData ? pieceData.piece_number : 0);
-            });
+            stateVersion = Math.max(stateVersion, data.version);
+            if (data.all_pieces) {
+                data.all_pieces.forEach(applyPieceUpdate);
+            }
+            
+            // Computer players moved right after this move
+            (data.bot_turns || []).forEach(logBotTurn);
             
             // Clear movable highlights
             document.querySelectorAll('.game-piece').forEach(piece => {
@@ -358,12 +456,139 @@ async function handlePieceClick(pieceId) {
                 // Enable roll button
                 document.getElementById('roll-button').disabled = false;
             }
+        } else if (data.error) {
+            addLogMessage(data.error);
+            if (response.status === 409) {
+                resyncState();
+            }
         }
     } catch (error) {
         console.error('Error moving piece:', error);
     }
 }
 
+// Log a turn played by a computer player
+function logBotTurn(turn) {
+    logRolledTurn(turn, '🤖 ');
+}
+
+// Log a roll that ended with a move or a pass (prefix marks computer players)
+function logRolledTurn(turn, prefix = '') {
+    if (turn.piece_id === null) {
+        addLogMessage(`${prefix}${turn.player} rolled a ${turn.dice_value} and cannot move`);
+    } else {
+        addLogMessage(`${prefix}${turn.player} rolled a ${turn.dice_value} and moved`);
+    }
+}
+
+// Subscribe to updates pushed by the server for moves made in other browsers
+function connectGameEvents() {
+    if (!window.EventSource) {
+        return;
+    }
+    const events = new EventSource(`/game/${gameId}/events/`);
+    events.onmessage = (message) => applyGameEvent(JSON.parse(message.data));
+    // Events sent while the stream was down are lost, catch up once it is back
+    let reconnecting = false;
+    events.onerror = () => {
+        reconnecting = true;
+    };
+    events.onopen = () => {
+        if (reconnecting) {
+            reconnecting = false;
+            resyncState();
+        }
+    };
+}
+
+// Catch up with the server after missed events: fetch the pieces changed since stateVersion
+async function resyncState() {
+    try {
+        const response = await fetch(`/game/${gameId}/state/?since=${stateVersion}`, {
+            headers: {'Accept': COMPACT_MEDIA_TYPE}
+        });
+        if (!response.ok) {
+            return;
+        }
+        const state = await readGameData(response);
+        if (state.version <= stateVersion) {
+            return;
+        }
+        stateVersion = state.version;
+        state.pieces.forEach(applyPieceUpdate);
+        highlightMovablePieces([]);
+        
+        if (state.status === 'finished') {
+            if (state.winner) {
+                showWinnerModal(state.winner);
+            } else {
+                addLogMessage('The game has been ended.');
+            }
+            document.getElementById('roll-button').disabled = true;
+            return;
+        }
+        updateCurrentPlayer(state.current_player, state.current_player_color);
+        const diceValueDisplay = document.getElementById('dice-value-display');
+        if (state.dice_value) {
+            setDiceFace(document.getElementById('dice-image'), state.dice_value);
+            diceValueDisplay.textContent = state.dice_value;
+            diceValueDisplay.classList.remove('hidden');
+        } else {
+            diceValueDisplay.classList.add('hidden');
+            document.getElementById('roll-button').disabled = false;
+        }
+    } catch (error) {
+        console.error('Error fetching game state:', error);
+    }
+}
+
+// Apply a pushed game event (roll, move or quit)
+function applyGameEvent(event) {
+    if (event.type === 'quit') {
+        addLogMessage('The game has been ended.');
+        document.getElementById('roll-button').disabled = true;
+        return;
+    }
+    
+    // Skip events this page already applied from its own responses
+    if (event.version <= stateVersion) {
+        return;
+    }
+    // An event was missed (dropped for a slow connection): the delta would leave the board wrong
+    if (event.version > stateVersion + 1) {
+        resyncState();
+        return;
+    }
+    stateVersion = event.version;
+    event.pieces.forEach(applyPieceUpdate);
+    
+    const diceValueDisplay = document.getElementById('dice-value-display');
+    if (event.type === 'roll') {
+        setDiceFace(document.getElementById('dice-image'), event.dice_value);
+        diceValueDisplay.textContent = event.dice_value;
+        diceValueDisplay.classList.remove('hidden');
+        addLogMessage(`${event.current_player} rolled a ${event.dice_value}`);
+        highlightMovablePieces(event.movable_pieces);
+        return;
+    }
+    
+    highlightMovablePieces([]);
+    if (event.rolled) {
+        const turn = {player: event.player, dice_value: event.rolled, piece_id: event.moved_piece ?? null};
+        logRolledTurn(turn, event.is_bot ? '🤖 ' : '');
+    }
+    if (event.status === 'finished') {
+        showWinnerModal(event.winner || event.current_player);
+        return;
+    }
+    updateCurrentPlayer(event.current_player, event.current_player_color);
+    addLogMessage(event.type === 'pass'
+        ? `${event.current_player}'s turn.`
+        : `Piece moved! ${event.current_player}'s turn.`);
+    diceValueDisplay.classList.add('hidden');
+    document.getElementById('roll-button').disabled = false;
+}
+
 // Update current player display
 function updateCurrentPlayer(playerName, playerColor) {
     document.getElementById('current-player-name').textContent = playerName;
@@ -409,7 +634,7 @@ function showSpecialTask(task) {
     
     // Build image HTML if image exists
     const imageHTML = task.image ? 
-        `<div class="task-image"><img src="/static/images/${task.image}" alt="${task.title}"></div>` : 
+        `<div class="task-image">${pictureHTML(task.image, 'card', task.title)}</div>` : 
         `<div class="task-icon">${getTaskIcon(task.type)}</div>`;
     
     overlay.innerHTML = `
@@ -466,6 +691,7 @@ function getTaskIcon(type) {
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', () => {
     initializeBoard();
+    connectGameEvents();
     
     // Highlight current player
     const currentCard = document.getElementById(`player-card-${currentPlayerColor}`);
@@ -0,0 +1,72 @@
+// Don't b mad, man! - Lobby infinite scroll
+// Older games are fetched from /lobby/ (one page per request) when the
+// "Older games" link scrolls into view; without JavaScript the link pages.
+
+function lobbyCard(game) {
+    // Same markup as templates/game/partials/lobby_game.html
+    const card = document.createElement('div');
+    card.className = 'game-card';
+
+    const info = document.createElement('div');
+    info.className = 'game-info';
+    const title = document.createElement('h3');
+    title.textContent = `Game #${game.id}`;
+    const status = document.createElement('span');
+    status.className = `game-status status-${game.status}`;
+    status.textContent = game.status_display;
+    const created = document.createElement('p');
+    created.className = 'game-time';
+    created.textContent = `Created: ${game.created_display}`;
+    const players = document.createElement('p');
+    players.className = 'game-players';
+    players.textContent = `Players: ${game.player_count}` + (game.current_player ? ` · Turn: ${game.current_player}` : '');
+    info.append(title, status, created, players);
+
+    const join = document.createElement('a');
+    join.href = game.url;
+    join.className = 'btn-secondary';
+    join.textContent = 'Join Game';
+
+    card.append(info, join);
+    return card;
+}
+
+function initLobby() {
+    const list = document.querySelector('.games-list');
+    const more = document.getElementById('lobby-more');
+    if (!list || !more || !('IntersectionObserver' in window)) {
+        return;
+    }
+
+    let loading = false;
+    const observer = new IntersectionObserver(async (entries) => {
+        if (loading || !entries.some(entry => entry.isIntersecting)) {
+            return;
+        }
+        loading = true;
+        try {
+            const response = await fetch(`/lobby/?before=${encodeURIComponent(more.dataset.cursor)}`);
+            if (!response.ok) {
+                throw new Error(`Lobby request failed with ${response.status}`);
+            }
+            const data = await response.json();
+            data.games.forEach(game => list.appendChild(lobbyCard(game)));
+            if (data.next_cursor) {
+                more.dataset.cursor = data.next_cursor;
+                more.href = `?before=${encodeURIComponent(data.next_cursor)}`;
+            } else {
+                observer.disconnect();
+                more.remove();
+            }
+        } catch (error) {
+            // Leave the link for the user to page manually
+            console.error('Error loading games:', error);
+            observer.disconnect();
+        } finally {
+            loading = false;
+        }
+    }, {rootMargin: '200px'});
+    observer.observe(more);
+}
+
+document.addEventListener('DOMContentLoaded', initLobby);